@@ -2,11 +2,13 @@ import os
 import json
 import uuid
 import logging
-from datetime import datetime, timezone
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
+from auth import current_user
+from analytics import analytics_payload, stats_payload
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
@@ -19,34 +21,6 @@ def set_db(database):
     global db
     db = database
 
-async def get_current_user(request: Request) -> dict:
-    session_token = request.cookies.get("session_token")
-    if not session_token:
-        auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            session_token = auth_header[7:]
-    if not session_token:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    session_doc = await db.user_sessions.find_one(
-        {"session_token": session_token}, {"_id": 0}
-    )
-    if not session_doc:
-        raise HTTPException(status_code=401, detail="Invalid session")
-    expires_at = session_doc["expires_at"]
-    if isinstance(expires_at, str):
-        expires_at = datetime.fromisoformat(expires_at)
-    if expires_at.tzinfo is None:
-        expires_at = expires_at.replace(tzinfo=timezone.utc)
-    if expires_at < datetime.now(timezone.utc):
-        raise HTTPException(status_code=401, detail="Session expired")
-    user_doc = await db.users.find_one(
-        {"user_id": session_doc["user_id"]}, {"_id": 0, "password_hash": 0}
-    )
-    if not user_doc:
-        raise HTTPException(status_code=401, detail="User not found")
-    return user_doc
-
-
 SYSTEM_MESSAGE = (
     "You are a friendly trainspotting analytics assistant. "
     "Write concise, insightful summaries about a user's trainspotting activity. "
@@ -74,14 +48,15 @@ def _make_chat(session_id: str):
 
 
 @ai_router.post("/analytics-summary")
-async def generate_analytics_summary(request: Request):
-    user = await get_current_user(request)
+async def generate_analytics_summary(request: Request, user: dict = Depends(current_user)):
     user_id = user["user_id"]
 
     body = await request.json()
-    analytics = body.get("analytics", {})
-    stats = body.get("stats", {})
     user_name = body.get("user_name", "Trainspotter")
+    # The same cached payloads the dashboard was just served; whatever the
+    # client sends back in "analytics"/"stats" is not trusted
+    _, analytics = await analytics_payload(user_id)
+    _, stats = await stats_payload(user_id)
 
     prompt = build_prompt(analytics, stats, user_name)
     chat_session_id = f"analytics-{user_id}-{uuid.uuid4().hex[:8]}"
@@ -107,9 +82,7 @@ class ReplyRequest(BaseModel):
 
 
 @ai_router.post("/analytics-reply")
-async def analytics_reply(payload: ReplyRequest, request: Request):
-    await get_current_user(request)
-
+async def analytics_reply(payload: ReplyRequest, user: dict = Depends(current_user)):
     if not payload.message.strip():
         raise HTTPException(status_code=400, detail="Message cannot be empty")
 
@@ -0,0 +1,480 @@
+"""
+Per-user sighting statistics, kept as one rollup document per user in
+user_analytics and served by /sightings/stats and /sightings/analytics with a
+single find_one:
+
+    {"user_id", "total", "last_sighting",
+     "dates": {"2024-05-01": 3, ...},          # sightings per day of sighted_at
+     "hours": {"7": 2, ...},                   # per hour
+     "train_type": {...}, "traction_type": {...}, "operator": {...},
+     "location": {...}, "train_number": {...}} # per value
+
+Writes keep it current with $inc (record_created / record_deleted /
+record_updated), each also bumping `version`. The version is part of the
+ETag of both responses and of the in-memory payload cache (analytics_cache.py),
+so an unchanged rollup answers 304 or straight from memory. Daily and monthly
+trends, weekday buckets and streaks are all derived from `dates`. Days and
+hours are counted from the typed sighted_at/hour fields (sighted_fields). Counters that drop to zero stay until the next rebuild;
+readers ignore them. Value keys are escaped, since field names can't contain
+"." or "$".
+
+A missing rollup (users from before rollups) is rebuilt from one $facet
+aggregation on first read. A rebuild only replaces the rollup if its version
+hasn't moved while counting, so it never discards a concurrent $inc. To
+reconcile drift across all users:
+
+    python analytics.py --rebuild [--user USER_ID]
+"""
+import os
+import re
+import asyncio
+import hashlib
+import logging
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+from urllib.parse import unquote
+
+import numpy as np
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from dotenv import load_dotenv
+
+from analytics_cache import analytics_cache
+from platform_stats import platform_stats
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DAY_NAMES = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+EPOCH = date(1970, 1, 1)
+
+# Counted per value; missing values count as "Unknown", except traction_type
+# where they aren't counted at all
+DIMENSIONS = ["train_type", "traction_type", "operator", "location", "train_number"]
+
+# rebuild_user retries this often when writes keep changing the rollup under it
+REBUILD_ATTEMPTS = 5
+
+# sighting_time is "HH:MM"
+CLOCK = re.compile(r"^(\d{1,2}):(\d{2})")
+# Zero-padded YYYY-MM-DD, parsed in bulk by NumPy (year 0000 isn't a strptime year)
+PLAIN_DAY = re.compile(r"(?!0000)[0-9]{4}-[0-9]{2}-[0-9]{2}")
+
+db = None
+
+def set_db(database):
+    global db
+    db = database
+
+
+def escape_key(value: str) -> str:
+    return value.replace("%", "%25").replace(".", "%2E").replace("$", "%24")
+
+
+def dimension_key(field: str, value) -> Optional[str]:
+    if not value:
+        return None if field == "traction_type" else "Unknown"
+    return str(value)
+
+
+def sighted_fields(sighting_date, sighting_time) -> dict:
+    """Typed copies of the free-form sighting_date/sighting_time, stored on every
+    sighting: sighted_at (UTC), hour, weekday (Mon=0) and year_month ("YYYY-MM").
+    The rollups count days and hours from these, so this is the only parser of
+    either string. A date that doesn't parse leaves sighted_at, weekday and
+    year_month None; a time that doesn't parse leaves sighted_at at midnight
+    and hour None."""
+    fields = {"sighted_at": None, "hour": None, "weekday": None, "year_month": None}
+    match = CLOCK.match(sighting_time or "")
+    if match and int(match.group(1)) < 24 and int(match.group(2)) < 60:
+        fields["hour"] = int(match.group(1))
+    try:
+        day = datetime.strptime(sighting_date or "", "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return fields
+    fields.update(sighted_at=day, weekday=day.weekday(), year_month=day.strftime("%Y-%m"))
+    if fields["hour"] is not None:
+        fields["sighted_at"] = day.replace(hour=fields["hour"], minute=int(match.group(2)))
+    return fields
+
+
+def typed_fields(sighting: dict) -> dict:
+    """The sighting's stored sighted_fields; derived on the fly for sightings
+    that predate them (until scripts/migrate_sighted_at.py has run)."""
+    if "sighted_at" in sighting:
+        return sighting
+    return sighted_fields(sighting.get("sighting_date"), sighting.get("sighting_time"))
+
+
+def day_key(sighted_at: Optional[datetime]) -> Optional[str]:
+    return sighted_at.strftime("%Y-%m-%d") if sighted_at else None
+
+
+def counters(sighting: dict) -> Counter:
+    """The rollup counters one sighting contributes to, as dotted paths."""
+    paths = Counter({"total": 1})
+    typed = typed_fields(sighting)
+    day = day_key(typed.get("sighted_at"))
+    if day is not None:
+        paths[f"dates.{day}"] += 1
+    if typed.get("hour") is not None:
+        paths[f"hours.{typed['hour']}"] += 1
+    for field in DIMENSIONS:
+        key = dimension_key(field, sighting.get(field))
+        if key is not None:
+            paths[f"{field}.{escape_key(key)}"] += 1
+    return paths
+
+
+async def _apply(user_id: str, inc: dict, set_fields: dict = None, max_fields: dict = None):
+    # No upsert: a user without a rollup gets a full rebuild on first read
+    # instead of a document that only counts recent changes. A pending
+    # placeholder (see rebuild_user) takes the $inc so the rebuild notices it
+    inc = {path: n for path, n in inc.items() if n}
+    if not inc and not set_fields and not max_fields:
+        return
+    update = {
+        "$set": {**(set_fields or {}), "updated_at": datetime.now(timezone.utc)},
+        "$inc": {**inc, "version": 1},
+    }
+    if max_fields:
+        update["$max"] = max_fields
+    await db.user_analytics.update_one({"user_id": user_id}, update)
+
+
+async def record_created(sighting: dict):
+    await _apply(sighting["user_id"], counters(sighting), max_fields={"last_sighting": sighting["created_at"]})
+
+
+async def record_updated(old: dict, new: dict):
+    inc = counters(new)
+    inc.subtract(counters(old))
+    await _apply(new["user_id"], inc)
+
+
+async def record_deleted(sighting: dict):
+    """Call after the sighting is gone, so last_sighting moves to the next newest."""
+    user_id = sighting["user_id"]
+    latest = await db.sightings.find_one(
+        {"user_id": user_id}, {"_id": 0, "created_at": 1}, sort=[("created_at", -1)]
+    )
+    inc = {path: -n for path, n in counters(sighting).items()}
+    await _apply(user_id, inc, set_fields={"last_sighting": latest["created_at"] if latest else None})
+
+
+def rebuild_pipeline(user_id: str) -> list:
+    """Raw per-value counts; compute_rollup() normalises them exactly as counters() does.
+    Days and hours come from the typed fields; sightings that predate them are
+    grouped by their raw strings and parsed by compute_rollup()."""
+    typed = {"sighted_at": {"$exists": True}}
+    return [
+        {"$match": {"user_id": user_id}},
+        {"$project": {
+            "_id": 0, "created_at": 1, "sighted_at": 1, "hour": 1, "sighting_date": 1, "sighting_time": 1,
+            **{field: 1 for field in DIMENSIONS},
+        }},
+        {"$facet": {
+            "totals": [{"$group": {"_id": None, "total": {"$sum": 1}, "last_sighting": {"$max": "$created_at"}}}],
+            "days": [
+                {"$match": {"sighted_at": {"$type": "date"}}},
+                {"$group": {"_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$sighted_at"}}, "count": {"$sum": 1}}},
+            ],
+            "hours": [{"$match": typed}, {"$group": {"_id": "$hour", "count": {"$sum": 1}}}],
+            "untyped": [
+                {"$match": {"sighted_at": {"$exists": False}}},
+                {"$group": {"_id": {"date": "$sighting_date", "time": "$sighting_time"}, "count": {"$sum": 1}}},
+            ],
+            **{field: [{"$group": {"_id": f"${field}", "count": {"$sum": 1}}}] for field in DIMENSIONS},
+        }},
+    ]
+
+
+def compute_rollup(user_id: str, facets: dict) -> dict:
+    totals = facets["totals"][0] if facets["totals"] else {}
+    rollup = {
+        "user_id": user_id,
+        "total": totals.get("total", 0),
+        "last_sighting": totals.get("last_sighting"),
+        "dates": Counter(),
+        "hours": Counter(),
+        **{field: Counter() for field in DIMENSIONS},
+    }
+    for row in facets["days"]:
+        if row["_id"]:
+            rollup["dates"][row["_id"]] += row["count"]
+    for row in facets["hours"]:
+        if row["_id"] is not None:
+            rollup["hours"][str(row["_id"])] += row["count"]
+    for row in facets["untyped"]:
+        typed = sighted_fields(row["_id"].get("date"), row["_id"].get("time"))
+        day = day_key(typed["sighted_at"])
+        if day is not None:
+            rollup["dates"][day] += row["count"]
+        if typed["hour"] is not None:
+            rollup["hours"][str(typed["hour"])] += row["count"]
+    for field in DIMENSIONS:
+        for row in facets[field]:
+            key = dimension_key(field, row["_id"])
+            if key is not None:
+                rollup[field][escape_key(key)] += row["count"]
+    return {name: dict(value) if isinstance(value, Counter) else value for name, value in rollup.items()}
+
+
+async def rebuild_user(user_id: str) -> dict:
+    """Recount a user's rollup from their sightings. The version is read before
+    aggregating and the recount only written if it is still the same, so a
+    counted write landing in between is never overwritten; the rebuild retries.
+    A user without a rollup first gets a pending placeholder, so writes counted
+    while the aggregation runs land on it and bump its version too."""
+    for _ in range(REBUILD_ATTEMPTS):
+        current = await db.user_analytics.find_one({"user_id": user_id}, {"_id": 0, "version": 1})
+        if current is None:
+            current = {"version": 1}
+            try:
+                await db.user_analytics.insert_one({"user_id": user_id, "pending": True, **current})
+            except DuplicateKeyError:
+                continue
+        facets = await db.sightings.aggregate(rebuild_pipeline(user_id)).to_list(1)
+        now = datetime.now(timezone.utc)
+        rollup = {**compute_rollup(user_id, facets[0]), "rebuilt_at": now, "updated_at": now}
+        doc = await db.user_analytics.find_one_and_update(
+            {"user_id": user_id, "version": current.get("version")},
+            {"$set": rollup, "$unset": {"pending": ""}, "$inc": {"version": 1}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc is not None:
+            return doc
+    logger.warning(f"Rollup for {user_id} kept changing; rebuild skipped")
+    doc = await db.user_analytics.find_one({"user_id": user_id}, {"_id": 0})
+    if doc is None or doc.get("pending"):
+        # A placeholder only counts recent writes; serve the last recount
+        # unsaved, and the next read tries again
+        return {**rollup, "version": current.get("version")}
+    # Its counters are current, only unreconciled
+    return doc
+
+
+async def load_rollup(user_id: str) -> dict:
+    rollup = await db.user_analytics.find_one({"user_id": user_id}, {"_id": 0})
+    if rollup is None or rollup.get("pending"):
+        rollup = await rebuild_user(user_id)
+    return rollup
+
+
+def counts(section: Optional[dict]) -> dict:
+    """Unescaped keys with a positive count."""
+    return {unquote(key): n for key, n in (section or {}).items() if n > 0}
+
+
+def top(section: Optional[dict], n: int) -> List[dict]:
+    ranked = sorted(counts(section).items(), key=lambda item: (-item[1], item[0]))
+    return [{"name": name, "count": count} for name, count in ranked[:n]]
+
+
+def build_stats(rollup: dict, current_month: str) -> dict:
+    dates = counts(rollup.get("dates"))
+    return {
+        "total_sightings": rollup.get("total", 0),
+        "this_month": sum(n for date, n in dates.items() if date.startswith(current_month)),
+        "unique_locations": len(counts(rollup.get("location"))),
+        "unique_trains": len(counts(rollup.get("train_number"))),
+        "last_sighting": rollup.get("last_sighting") if rollup.get("total") else None,
+        "top_train_types": top(rollup.get("train_type"), 5),
+        "top_operators": top(rollup.get("operator"), 5),
+        "top_locations": top(rollup.get("location"), 5),
+    }
+
+
+def recent_days(now: datetime) -> List[str]:
+    """The last 30 days, oldest first."""
+    return [(now - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(29, -1, -1)]
+
+
+def recent_months(now: datetime) -> List[str]:
+    """The last 12 months (30-day steps), oldest first."""
+    return [(now - timedelta(days=i * 30)).strftime("%Y-%m") for i in range(11, -1, -1)]
+
+
+def date_columns(dates: dict) -> Tuple[np.ndarray, np.ndarray]:
+    """The sighting dates that are real days, as sorted unique day numbers (days
+    since 1970-01-01) with their counts. A date counts if strptime("%Y-%m-%d")
+    accepts it, which includes dates without zero padding ("2024-5-1")."""
+    plain = [key for key in dates if PLAIN_DAY.fullmatch(key)]
+    try:
+        plain_days = np.array(plain, dtype="datetime64[D]").astype(np.int64)
+    except ValueError:
+        # Some date looks right but isn't a real day (2024-02-30)
+        plain = [key for key in plain if day_number(key) is not None]
+        plain_days = np.array(plain, dtype="datetime64[D]").astype(np.int64)
+    # The rest are rare; parse them one by one
+    other = {key: day_number(key) for key in dates if not PLAIN_DAY.fullmatch(key)}
+    other = {key: day for key, day in other.items() if day is not None}
+    keys = plain + list(other)
+    days = np.concatenate([plain_days, np.fromiter(other.values(), dtype=np.int64, count=len(other))])
+    counts = np.fromiter((dates[key] for key in keys), dtype=np.int64, count=len(keys))
+    # "2024-5-1" and "2024-05-01" are the same day
+    days, slot = np.unique(days, return_inverse=True)
+    return days, np.bincount(slot, weights=counts, minlength=len(days)).astype(np.int64)
+
+
+def day_number(value: str) -> Optional[int]:
+    try:
+        return (datetime.strptime(value, "%Y-%m-%d").date() - EPOCH).days
+    except ValueError:
+        return None
+
+
+def weekday_histogram(days: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Sightings per weekday, Monday first (day 0 was a Thursday)."""
+    return np.bincount((days + 3) % 7, weights=counts, minlength=7).astype(np.int64)
+
+
+def month_totals(days: np.ndarray, counts: np.ndarray, months: List[str]) -> List[int]:
+    """Sightings in each of `months` ("YYYY-MM"; may repeat)."""
+    wanted, slot = np.unique(np.array(months, dtype="datetime64[M]"), return_inverse=True)
+    month_numbers = days.astype("datetime64[D]").astype("datetime64[M]")
+    position = np.minimum(np.searchsorted(wanted, month_numbers), len(wanted) - 1)
+    hit = wanted[position] == month_numbers
+    totals = np.bincount(position[hit], weights=counts[hit], minlength=len(wanted))
+    return [int(totals[i]) for i in slot]
+
+
+def streaks(days: np.ndarray, now: datetime) -> dict:
+    """Current and longest run of consecutive days with a sighting. The current
+    streak counts if it reaches today or yesterday. `days` are sorted day numbers."""
+    if not len(days):
+        return {"current": 0, "longest": 0}
+    # Runs end wherever the gap to the next day isn't exactly one
+    ends = np.flatnonzero(np.diff(days) != 1)
+    runs = np.diff(np.concatenate(([-1], ends, [len(days) - 1])))
+    today = (now.date() - EPOCH).days
+    current = int(runs[-1]) if today - days[-1] in (0, 1) else 0
+    return {"current": current, "longest": int(runs.max())}
+
+
+EMPTY_ANALYTICS = {
+    "sightings_over_time": [],
+    "by_train_type": [],
+    "by_traction_type": [],
+    "by_operator": [],
+    "by_location": [],
+    "time_of_day": [],
+    "day_of_week": [],
+    "streak": {"current": 0, "longest": 0},
+    "monthly_trend": [],
+}
+
+
+def build_analytics(rollup: dict, now: datetime) -> dict:
+    if not rollup.get("total"):
+        return dict(EMPTY_ANALYTICS)
+    dates = counts(rollup.get("dates"))
+    days, day_counts = date_columns(dates)
+    hours = counts(rollup.get("hours"))
+    months = recent_months(now)
+    weekdays = weekday_histogram(days, day_counts)
+    return {
+        "sightings_over_time": [{"date": d, "count": dates.get(d, 0)} for d in recent_days(now)],
+        "monthly_trend": [{"month": m, "count": n} for m, n in zip(months, month_totals(days, day_counts, months))],
+        "by_train_type": top(rollup.get("train_type"), 10),
+        "by_traction_type": top(rollup.get("traction_type"), 10),
+        "by_operator": top(rollup.get("operator"), 10),
+        "by_location": top(rollup.get("location"), 10),
+        "time_of_day": [{"hour": h, "label": f"{h:02d}:00", "count": hours.get(str(h), 0)} for h in range(24)],
+        "day_of_week": [{"day": DAY_NAMES[i], "count": int(weekdays[i])} for i in range(7)],
+        "streak": streaks(days, now),
+    }
+
+
+def user_tag(user_id: str) -> str:
+    """Identifies the user in an ETag without exposing the id."""
+    return hashlib.sha256(user_id.encode()).hexdigest()[:16]
+
+
+async def data_version(user_id: str) -> str:
+    """Changes whenever the user's rollup does: bumped by every counted write,
+    and by rebuilds (rebuilt_at also covers a rollup that was deleted and rebuilt).
+    Versions are small numbers shared by many users, so it starts with user_tag();
+    a browser shared by two users never gets a 304 for the other one's data."""
+    doc = await db.user_analytics.find_one(
+        {"user_id": user_id}, {"_id": 0, "version": 1, "rebuilt_at": 1, "pending": 1}
+    )
+    if doc is None or doc.get("pending"):
+        doc = await rebuild_user(user_id)
+    rebuilt_at = doc.get("rebuilt_at")
+    return f"{user_tag(user_id)}.{doc.get('version', 0)}.{int(rebuilt_at.timestamp()) if rebuilt_at else 0}"
+
+
+async def _cached(user_id: str, kind: str, etag: str, build) -> Tuple[str, dict]:
+    payload = analytics_cache.get((user_id, kind), etag)
+    if payload is None:
+        # Read after the version: a concurrent write can only make the payload newer than its tag
+        payload = build(await load_rollup(user_id))
+        analytics_cache.set((user_id, kind), etag, payload)
+    return etag, payload
+
+
+async def stats_payload(user_id: str) -> Tuple[str, dict]:
+    """(ETag, /sightings/stats payload). The tag covers the user and data version
+    and the current month, which this_month depends on."""
+    month = datetime.now(timezone.utc).strftime("%Y-%m")
+    etag = f'W/"stats-{await data_version(user_id)}-{month}"'
+    return await _cached(user_id, "stats", etag, lambda rollup: build_stats(rollup, month))
+
+
+async def analytics_payload(user_id: str) -> Tuple[str, dict]:
+    """(ETag, /sightings/analytics payload). Trends and streaks depend on today's
+    date, and the payload carries the platform totals, so both are in the tag."""
+    now = datetime.now(timezone.utc)
+    platform = platform_stats.totals()
+    etag = (
+        f'W/"analytics-{await data_version(user_id)}-{now:%Y%m%d}'
+        f'-{platform["total_sightings"]}-{platform["total_users"]}"'
+    )
+    return await _cached(
+        user_id, "analytics", etag, lambda rollup: {**build_analytics(rollup, now), "platform": platform}
+    )
+
+
+def _comparable(rollup: dict) -> dict:
+    return {
+        key: counts(value) if isinstance(value, dict) else value
+        for key, value in rollup.items()
+        if key not in ("_id", "version", "rebuilt_at", "updated_at")
+    }
+
+
+async def rebuild_all(user_id: str = None) -> dict:
+    """Rebuild every user's rollup (or one user's), counting those that had drifted."""
+    result = Counter()
+    query = {"user_id": user_id} if user_id else {}
+    async for user in db.users.find(query, {"_id": 0, "user_id": 1}):
+        before = await db.user_analytics.find_one({"user_id": user["user_id"]}, {"_id": 0})
+        after = await rebuild_user(user["user_id"])
+        result["rebuilt"] += 1
+        if before is not None and not before.get("pending") and _comparable(before) != _comparable(after):
+            result["drifted"] += 1
+            logger.warning(f"Rollup for {user['user_id']} had drifted")
+    return dict(result)
+
+
+async def main(user_id: str = None):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    set_db(client[os.environ["DB_NAME"]])
+    try:
+        print(f"Rollups: {await rebuild_all(user_id)}")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    import sys
+    logging.basicConfig(level=logging.INFO)
+    if "--rebuild" not in sys.argv:
+        sys.exit(__doc__)
+    asyncio.run(main(sys.argv[sys.argv.index("--user") + 1] if "--user" in sys.argv else None))
@@ -0,0 +1,61 @@
+import os
+from collections import OrderedDict
+from typing import Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Bounded LRU cache of built /sightings/stats and /sightings/analytics payloads,
+# keyed by (user_id, kind) and tagged with the ETag they were built for.
+#
+# The tag embeds the user's rollup version (analytics.py), which every sighting
+# write bumps in the database, so an entry is never served once the data has
+# changed, whichever worker made the change.
+
+ANALYTICS_CACHE_MAX = int(os.environ.get("ANALYTICS_CACHE_MAX", "5000"))
+
+
+class AnalyticsCache:
+    def __init__(self, maxsize: int = ANALYTICS_CACHE_MAX):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # (user_id, kind) -> (etag, payload)
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    def get(self, key: tuple, etag: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != etag:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: tuple, etag: str, payload: dict):
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = (etag, payload)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "not_modified": self.not_modified,
+            "evictions": self.evictions,
+        }
+
+
+analytics_cache = AnalyticsCache()
@@ -1,27 +1,28 @@
-from fastapi import APIRouter, HTTPException, Response, Request
+from fastapi import APIRouter, Depends, HTTPException, Response, Request
 from pydantic import BaseModel, EmailStr
 from typing import Optional
 from datetime import datetime, timezone, timedelta
 import uuid
-import httpx
-import os
-import base64
-import smtplib
+import jwt
 import logging
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from passlib.context import CryptContext
 from dotenv import load_dotenv
 
+from session_cache import session_cache
+from passwords import hash_password, verify_password
+import session_tokens
+from session_tokens import revocations
+import mailer
+from oauth_client import oauth_client, CircuitOpenError
+from purge import enqueue_purge
+from rate_limit import rate_limiter
+from uploads import save_data_url, is_data_url, photo_store
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
 auth_router = APIRouter(prefix="/auth", tags=["auth"])
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 # Database will be injected
 db = None
 
@@ -29,12 +30,6 @@ def set_db(database):
     global db
     db = database
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
-
 # Models
 class UserCreate(BaseModel):
     email: EmailStr
@@ -65,6 +60,8 @@ class PasswordUpdate(BaseModel):
 class SessionRequest(BaseModel):
     session_id: str
 
+SESSION_TTL = timedelta(days=7)
+
 def set_session_cookie(response: Response, session_token: str):
     # Clear any old cookies with different attributes first
     response.delete_cookie(key="session_token", path="/")
@@ -75,13 +72,37 @@ def set_session_cookie(response: Response, session_token: str):
         secure=True,
         samesite="lax",
         path="/",
-        max_age=7 * 24 * 60 * 60
+        max_age=int(SESSION_TTL.total_seconds())
     )
 
 def clear_session_cookie(response: Response):
     response.delete_cookie(key="session_token", path="/")
 
-async def get_current_user(request: Request) -> dict:
+async def start_session(response: Response, user_id: str) -> str:
+    expires_at = datetime.now(timezone.utc) + SESSION_TTL
+    if session_tokens.signed_sessions_enabled():
+        # Stateless: nothing to store, the token itself carries user_id and expiry
+        session_token = session_tokens.issue_token(user_id, expires_at)
+    else:
+        session_token = f"session_{uuid.uuid4().hex}"
+        session_doc = {
+            "user_id": user_id,
+            "session_token": session_token,
+            "expires_at": expires_at,
+            "created_at": datetime.now(timezone.utc)
+        }
+        await db.user_sessions.insert_one(session_doc)
+    
+    set_session_cookie(response, session_token)
+    return session_token
+
+async def revoke_user_sessions(user_id: str):
+    await db.user_sessions.delete_many({"user_id": user_id})
+    if session_tokens.SESSION_SECRET:
+        await revocations.revoke_user(user_id, datetime.now(timezone.utc) + SESSION_TTL)
+    session_cache.invalidate_user(user_id)
+
+def get_session_token(request: Request) -> Optional[str]:
     session_token = request.cookies.get("session_token")
     
     if not session_token:
@@ -89,37 +110,102 @@ async def get_current_user(request: Request) -> dict:
         if auth_header and auth_header.startswith("Bearer "):
             session_token = auth_header[7:]
     
-    if not session_token:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    session_doc = await db.user_sessions.find_one(
-        {"session_token": session_token},
-        {"_id": 0}
-    )
-    
-    if not session_doc:
-        raise HTTPException(status_code=401, detail="Invalid session")
-    
+    return session_token
+
+def session_expiry(session_doc: dict) -> datetime:
     expires_at = session_doc["expires_at"]
     if isinstance(expires_at, str):
         expires_at = datetime.fromisoformat(expires_at)
     if expires_at.tzinfo is None:
         expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return expires_at
+
+def session_lookup_pipeline(session_token: str) -> list:
+    # Session + owning user in a single round trip; password_hash never leaves the server
+    return [
+        {"$match": {"session_token": session_token}},
+        {"$limit": 1},
+        {"$lookup": {
+            "from": "users",
+            "localField": "user_id",
+            "foreignField": "user_id",
+            "as": "user",
+        }},
+        {"$project": {"_id": 0, "user._id": 0, "user.password_hash": 0}},
+    ]
+
+async def resolve_session(session_token: str) -> dict:
+    docs = await db.user_sessions.aggregate(session_lookup_pipeline(session_token)).to_list(1)
+    
+    if not docs:
+        raise HTTPException(status_code=401, detail="Invalid session")
+    session_doc = docs[0]
+    
+    expires_at = session_expiry(session_doc)
     if expires_at < datetime.now(timezone.utc):
         raise HTTPException(status_code=401, detail="Session expired")
     
+    if not session_doc["user"]:
+        raise HTTPException(status_code=401, detail="User not found")
+    
+    user_doc = session_doc["user"][0]
+    session_cache.set(session_token, user_doc, expires_at)
+    return user_doc
+
+async def resolve_signed_session(session_token: str) -> dict:
+    if not session_tokens.SESSION_SECRET:
+        raise HTTPException(status_code=401, detail="Invalid session")
+    try:
+        claims = session_tokens.decode_token(session_token)
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Session expired")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid session")
+    
+    if revocations.is_revoked(claims):
+        raise HTTPException(status_code=401, detail="Invalid session")
+    
     user_doc = await db.users.find_one(
-        {"user_id": session_doc["user_id"]},
+        {"user_id": claims["sub"]},
         {"_id": 0, "password_hash": 0}
     )
     
     if not user_doc:
         raise HTTPException(status_code=401, detail="User not found")
     
+    session_cache.set(session_token, user_doc, datetime.fromtimestamp(claims["exp"], tz=timezone.utc))
     return user_doc
 
+async def get_current_user(request: Request) -> dict:
+    session_token = get_session_token(request)
+    
+    if not session_token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    cached_user = session_cache.get(session_token)
+    if cached_user is not None:
+        if session_tokens.is_signed_token(session_token) and revocations.is_revoked(
+            session_tokens.decode_token(session_token, verify_exp=False)
+        ):
+            session_cache.invalidate_token(session_token)
+            raise HTTPException(status_code=401, detail="Invalid session")
+        return cached_user
+    
+    if session_tokens.is_signed_token(session_token):
+        return await resolve_signed_session(session_token)
+    return await resolve_session(session_token)
+
+async def current_user(request: Request) -> dict:
+    """Route dependency: the authenticated user, resolved at most once per request."""
+    user = getattr(request.state, "user", None)
+    if user is None:
+        user = await get_current_user(request)
+        request.state.user = user
+    return user
+
 @auth_router.post("/register", response_model=UserResponse)
-async def register(user_data: UserCreate, response: Response):
+async def register(user_data: UserCreate, request: Request, response: Response):
+    await rate_limiter.enforce(request, "register", user_data.email)
     existing_user = await db.users.find_one({"email": user_data.email}, {"_id": 0})
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
@@ -129,28 +215,20 @@ async def register(user_data: UserCreate, response: Response):
         "user_id": user_id,
         "email": user_data.email,
         "name": user_data.name,
-        "password_hash": hash_password(user_data.password),
+        "password_hash": await hash_password(user_data.password),
         "picture": None,
         "auth_provider": "email",
         "created_at": datetime.now(timezone.utc)
     }
     await db.users.insert_one(user_doc)
     
-    session_token = f"session_{uuid.uuid4().hex}"
-    session_doc = {
-        "user_id": user_id,
-        "session_token": session_token,
-        "expires_at": datetime.now(timezone.utc) + timedelta(days=7),
-        "created_at": datetime.now(timezone.utc)
-    }
-    await db.user_sessions.insert_one(session_doc)
-    
-    set_session_cookie(response, session_token)
+    await start_session(response, user_id)
     
     return UserResponse(user_id=user_id, email=user_data.email, name=user_data.name, picture=None, auth_provider="email")
 
 @auth_router.post("/login", response_model=UserResponse)
-async def login(user_data: UserLogin, response: Response):
+async def login(user_data: UserLogin, request: Request, response: Response):
+    await rate_limiter.enforce(request, "login", user_data.email)
     user_doc = await db.users.find_one({"email": user_data.email}, {"_id": 0})
     if not user_doc:
         raise HTTPException(status_code=401, detail="Invalid email or password")
@@ -161,19 +239,10 @@ async def login(user_data: UserLogin, response: Response):
     if not user_doc.get("password_hash"):
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
-    if not verify_password(user_data.password, user_doc["password_hash"]):
+    if not await verify_password(user_data.password, user_doc["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
-    session_token = f"session_{uuid.uuid4().hex}"
-    session_doc = {
-        "user_id": user_doc["user_id"],
-        "session_token": session_token,
-        "expires_at": datetime.now(timezone.utc) + timedelta(days=7),
-        "created_at": datetime.now(timezone.utc)
-    }
-    await db.user_sessions.insert_one(session_doc)
-    
-    set_session_cookie(response, session_token)
+    await start_session(response, user_doc["user_id"])
     
     return UserResponse(
         user_id=user_doc["user_id"],
@@ -187,13 +256,9 @@ async def login(user_data: UserLogin, response: Response):
 @auth_router.post("/session")
 async def exchange_session(session_data: SessionRequest, response: Response):
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(
-                "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
-                headers={"X-Session-ID": session_data.session_id}
-            )
-            resp.raise_for_status()
-            oauth_data = resp.json()
+        oauth_data = await oauth_client.fetch_session_data(session_data.session_id)
+    except CircuitOpenError:
+        raise HTTPException(status_code=503, detail="Google sign-in is temporarily unavailable, please try again shortly")
     except Exception as e:
         raise HTTPException(status_code=401, detail=f"Failed to verify session: {str(e)}")
     
@@ -209,6 +274,9 @@ async def exchange_session(session_data: SessionRequest, response: Response):
             {"user_id": user_id},
             {"$set": {"name": name, "picture": picture}}
         )
+        session_cache.invalidate_user(user_id)
+        if existing_user.get("picture") != picture:
+            await photo_store.release([existing_user.get("picture")])
     else:
         user_id = f"user_{uuid.uuid4().hex[:12]}"
         user_doc = {
@@ -221,22 +289,12 @@ async def exchange_session(session_data: SessionRequest, response: Response):
         }
         await db.users.insert_one(user_doc)
     
-    session_token = f"session_{uuid.uuid4().hex}"
-    session_doc = {
-        "user_id": user_id,
-        "session_token": session_token,
-        "expires_at": datetime.now(timezone.utc) + timedelta(days=7),
-        "created_at": datetime.now(timezone.utc)
-    }
-    await db.user_sessions.insert_one(session_doc)
-    
-    set_session_cookie(response, session_token)
+    await start_session(response, user_id)
     
     return {"user_id": user_id, "email": email, "name": name, "picture": picture}
 
 @auth_router.get("/me", response_model=UserResponse)
-async def get_me(request: Request):
-    user = await get_current_user(request)
+async def get_me(user: dict = Depends(current_user)):
     return UserResponse(
         user_id=user["user_id"],
         email=user["email"],
@@ -248,38 +306,45 @@ async def get_me(request: Request):
 
 @auth_router.post("/logout")
 async def logout(request: Request, response: Response):
-    session_token = request.cookies.get("session_token")
+    session_token = get_session_token(request)
     if session_token:
-        await db.user_sessions.delete_one({"session_token": session_token})
+        if session_tokens.is_signed_token(session_token):
+            # Without SESSION_SECRET signed tokens are never accepted, so there is nothing to revoke
+            if session_tokens.SESSION_SECRET:
+                try:
+                    await revocations.revoke_token(session_tokens.decode_token(session_token))
+                except jwt.InvalidTokenError:
+                    pass
+        else:
+            await db.user_sessions.delete_one({"session_token": session_token})
+        session_cache.invalidate_token(session_token)
     clear_session_cookie(response)
     return {"message": "Logged out successfully"}
 
 @auth_router.put("/profile", response_model=UserResponse)
-async def update_profile(user_data: UserUpdate, request: Request):
-    user = await get_current_user(request)
+async def update_profile(user_data: UserUpdate, user: dict = Depends(current_user)):
     user_id = user["user_id"]
     
     update_fields = {}
     if user_data.name is not None:
         update_fields["name"] = user_data.name
-    if user_data.picture is not None:
-        if user_data.picture.startswith("data:image"):
+    if user_data.picture is not None and user_data.picture != user.get("picture"):
+        if is_data_url(user_data.picture):
             try:
-                header, data = user_data.picture.split(",", 1)
-                ext = "jpg" if "jpeg" in header else "png"
-                filename = f"profile_{user_id}.{ext}"
-                filepath = f"/app/backend/uploads/{filename}"
-                os.makedirs("/app/backend/uploads", exist_ok=True)
-                with open(filepath, "wb") as f:
-                    f.write(base64.b64decode(data))
-                update_fields["picture"] = f"/api/uploads/{filename}"
+                update_fields["picture"] = await save_data_url(user_data.picture)
+            except HTTPException:
+                raise
             except Exception as e:
                 raise HTTPException(status_code=400, detail=f"Failed to save image: {str(e)}")
         else:
+            await photo_store.retain(user_data.picture)
             update_fields["picture"] = user_data.picture
     
     if update_fields:
         await db.users.update_one({"user_id": user_id}, {"$set": update_fields})
+        session_cache.invalidate_user(user_id)
+        if "picture" in update_fields:
+            await photo_store.release([user.get("picture")])
     
     updated_user = await db.users.find_one({"user_id": user_id}, {"_id": 0, "password_hash": 0})
     return UserResponse(
@@ -292,8 +357,7 @@ async def update_profile(user_data: UserUpdate, request: Request):
     )
 
 @auth_router.put("/password")
-async def update_password(password_data: PasswordUpdate, request: Request):
-    user = await get_current_user(request)
+async def update_password(password_data: PasswordUpdate, user: dict = Depends(current_user)):
     user_id = user["user_id"]
     
     user_doc = await db.users.find_one({"user_id": user_id}, {"_id": 0})
@@ -306,22 +370,23 @@ async def update_password(password_data: PasswordUpdate, request: Request):
     if not user_doc.get("password_hash"):
         raise HTTPException(status_code=400, detail="No password set for this account")
     
-    if not verify_password(password_data.current_password, user_doc["password_hash"]):
+    if not await verify_password(password_data.current_password, user_doc["password_hash"]):
         raise HTTPException(status_code=401, detail="Current password is incorrect")
     
-    new_hash = hash_password(password_data.new_password)
+    new_hash = await hash_password(password_data.new_password)
     await db.users.update_one({"user_id": user_id}, {"$set": {"password_hash": new_hash}})
+    session_cache.invalidate_user(user_id)
     
     return {"message": "Password updated successfully"}
 
 @auth_router.delete("/account")
-async def delete_account(request: Request, response: Response):
-    user = await get_current_user(request)
+async def delete_account(response: Response, user: dict = Depends(current_user)):
     user_id = user["user_id"]
     
-    await db.user_sessions.delete_many({"user_id": user_id})
-    await db.sightings.delete_many({"user_id": user_id})
+    await revoke_user_sessions(user_id)
     await db.users.delete_one({"user_id": user_id})
+    # Sightings, interactions and uploads are removed in the background
+    await enqueue_purge(user_id, user.get("picture"))
     
     clear_session_cookie(response)
     return {"message": "Account deleted successfully"}
@@ -331,28 +396,21 @@ class ProfileVisibilityUpdate(BaseModel):
     is_profile_public: bool
 
 @auth_router.put("/profile/visibility")
-async def toggle_profile_visibility(data: ProfileVisibilityUpdate, request: Request):
-    user = await get_current_user(request)
+async def toggle_profile_visibility(data: ProfileVisibilityUpdate, user: dict = Depends(current_user)):
     await db.users.update_one(
         {"user_id": user["user_id"]},
         {"$set": {"is_profile_public": data.is_profile_public}}
     )
+    session_cache.invalidate_user(user["user_id"])
     return {"message": "Profile visibility updated", "is_profile_public": data.is_profile_public}
 
 
 # ── Forgot Password / Reset ─────────────────────────────────────
 
-def send_reset_email(to_email: str, reset_link: str):
-    smtp_email = os.environ.get("SMTP_EMAIL")
-    smtp_password = os.environ.get("SMTP_PASSWORD")
-    if not smtp_email or not smtp_password:
+async def send_reset_email(to_email: str, reset_link: str):
+    if not mailer.email_configured():
         raise HTTPException(status_code=500, detail="Email service not configured")
 
-    msg = MIMEMultipart("alternative")
-    msg["Subject"] = "Reset your TrackLog password"
-    msg["From"] = f"TrackLog <{smtp_email}>"
-    msg["To"] = to_email
-
     text = f"Reset your password by visiting: {reset_link}\n\nThis link expires in 1 hour. If you didn't request this, ignore this email."
 
     html = f"""\
@@ -374,16 +432,7 @@ def send_reset_email(to_email: str, reset_link: str):
   </p>
 </div>"""
 
-    msg.attach(MIMEText(text, "plain"))
-    msg.attach(MIMEText(html, "html"))
-
-    try:
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-            server.login(smtp_email, smtp_password)
-            server.sendmail(smtp_email, to_email, msg.as_string())
-    except Exception as e:
-        logger.error(f"Failed to send reset email: {e}")
-        raise HTTPException(status_code=500, detail="Failed to send email")
+    await mailer.enqueue_email(to_email, "Reset your TrackLog password", text, html)
 
 
 class ForgotPasswordRequest(BaseModel):
@@ -397,6 +446,7 @@ class ResetPasswordRequest(BaseModel):
 
 @auth_router.post("/forgot-password")
 async def forgot_password(data: ForgotPasswordRequest, request: Request):
+    await rate_limiter.enforce(request, "forgot_password", data.email)
     user = await db.users.find_one({"email": data.email}, {"_id": 0})
     # Always return success to avoid leaking which emails exist
     if not user:
@@ -419,7 +469,7 @@ async def forgot_password(data: ForgotPasswordRequest, request: Request):
         origin = str(request.base_url).rstrip("/")
     reset_link = f"{origin}/reset-password?token={token}"
 
-    send_reset_email(user["email"], reset_link)
+    await send_reset_email(user["email"], reset_link)
     return {"message": "If an account with that email exists, a reset link has been sent."}
 
 
@@ -442,7 +492,7 @@ async def reset_password(data: ResetPasswordRequest):
     if len(data.new_password) < 6:
         raise HTTPException(status_code=400, detail="Password must be at least 6 characters")
 
-    new_hash = hash_password(data.new_password)
+    new_hash = await hash_password(data.new_password)
     await db.users.update_one(
         {"user_id": reset_doc["user_id"]},
         {"$set": {"password_hash": new_hash}},
@@ -452,6 +502,6 @@ async def reset_password(data: ResetPasswordRequest):
         {"$set": {"used": True}},
     )
     # Invalidate all sessions for security
-    await db.user_sessions.delete_many({"user_id": reset_doc["user_id"]})
+    await revoke_user_sessions(reset_doc["user_id"])
 
     return {"message": "Password has been reset successfully. Please sign in with your new password."}
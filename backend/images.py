@@ -0,0 +1,280 @@
+"""
+Photo derivatives. Every stored sighting photo gets thumb/medium/full variants,
+rendered by Pillow in a process pool (decoding and resizing are CPU-bound and
+would stall the event loop, and threads would serialise on the GIL). Variants
+are EXIF-rotated and re-encoded without metadata, so location tags in the
+original never reach the public feed.
+
+The sighting document records them alongside `photos`:
+
+    "photo_variants": [{"original": url, "thumb": url, "medium": url, "full": url}, ...]
+
+Write routes don't wait for them: they flag the sighting `variants_pending` and
+VariantQueue renders it in the background. Until then variant_urls() serves the
+originals.
+
+Existing sightings are processed by running this module directly:
+
+    python images.py --backfill
+"""
+import os
+import asyncio
+import logging
+import multiprocessing
+import shutil
+import tempfile
+import time
+from datetime import datetime, timezone, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+from PIL import Image, ImageOps
+from dotenv import load_dotenv
+
+from storage import storage, scratch_dir
+from uploads import UPLOAD_URL_PREFIX, upload_key, delete_uploads
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", str(min(2, os.cpu_count() or 1))))
+IMAGE_JPEG_QUALITY = int(os.environ.get("IMAGE_JPEG_QUALITY", "82"))
+VARIANT_POLL_SECONDS = float(os.environ.get("VARIANT_POLL_SECONDS", "10"))
+# A claimed sighting not finished within this long (worker crashed) is picked up again
+VARIANT_LOCK_SECONDS = float(os.environ.get("VARIANT_LOCK_SECONDS", "300"))
+
+# Longest edge in pixels
+IMAGE_VARIANTS = {
+    "thumb": 400,
+    "medium": 1280,
+    "full": 2560,
+}
+
+db = None
+
+def set_db(database):
+    global db
+    db = database
+
+
+def render_variants(source: str, out_dir: str) -> dict:
+    """Write <variant>.<ext> files for the image at `source` into out_dir;
+    returns variant -> filename. Runs in a worker process."""
+    with Image.open(source) as original:
+        has_alpha = original.mode in ("RGBA", "LA") or (original.mode == "P" and "transparency" in original.info)
+        image = ImageOps.exif_transpose(original).convert("RGBA" if has_alpha else "RGB")
+
+    fmt, ext, options = ("PNG", "png", {"optimize": True}) if has_alpha else (
+        "JPEG", "jpg", {"quality": IMAGE_JPEG_QUALITY, "optimize": True, "progressive": True}
+    )
+    rendered = {}
+    for name, edge in IMAGE_VARIANTS.items():
+        variant = image.copy()
+        variant.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+        rendered[name] = f"{name}.{ext}"
+        variant.save(os.path.join(out_dir, rendered[name]), fmt, **options)
+    return rendered
+
+
+class ImagePipeline:
+    def __init__(self, max_workers: int = IMAGE_WORKERS):
+        self.max_workers = max(1, max_workers)
+        self._executor = None
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_seconds = 0.0
+
+    async def variants(self, url: str) -> Optional[dict]:
+        """Render the variants of one stored photo; None if it isn't a local
+        upload or can't be decoded (callers then keep serving the original)."""
+        key = upload_key(url)
+        if key is None:
+            return None
+        stem = os.path.splitext(key)[0]
+        # Photos are content-addressed, so another sighting may already have rendered these
+        for ext in ("jpg", "png"):
+            keys = {name: f"{stem}_{name}.{ext}" for name in IMAGE_VARIANTS}
+            if all([await storage.exists(k) for k in keys.values()]):
+                return {"original": url, **{name: UPLOAD_URL_PREFIX + k for name, k in keys.items()}}
+
+        if self._executor is None:
+            # spawn: forking a process that runs the event loop and Mongo threads isn't safe
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        started = time.perf_counter()
+        self.in_flight += 1
+        try:
+            async with storage.local_copy(key) as source:
+                out_dir = await asyncio.to_thread(tempfile.mkdtemp, dir=scratch_dir())
+                try:
+                    rendered = await asyncio.get_running_loop().run_in_executor(
+                        self._executor, render_variants, source, out_dir
+                    )
+                    keys = {}
+                    for name, filename in rendered.items():
+                        keys[name] = f"{stem}_{filename}"
+                        await storage.put_file(keys[name], os.path.join(out_dir, filename))
+                finally:
+                    await asyncio.to_thread(shutil.rmtree, out_dir, True)
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Could not render variants of {url}: {e}")
+            return None
+        finally:
+            self.in_flight -= 1
+        self.completed += 1
+        self.total_seconds += time.perf_counter() - started
+        return {"original": url, **{name: UPLOAD_URL_PREFIX + k for name, k in keys.items()}}
+
+    async def process(self, urls: List[str]) -> List[dict]:
+        """Variants for every photo of a sighting, rendered in parallel."""
+        results = await asyncio.gather(*(self.variants(url) for url in urls))
+        return [r for r in results if r]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.max_workers,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "avg_ms": round(self.total_seconds / self.completed * 1000, 1) if self.completed else 0.0,
+        }
+
+
+image_pipeline = ImagePipeline()
+
+
+def variant_urls(sighting: dict, size: str) -> List[str]:
+    """The sighting's photos at `size`, falling back to the original where there is no variant."""
+    by_original = {v["original"]: v for v in sighting.get("photo_variants") or []}
+    return [by_original.get(photo, {}).get(size, photo) for photo in sighting.get("photos", [])]
+
+
+def variant_files(variants: List[dict]) -> List[str]:
+    """Upload URLs of every rendered variant (not the originals)."""
+    return [url for v in variants for name, url in v.items() if name != "original"]
+
+
+class VariantQueue:
+    def __init__(self):
+        self._wakeup = asyncio.Event()
+        self.completed = 0
+        self.failed = 0
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def claim(self) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        return await db.sightings.find_one_and_update(
+            {
+                "variants_pending": True,
+                "$or": [{"variants_locked_until": None}, {"variants_locked_until": {"$lte": now}}],
+            },
+            {"$set": {"variants_locked_until": now + timedelta(seconds=VARIANT_LOCK_SECONDS)}},
+            projection={"_id": 0, "sighting_id": 1, "photos": 1, "photo_variants": 1},
+        )
+
+    async def process(self, sighting: dict):
+        """Render the photos that have no variants yet. The result is only saved
+        if the photo list is still the one rendered; otherwise the sighting stays
+        pending and the new list is rendered on a later pass."""
+        photos = sighting.get("photos", [])
+        current = [v for v in sighting.get("photo_variants") or [] if v["original"] in photos]
+        done = {v["original"] for v in current}
+        rendered = await image_pipeline.process([url for url in dict.fromkeys(photos) if url not in done])
+        result = await db.sightings.update_one(
+            {"sighting_id": sighting["sighting_id"], "photos": photos},
+            {
+                "$set": {"photo_variants": current + rendered},
+                "$unset": {"variants_pending": "", "variants_locked_until": ""},
+            },
+        )
+        if result.matched_count:
+            self.completed += 1
+            return
+        # Edited or deleted meanwhile: drop variants whose original is already gone
+        orphaned = [v for v in rendered if not await storage.exists(upload_key(v["original"]))]
+        await delete_uploads(variant_files(orphaned))
+        await db.sightings.update_one(
+            {"sighting_id": sighting["sighting_id"]}, {"$unset": {"variants_locked_until": ""}}
+        )
+
+    async def worker(self):
+        while True:
+            sighting = None
+            try:
+                sighting = await self.claim()
+                if sighting:
+                    await self.process(sighting)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # The lock expires and another pass retries it
+                self.failed += 1
+                logger.error(f"Variants for {sighting['sighting_id'] if sighting else '?'} failed: {e}")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=VARIANT_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> asyncio.Task:
+        return asyncio.create_task(self.worker())
+
+    async def stats(self) -> dict:
+        return {
+            "pending": await db.sightings.count_documents({"variants_pending": True}),
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+
+variant_queue = VariantQueue()
+
+
+async def backfill(db, batch_size: int = 100) -> int:
+    processed = 0
+    query = {"photo_variants": {"$exists": False}, "photos.0": {"$exists": True}}
+    while True:
+        batch = await db.sightings.find(
+            query, {"_id": 0, "sighting_id": 1, "photos": 1}
+        ).limit(batch_size).to_list(batch_size)
+        if not batch:
+            return processed
+        for sighting in batch:
+            variants = await image_pipeline.process(sighting["photos"])
+            await db.sightings.update_one(
+                {"sighting_id": sighting["sighting_id"]}, {"$set": {"photo_variants": variants}}
+            )
+            processed += 1
+        logger.info(f"Rendered variants for {processed} sightings")
+
+
+async def main():
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    try:
+        processed = await backfill(client[os.environ["DB_NAME"]])
+        print(f"Rendered variants for {processed} sightings")
+    finally:
+        image_pipeline.shutdown()
+        client.close()
+
+
+if __name__ == "__main__":
+    import sys
+    logging.basicConfig(level=logging.INFO)
+    if "--backfill" not in sys.argv:
+        sys.exit(__doc__)
+    asyncio.run(main())
@@ -0,0 +1,173 @@
+"""
+Index manifest for every collection the API queries.
+
+apply_indexes() runs from server.lifespan and is idempotent: existing indexes
+are left alone, missing ones are created. Run this module directly to report
+missing indexes and indexes with no recorded use ($indexStats):
+
+    python indexes.py            # report
+    python indexes.py --apply    # create missing indexes, then report
+"""
+import os
+import asyncio
+import logging
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+INDEXES = {
+    "users": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        # search_users: public profiles, newest first
+        IndexModel([("is_profile_public", ASCENDING), ("created_at", DESCENDING)], name="public_created_at"),
+    ],
+    "user_sessions": [
+        IndexModel([("session_token", ASCENDING)], name="session_token_unique", unique=True),
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "sightings": [
+        IndexModel([("sighting_id", ASCENDING)], name="sighting_id_unique", unique=True),
+        # Legacy documents may predate share_id, so only enforce it where present
+        IndexModel(
+            [("share_id", ASCENDING)], name="share_id_unique", unique=True,
+            partialFilterExpression={"share_id": {"$type": "string"}},
+        ),
+        # get_sightings keyset paging; sighting_id breaks created_at ties
+        IndexModel(
+            [("user_id", ASCENDING), ("created_at", DESCENDING), ("sighting_id", DESCENDING)],
+            name="user_created_at_sighting_id",
+        ),
+        IndexModel([("is_public", ASCENDING), ("created_at", DESCENDING)], name="public_created_at"),
+        # get_public_profile / search_users sighting counts
+        IndexModel(
+            [("user_id", ASCENDING), ("is_public", ASCENDING), ("created_at", DESCENDING)],
+            name="user_public_created_at",
+        ),
+        # images.variant_queue: the few sightings still waiting for photo variants
+        IndexModel(
+            [("variants_pending", ASCENDING)], name="variants_pending",
+            partialFilterExpression={"variants_pending": True},
+        ),
+    ],
+    "likes": [
+        IndexModel([("user_id", ASCENDING), ("sighting_id", ASCENDING)], name="user_sighting_unique", unique=True),
+        # purge: likes on a deleted user's sightings
+        IndexModel([("sighting_id", ASCENDING)], name="sighting_id"),
+    ],
+    "bookmarks": [
+        IndexModel([("user_id", ASCENDING), ("sighting_id", ASCENDING)], name="user_sighting_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_created_at"),
+        IndexModel([("sighting_id", ASCENDING)], name="sighting_id"),
+    ],
+    "follows": [
+        IndexModel([("follower_id", ASCENDING), ("following_id", ASCENDING)], name="follower_following_unique", unique=True),
+        IndexModel([("following_id", ASCENDING)], name="following_id"),
+    ],
+    "notifications": [
+        IndexModel([("user_id", ASCENDING), ("read", ASCENDING), ("created_at", DESCENDING)], name="user_read_created_at"),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_created_at"),
+        IndexModel([("sighting_id", ASCENDING)], name="sighting_id"),
+        IndexModel([("actor_id", ASCENDING)], name="actor_id"),
+    ],
+    "password_resets": [
+        IndexModel([("token", ASCENDING)], name="token_unique", unique=True),
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+    ],
+    "revoked_sessions": [
+        IndexModel(
+            [("jti", ASCENDING)], name="jti_unique", unique=True,
+            partialFilterExpression={"jti": {"$type": "string"}},
+        ),
+        IndexModel(
+            [("user_id", ASCENDING)], name="user_id_unique", unique=True,
+            partialFilterExpression={"user_id": {"$type": "string"}},
+        ),
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "email_outbox": [
+        IndexModel([("email_id", ASCENDING)], name="email_id_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)], name="status_next_attempt_at"),
+    ],
+    "rate_limits": [
+        IndexModel([("key", ASCENDING)], name="key_unique", unique=True),
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "user_analytics": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+    ],
+    "photo_blobs": [
+        IndexModel([("blob_id", ASCENDING)], name="blob_id_unique", unique=True),
+    ],
+    "purge_jobs": [
+        IndexModel([("job_id", ASCENDING)], name="job_id_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)], name="status_created_at"),
+    ],
+}
+
+
+def _key(spec) -> tuple:
+    return tuple((field, int(direction)) for field, direction in spec.items())
+
+
+async def apply_indexes(db):
+    """Create any index in the manifest that doesn't exist yet. A failure on one
+    index (e.g. duplicates blocking a unique index) is logged, not fatal."""
+    for collection, models in INDEXES.items():
+        for model in models:
+            try:
+                await db[collection].create_indexes([model])
+            except OperationFailure as e:
+                logger.error(f"Could not create index {collection}.{model.document['name']}: {e}")
+
+
+async def check_indexes(db) -> dict:
+    """Report manifest indexes missing from the database, and existing indexes
+    that $indexStats shows have never been used since the last mongod restart."""
+    report = {"missing": [], "unused": [], "unmanaged": []}
+    for collection, models in INDEXES.items():
+        existing = {}
+        async for index in db[collection].list_indexes():
+            existing[_key(index["key"])] = index["name"]
+        expected = {_key(model.document["key"]): model.document["name"] for model in models}
+
+        for key, name in expected.items():
+            if key not in existing:
+                report["missing"].append(f"{collection}.{name}")
+        for key, name in existing.items():
+            if name != "_id_" and key not in expected:
+                report["unmanaged"].append(f"{collection}.{name}")
+
+        try:
+            async for stat in db[collection].aggregate([{"$indexStats": {}}]):
+                if stat["name"] != "_id_" and stat["accesses"]["ops"] == 0:
+                    report["unused"].append(f"{collection}.{stat['name']}")
+        except OperationFailure as e:
+            logger.warning(f"$indexStats unavailable for {collection}: {e}")
+    return report
+
+
+async def main(apply: bool):
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    db = client[os.environ["DB_NAME"]]
+    if apply:
+        await apply_indexes(db)
+    report = await check_indexes(db)
+    for section, names in report.items():
+        print(f"{section} ({len(names)}):")
+        for name in names:
+            print(f"  {name}")
+    client.close()
+
+
+if __name__ == "__main__":
+    import sys
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(apply="--apply" in sys.argv))
@@ -0,0 +1,211 @@
+import os
+import asyncio
+import logging
+import smtplib
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Outbound email goes through a durable queue (email_outbox) instead of being
+# sent inline by the request handler. Background workers claim jobs, send them
+# over a reused SMTP connection and retry failures with exponential backoff.
+#
+# Point SMTP_HOST/SMTP_PORT at a local stub (e.g. `python -m aiosmtpd -n -l
+# localhost:1025`) with SMTP_SSL=false and no SMTP_PASSWORD to test delivery.
+
+SMTP_HOST = os.environ.get("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", "465"))
+SMTP_SSL = os.environ.get("SMTP_SSL", "true").lower() == "true"
+SMTP_TIMEOUT = float(os.environ.get("SMTP_TIMEOUT", "20"))
+EMAIL_WORKERS = int(os.environ.get("EMAIL_WORKERS", "1"))
+EMAIL_POLL_SECONDS = float(os.environ.get("EMAIL_POLL_SECONDS", "5"))
+EMAIL_IDLE_SECONDS = float(os.environ.get("EMAIL_IDLE_SECONDS", "60"))
+EMAIL_MAX_ATTEMPTS = int(os.environ.get("EMAIL_MAX_ATTEMPTS", "6"))
+EMAIL_RETRY_BASE_SECONDS = float(os.environ.get("EMAIL_RETRY_BASE_SECONDS", "10"))
+# A job stuck in "sending" past this (worker crashed mid-send) is picked up again
+EMAIL_LOCK_SECONDS = float(os.environ.get("EMAIL_LOCK_SECONDS", "120"))
+
+db = None
+
+def set_db(database):
+    global db
+    db = database
+
+def smtp_sender() -> str:
+    return os.environ.get("SMTP_EMAIL")
+
+def email_configured() -> bool:
+    return bool(smtp_sender())
+
+
+async def enqueue_email(to_email: str, subject: str, text: str, html: str) -> str:
+    email_id = f"email_{uuid.uuid4().hex[:12]}"
+    now = datetime.now(timezone.utc)
+    await db.email_outbox.insert_one({
+        "email_id": email_id,
+        "to": to_email,
+        "subject": subject,
+        "text": text,
+        "html": html,
+        "status": "pending",
+        "attempts": 0,
+        "next_attempt_at": now,
+        "created_at": now,
+    })
+    email_queue.wake()
+    return email_id
+
+
+class SMTPConnection:
+    """One SMTP session reused across sends; reconnects when dropped."""
+
+    def __init__(self):
+        self._server = None
+        self._last_used = 0.0
+
+    def send(self, to_email: str, message: str):
+        sender = smtp_sender()
+        if self._server is None:
+            self._connect()
+        try:
+            self._server.sendmail(sender, to_email, message)
+        except smtplib.SMTPServerDisconnected:
+            # Server closed an idle connection; retry once on a fresh one
+            self._connect()
+            self._server.sendmail(sender, to_email, message)
+        self._last_used = time.monotonic()
+
+    def close_if_idle(self):
+        if self._server is not None and time.monotonic() - self._last_used > EMAIL_IDLE_SECONDS:
+            self.close()
+
+    def close(self):
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except Exception:
+            pass
+        self._server = None
+
+    def _connect(self):
+        self.close()
+        if SMTP_SSL:
+            server = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        else:
+            server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        password = os.environ.get("SMTP_PASSWORD")
+        if password:
+            server.login(smtp_sender(), password)
+        self._server = server
+
+
+def build_message(job: dict) -> str:
+    msg = MIMEMultipart("alternative")
+    msg["Subject"] = job["subject"]
+    msg["From"] = f"TrackLog <{smtp_sender()}>"
+    msg["To"] = job["to"]
+    msg.attach(MIMEText(job["text"], "plain"))
+    msg.attach(MIMEText(job["html"], "html"))
+    return msg.as_string()
+
+
+class EmailQueue:
+    def __init__(self):
+        self._wakeup = asyncio.Event()
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def claim(self):
+        now = datetime.now(timezone.utc)
+        return await db.email_outbox.find_one_and_update(
+            {
+                "$or": [
+                    {"status": "pending", "next_attempt_at": {"$lte": now}},
+                    {"status": "sending", "locked_until": {"$lte": now}},
+                ]
+            },
+            {"$set": {"status": "sending", "locked_until": now + timedelta(seconds=EMAIL_LOCK_SECONDS)}},
+            sort=[("next_attempt_at", 1)],
+            projection={"_id": 0},
+        )
+
+    async def deliver(self, job: dict, connection: SMTPConnection):
+        try:
+            await asyncio.to_thread(connection.send, job["to"], build_message(job))
+        except Exception as e:
+            await asyncio.to_thread(connection.close)
+            attempts = job.get("attempts", 0) + 1
+            if attempts >= EMAIL_MAX_ATTEMPTS:
+                self.failed += 1
+                logger.error(f"Giving up on email {job['email_id']} after {attempts} attempts: {e}")
+                update = {"status": "failed", "attempts": attempts, "last_error": str(e)}
+            else:
+                self.retried += 1
+                delay = EMAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+                logger.warning(f"Email {job['email_id']} failed (attempt {attempts}), retrying in {delay:.0f}s: {e}")
+                update = {
+                    "status": "pending",
+                    "attempts": attempts,
+                    "last_error": str(e),
+                    "next_attempt_at": datetime.now(timezone.utc) + timedelta(seconds=delay),
+                }
+            await db.email_outbox.update_one({"email_id": job["email_id"]}, {"$set": update})
+            return
+
+        self.sent += 1
+        await db.email_outbox.update_one(
+            {"email_id": job["email_id"]},
+            {
+                "$set": {"status": "sent", "sent_at": datetime.now(timezone.utc)},
+                "$unset": {"html": "", "text": ""},
+            },
+        )
+
+    async def worker(self):
+        connection = SMTPConnection()
+        try:
+            while True:
+                try:
+                    job = await self.claim()
+                except Exception as e:
+                    logger.error(f"Failed to claim email job: {e}")
+                    job = None
+                if job:
+                    await self.deliver(job, connection)
+                    continue
+                await asyncio.to_thread(connection.close_if_idle)
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=EMAIL_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            # quit() is a network round trip; keep it off the event loop like sends
+            await asyncio.to_thread(connection.close)
+
+    def start(self) -> list:
+        return [asyncio.create_task(self.worker()) for _ in range(max(1, EMAIL_WORKERS))]
+
+    async def stats(self) -> dict:
+        return {
+            "pending": await db.email_outbox.count_documents({"status": "pending"}),
+            "failed_total": await db.email_outbox.count_documents({"status": "failed"}),
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+email_queue = EmailQueue()
@@ -0,0 +1,152 @@
+import os
+import time
+from collections import deque
+from typing import Optional
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# App-lifetime HTTP client for the Emergent OAuth session exchange. One pooled,
+# keep-alive client is created in server.lifespan so Google sign-ins reuse
+# connections, with explicit timeouts and connection limits. A circuit breaker
+# stops hammering the upstream (and tying up sockets) while it is failing.
+
+OAUTH_SESSION_URL = os.environ.get(
+    "OAUTH_SESSION_URL",
+    "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
+)
+OAUTH_CONNECT_TIMEOUT = float(os.environ.get("OAUTH_CONNECT_TIMEOUT", "3"))
+OAUTH_READ_TIMEOUT = float(os.environ.get("OAUTH_READ_TIMEOUT", "10"))
+OAUTH_MAX_CONNECTIONS = int(os.environ.get("OAUTH_MAX_CONNECTIONS", "20"))
+OAUTH_MAX_KEEPALIVE = int(os.environ.get("OAUTH_MAX_KEEPALIVE", "10"))
+OAUTH_BREAKER_FAILURES = int(os.environ.get("OAUTH_BREAKER_FAILURES", "5"))
+OAUTH_BREAKER_RESET_SECONDS = float(os.environ.get("OAUTH_BREAKER_RESET_SECONDS", "30"))
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """closed -> open after `failure_threshold` consecutive failures; after
+    `reset_timeout` one trial call is let through (half-open) and its outcome
+    closes or re-opens the circuit."""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        state = self.state
+        if state == "open" or (state == "half_open" and self.trial_in_flight):
+            raise CircuitOpenError("OAuth provider temporarily unavailable")
+        if state == "half_open":
+            self.trial_in_flight = True
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.trial_in_flight or self.consecutive_failures >= self.failure_threshold:
+            if self.opened_at is None or self.trial_in_flight:
+                self.times_opened += 1
+            self.opened_at = time.monotonic()
+        self.trial_in_flight = False
+
+
+class OAuthClient:
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self.breaker = CircuitBreaker(OAUTH_BREAKER_FAILURES, OAUTH_BREAKER_RESET_SECONDS)
+        self.latencies = deque(maxlen=1000)
+        self.requests = 0
+        self.failures = 0
+        self.rejected = 0
+
+    def start(self):
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                OAUTH_READ_TIMEOUT,
+                connect=OAUTH_CONNECT_TIMEOUT,
+                pool=OAUTH_CONNECT_TIMEOUT,
+            ),
+            limits=httpx.Limits(
+                max_connections=OAUTH_MAX_CONNECTIONS,
+                max_keepalive_connections=OAUTH_MAX_KEEPALIVE,
+            ),
+        )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def fetch_session_data(self, session_id: str) -> dict:
+        if self._client is None:
+            self.start()
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            self.rejected += 1
+            raise
+
+        self.requests += 1
+        started = time.perf_counter()
+        try:
+            resp = await self._client.get(OAUTH_SESSION_URL, headers={"X-Session-ID": session_id})
+        except httpx.HTTPError:
+            self._record(started, upstream_ok=False)
+            raise
+        except BaseException:
+            # Cancelled mid-flight: don't leave a half-open trial dangling
+            self.breaker.trial_in_flight = False
+            raise
+        # A 4xx means a bad/expired session id, not an unhealthy upstream
+        self._record(started, upstream_ok=resp.status_code < 500)
+        resp.raise_for_status()
+        return resp.json()
+
+    def _record(self, started: float, upstream_ok: bool):
+        self.latencies.append(time.perf_counter() - started)
+        if upstream_ok:
+            self.breaker.record_success()
+        else:
+            self.failures += 1
+            self.breaker.record_failure()
+
+    def stats(self) -> dict:
+        ordered = sorted(self.latencies)
+
+        def pct(p):
+            if not ordered:
+                return None
+            return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000, 1)
+
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "rejected_by_breaker": self.rejected,
+            "circuit": self.breaker.state,
+            "times_opened": self.breaker.times_opened,
+            "latency_ms": {"p50": pct(0.50), "p95": pct(0.95), "p99": pct(0.99)},
+        }
+
+
+oauth_client = OAuthClient()
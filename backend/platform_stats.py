@@ -0,0 +1,66 @@
+import os
+import asyncio
+import logging
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Platform-wide totals (dashboard analytics, landing page) are served from
+# memory and refreshed every PLATFORM_STATS_REFRESH_SECONDS with
+# estimated_document_count, which reads collection metadata instead of
+# counting documents. The numbers can lag by one interval, and may be slightly
+# off after an unclean shutdown; both are fine for display.
+
+PLATFORM_STATS_REFRESH_SECONDS = float(os.environ.get("PLATFORM_STATS_REFRESH_SECONDS", "300"))
+
+db = None
+
+def set_db(database):
+    global db
+    db = database
+
+
+class PlatformStats:
+    def __init__(self):
+        self.total_sightings = 0
+        self.total_users = 0
+        self.last_refresh = None
+        self.refreshes = 0
+        self.failures = 0
+
+    async def refresh(self):
+        self.total_sightings, self.total_users = await asyncio.gather(
+            db.sightings.estimated_document_count(),
+            db.users.estimated_document_count(),
+        )
+        self.last_refresh = datetime.now(timezone.utc)
+        self.refreshes += 1
+
+    async def run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"Failed to refresh platform stats: {e}")
+            await asyncio.sleep(PLATFORM_STATS_REFRESH_SECONDS)
+
+    def start(self) -> asyncio.Task:
+        return asyncio.create_task(self.run())
+
+    def totals(self) -> dict:
+        return {"total_sightings": self.total_sightings, "total_users": self.total_users}
+
+    def stats(self) -> dict:
+        return {
+            **self.totals(),
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "last_refresh": self.last_refresh.isoformat() if self.last_refresh else None,
+        }
+
+
+platform_stats = PlatformStats()
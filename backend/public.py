@@ -3,6 +3,9 @@ from pydantic import BaseModel
 from typing import Optional, List
 from datetime import datetime
 
+from images import variant_urls
+from platform_stats import platform_stats
+
 public_router = APIRouter(prefix="/public", tags=["public"])
 
 db = None
@@ -38,6 +41,11 @@ class PublicProfileResponse(BaseModel):
     member_since: Optional[str] = None
     sightings: List[PublicSightingResponse] = []
 
+@public_router.get("/stats")
+async def get_platform_stats():
+    """Landing-page totals, served from memory (platform_stats.py)."""
+    return platform_stats.totals()
+
 @public_router.get("/feed")
 async def get_public_feed(page: int = 1, limit: int = 20, search: str = ""):
     skip = (page - 1) * limit
@@ -75,7 +83,7 @@ async def get_public_feed(page: int = 1, limit: int = 20, search: str = ""):
             "sighting_date": s["sighting_date"],
             "sighting_time": s["sighting_time"],
             "notes": s.get("notes"),
-            "photos": s.get("photos", []),
+            "photos": variant_urls(s, "thumb"),
             "like_count": max(s.get("like_count", 0), 0),
             "created_at": s["created_at"].isoformat() if hasattr(s.get("created_at"), 'isoformat') else str(s.get("created_at", "")),
             "owner_name": owner.get("name", "Unknown"),
@@ -159,7 +167,7 @@ async def get_public_profile(user_id: str):
             sighting_date=s["sighting_date"],
             sighting_time=s["sighting_time"],
             notes=s.get("notes"),
-            photos=s.get("photos", []),
+            photos=variant_urls(s, "thumb"),
             created_at=s["created_at"],
             owner_name=user["name"],
             owner_picture=user.get("picture"),
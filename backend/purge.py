@@ -0,0 +1,247 @@
+import os
+import asyncio
+import logging
+import uuid
+from collections import Counter
+from datetime import datetime, timezone, timedelta
+from pymongo import UpdateOne
+from dotenv import load_dotenv
+
+from images import variant_files
+from uploads import photo_store, delete_uploads
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Account deletion only removes the user document and sessions inline; all of
+# the user's other data is purged by a background job (purge_jobs) in batches.
+#
+# Each step deletes BATCH documents at a time until nothing matches, so a job
+# interrupted by a restart simply resumes at its current step. Progress
+# (documents and files removed per step) is recorded on the job document.
+
+PURGE_BATCH_SIZE = int(os.environ.get("PURGE_BATCH_SIZE", "500"))
+PURGE_POLL_SECONDS = float(os.environ.get("PURGE_POLL_SECONDS", "10"))
+# A running job whose lock hasn't been renewed for this long is taken over
+PURGE_LOCK_SECONDS = float(os.environ.get("PURGE_LOCK_SECONDS", "300"))
+
+STEPS = [
+    "hide_sightings",
+    "sightings",
+    "likes",
+    "bookmarks",
+    "follows",
+    "notifications",
+    "password_resets",
+    "profile_picture",
+]
+
+db = None
+
+def set_db(database):
+    global db
+    db = database
+
+
+async def enqueue_purge(user_id: str, picture: str = None) -> str:
+    job_id = f"purge_{uuid.uuid4().hex[:12]}"
+    now = datetime.now(timezone.utc)
+    await db.purge_jobs.insert_one({
+        "job_id": job_id,
+        "user_id": user_id,
+        "picture": picture,
+        "status": "pending",
+        "step": STEPS[0],
+        "progress": {},
+        "created_at": now,
+        "updated_at": now,
+    })
+    purge_queue.wake()
+    return job_id
+
+
+async def _delete_in_batches(collection, query: dict, record, key: str,
+                             projection: dict = None, before_delete=None, after_delete=None):
+    """Delete everything matching query, PURGE_BATCH_SIZE documents per round trip,
+    recording the deleted count under `key` after each batch."""
+    while True:
+        batch = await collection.find(query, projection or {"_id": 1}).limit(PURGE_BATCH_SIZE).to_list(PURGE_BATCH_SIZE)
+        if not batch:
+            return
+        counts = {}
+        if before_delete:
+            counts.update(await before_delete(batch))
+        result = await collection.delete_many({"_id": {"$in": [d["_id"] for d in batch]}})
+        if after_delete:
+            await after_delete(batch)
+        counts[key] = result.deleted_count
+        await record(counts)
+        if len(batch) < PURGE_BATCH_SIZE:
+            return
+
+
+class PurgeQueue:
+    def __init__(self):
+        self._wakeup = asyncio.Event()
+        self.completed = 0
+        self.failed = 0
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def claim(self):
+        now = datetime.now(timezone.utc)
+        return await db.purge_jobs.find_one_and_update(
+            {
+                "$or": [
+                    {"status": "pending"},
+                    {"status": "running", "locked_until": {"$lte": now}},
+                ]
+            },
+            {"$set": {"status": "running", "locked_until": now + timedelta(seconds=PURGE_LOCK_SECONDS)}},
+            sort=[("created_at", 1)],
+            projection={"_id": 0},
+        )
+
+    async def _record(self, job: dict, step: str, removed: dict):
+        progress = job.setdefault("progress", {}).setdefault(step, {})
+        for key, count in removed.items():
+            progress[key] = progress.get(key, 0) + count
+        now = datetime.now(timezone.utc)
+        await db.purge_jobs.update_one(
+            {"job_id": job["job_id"]},
+            {"$set": {
+                "step": step,
+                f"progress.{step}": progress,
+                "updated_at": now,
+                "locked_until": now + timedelta(seconds=PURGE_LOCK_SECONDS),
+            }},
+        )
+
+    async def run_step(self, job: dict, step: str):
+        user_id = job["user_id"]
+
+        async def record(counts):
+            await self._record(job, step, counts)
+
+        if step == "hide_sightings":
+            result = await db.sightings.update_many(
+                {"user_id": user_id, "is_public": True}, {"$set": {"is_public": False}}
+            )
+            await record({"hidden": result.modified_count})
+
+        elif step == "sightings":
+            # Dependents go first so an interrupted batch never orphans them
+            async def drop_dependents(batch):
+                ids = [s["sighting_id"] for s in batch]
+                released = []
+                for s in batch:
+                    # Flag first: a resumed batch must not release the same references twice
+                    flagged = await db.sightings.update_one(
+                        {"_id": s["_id"], "photos_released": {"$ne": True}}, {"$set": {"photos_released": True}}
+                    )
+                    if flagged.modified_count:
+                        released += await photo_store.release(s.get("photos", []))
+                variants = [v for s in batch for v in s.get("photo_variants") or [] if v["original"] in released]
+                await delete_uploads(variant_files(variants))
+                return {
+                    "likes": (await db.likes.delete_many({"sighting_id": {"$in": ids}})).deleted_count,
+                    "bookmarks": (await db.bookmarks.delete_many({"sighting_id": {"$in": ids}})).deleted_count,
+                    "notifications": (await db.notifications.delete_many({"sighting_id": {"$in": ids}})).deleted_count,
+                    "files": len(released),
+                }
+
+            await _delete_in_batches(
+                db.sightings, {"user_id": user_id}, record, "sightings",
+                projection={"_id": 1, "sighting_id": 1, "photos": 1, "photo_variants": 1},
+                before_delete=drop_dependents,
+            )
+            await db.user_analytics.delete_one({"user_id": user_id})
+
+        elif step == "likes":
+            # Decrement after deleting: a crash can leave a count too high, never double-decremented
+            async def release_like_counts(batch):
+                per_sighting = Counter(like["sighting_id"] for like in batch)
+                await db.sightings.bulk_write(
+                    [UpdateOne({"sighting_id": sid}, {"$inc": {"like_count": -n}}) for sid, n in per_sighting.items()],
+                    ordered=False,
+                )
+
+            await _delete_in_batches(
+                db.likes, {"user_id": user_id}, record, "likes",
+                projection={"_id": 1, "sighting_id": 1},
+                after_delete=release_like_counts,
+            )
+
+        elif step == "bookmarks":
+            await _delete_in_batches(db.bookmarks, {"user_id": user_id}, record, "bookmarks")
+
+        elif step == "follows":
+            await _delete_in_batches(db.follows, {"follower_id": user_id}, record, "following")
+            await _delete_in_batches(db.follows, {"following_id": user_id}, record, "followers")
+
+        elif step == "notifications":
+            await _delete_in_batches(db.notifications, {"user_id": user_id}, record, "received")
+            await _delete_in_batches(db.notifications, {"actor_id": user_id}, record, "sent")
+
+        elif step == "password_resets":
+            result = await db.password_resets.delete_many({"user_id": user_id})
+            await record({"password_resets": result.deleted_count})
+
+        elif step == "profile_picture":
+            released = await photo_store.release([job.get("picture")])
+            await record({"files": len(released)})
+
+        else:
+            raise ValueError(f"Unknown purge step {step}")
+
+    async def process(self, job: dict):
+        start = STEPS.index(job.get("step", STEPS[0]))
+        for step in STEPS[start:]:
+            await self.run_step(job, step)
+        await db.purge_jobs.update_one(
+            {"job_id": job["job_id"]},
+            {"$set": {"status": "done", "finished_at": datetime.now(timezone.utc)}, "$unset": {"locked_until": ""}},
+        )
+        self.completed += 1
+        logger.info(f"Purged data for deleted user {job['user_id']} ({job['job_id']})")
+
+    async def worker(self):
+        while True:
+            job = None
+            try:
+                job = await self.claim()
+                if job:
+                    await self.process(job)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Purge job {job['job_id'] if job else '?'} failed, will resume: {e}")
+                if job:
+                    # Leave it "running" with an expired lock so it is retried after a pause
+                    await db.purge_jobs.update_one(
+                        {"job_id": job["job_id"]},
+                        {"$set": {"locked_until": datetime.now(timezone.utc) + timedelta(seconds=PURGE_POLL_SECONDS), "last_error": str(e)}},
+                    )
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=PURGE_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> asyncio.Task:
+        return asyncio.create_task(self.worker())
+
+    async def stats(self) -> dict:
+        return {
+            "pending": await db.purge_jobs.count_documents({"status": "pending"}),
+            "running": await db.purge_jobs.count_documents({"status": "running"}),
+            "completed": self.completed,
+            "failed_attempts": self.failed,
+        }
+
+
+purge_queue = PurgeQueue()
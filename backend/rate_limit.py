@@ -0,0 +1,142 @@
+import os
+import time
+import math
+from collections import OrderedDict, Counter
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+from fastapi import HTTPException, Request
+from pymongo import ReturnDocument
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Token-bucket throttling for the credential endpoints. login and register each
+# cost a bcrypt operation, so requests over the limit are rejected with 429
+# before any hashing happens.
+#
+# Buckets are keyed by client IP and by email. The default backend is
+# in-process; RATE_LIMIT_BACKEND=mongo shares buckets across workers through
+# the rate_limits collection (one atomic find_one_and_update per check).
+#
+# Limits are "<requests>/<seconds>" and can be overridden per rule with
+# RATE_LIMIT_<RULE>, e.g. RATE_LIMIT_LOGIN_EMAIL=5/300.
+
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", "100000"))
+# Number of reverse proxies in front of the app (e.g. 1 behind the ingress). Each
+# appends the address it saw to X-Forwarded-For, so the client is the entry that
+# many hops from the right; anything further left is whatever the client sent.
+# 0 ignores the header and uses the socket address.
+RATE_LIMIT_TRUSTED_PROXIES = int(os.environ.get("RATE_LIMIT_TRUSTED_PROXIES", "0"))
+
+DEFAULT_RULES = {
+    "login_ip": "60/60",
+    "login_email": "30/300",
+    "register_ip": "20/300",
+    "forgot_password_ip": "10/300",
+    "forgot_password_email": "3/900",
+}
+
+db = None
+
+def set_db(database):
+    global db
+    db = database
+
+
+def parse_rate(rate: str) -> tuple:
+    """"10/60" -> (capacity 10, refill 10 tokens per 60 seconds)"""
+    requests, seconds = rate.split("/")
+    capacity = float(requests)
+    return capacity, capacity / float(seconds)
+
+
+RULES = {
+    name: parse_rate(os.environ.get(f"RATE_LIMIT_{name.upper()}", rate))
+    for name, rate in DEFAULT_RULES.items()
+}
+
+
+def client_ip(request: Request) -> str:
+    if RATE_LIMIT_TRUSTED_PROXIES > 0:
+        hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+        if hops:
+            return hops[-min(RATE_LIMIT_TRUSTED_PROXIES, len(hops))]
+    return request.client.host if request.client else "unknown"
+
+
+class RateLimiter:
+    def __init__(self):
+        self._buckets = OrderedDict()  # key -> (tokens, last_refill)
+        self.allowed = Counter()
+        self.throttled = Counter()
+
+    def _take_memory(self, key: str, capacity: float, refill_rate: float) -> float:
+        """Take a token; return 0 if allowed, else seconds until one is available."""
+        now = time.monotonic()
+        tokens, last = self._buckets.pop(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - last) * refill_rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / refill_rate
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > RATE_LIMIT_MAX_KEYS:
+            self._buckets.popitem(last=False)
+        return wait
+
+    async def _take_mongo(self, key: str, capacity: float, refill_rate: float) -> float:
+        now = datetime.now(timezone.utc)
+        elapsed = {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]}
+        refilled = {"$min": [capacity, {"$add": [{"$ifNull": ["$tokens", capacity]}, {"$multiply": [elapsed, refill_rate]}]}]}
+        doc = await db.rate_limits.find_one_and_update(
+            {"key": key},
+            [
+                {"$set": {"tokens": refilled, "updated_at": now}},
+                {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+                {"$set": {
+                    "tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                    # Full again after this long; the TTL index drops idle buckets
+                    "expires_at": now + timedelta(seconds=capacity / refill_rate),
+                }},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+            projection={"_id": 0, "allowed": 1, "tokens": 1},
+        )
+        if doc["allowed"]:
+            return 0.0
+        return (1 - doc["tokens"]) / refill_rate
+
+    async def hit(self, rule: str, identity: str):
+        capacity, refill_rate = RULES[rule]
+        key = f"{rule}:{identity}"
+        if RATE_LIMIT_BACKEND == "mongo":
+            wait = await self._take_mongo(key, capacity, refill_rate)
+        else:
+            wait = self._take_memory(key, capacity, refill_rate)
+        if wait > 0:
+            self.throttled[rule] += 1
+            raise HTTPException(
+                status_code=429,
+                detail="Too many attempts, please try again later",
+                headers={"Retry-After": str(max(1, math.ceil(wait)))},
+            )
+        self.allowed[rule] += 1
+
+    async def enforce(self, request: Request, route: str, email: Optional[str] = None):
+        await self.hit(f"{route}_ip", client_ip(request))
+        if email and f"{route}_email" in RULES:
+            await self.hit(f"{route}_email", email.strip().lower())
+
+    def stats(self) -> dict:
+        return {
+            "backend": RATE_LIMIT_BACKEND,
+            "tracked_keys": len(self._buckets),
+            "allowed": dict(self.allowed),
+            "throttled": dict(self.throttled),
+        }
+
+
+rate_limiter = RateLimiter()
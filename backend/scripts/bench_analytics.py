@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: CPU time to build the /sightings/analytics payload for one
+user, at several history sizes, in three modes:
+
+    legacy        per-document Python loops over every sighting (the original
+                  get_analytics: strptime per sighting, string splitting, Counter passes)
+    rollup-loops  the user_analytics rollup, dates derived with per-date strptime loops
+                  (the reference the tests check against, tests/analytics_reference.py)
+    rollup-numpy  the user_analytics rollup, dates derived in vectorised NumPy
+                  passes (analytics.build_analytics)
+
+Database time is left out: the sightings and the rollup are built in memory
+first, so only the Python work per request is measured.
+
+Usage (from backend/):
+    python scripts/bench_analytics.py [--sizes 1000,10000,100000] [--repeat 5]
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "tests"))
+
+import analytics
+from analytics_reference import rollup_loops
+
+# Fifteen years at most; shorter histories are denser
+MAX_HISTORY_DAYS = 15 * 365
+
+
+def make_sightings(n: int, now: datetime) -> list:
+    rng = random.Random(n)
+    history = min(max(n // 2, 30), MAX_HISTORY_DAYS)
+    sightings = []
+    for _ in range(n):
+        day = now - timedelta(days=int(rng.triangular(0, history, 0)))
+        sightings.append({
+            "user_id": "bench",
+            "train_number": str(rng.randint(1, 5000)),
+            "train_type": rng.choice(["Express", "Freight", "Local", "Intercity", "Regional"]),
+            "traction_type": rng.choice(["Electric", "Diesel", "Steam", None]),
+            "operator": rng.choice(["DB", "SNCF", "NS", "SBB", "ÖBB", "Trenitalia"]),
+            "location": f"Station {rng.randint(1, 400)}",
+            "sighting_date": day.strftime("%Y-%m-%d"),
+            "sighting_time": f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}",
+            "notes": "x" * rng.randint(0, 200),
+            "photos": [],
+            "created_at": day,
+        })
+    return sightings
+
+
+def make_rollup(sightings: list) -> dict:
+    rollup = {"total": len(sightings), "dates": {}, "hours": {}, **{field: {} for field in analytics.DIMENSIONS}}
+    paths = Counter()
+    for s in sightings:
+        paths.update(analytics.counters(s))
+    for path, n in paths.items():
+        if "." in path:
+            section, key = path.split(".", 1)
+            rollup[section][key] = n
+    return rollup
+
+
+def legacy(sightings: list, now: datetime) -> dict:
+    daily_counts = defaultdict(int)
+    monthly_counts = defaultdict(int)
+    for s in sightings:
+        date_str = s.get("sighting_date", "")
+        if date_str:
+            daily_counts[date_str] += 1
+        if len(date_str) >= 7:
+            monthly_counts[date_str[:7]] += 1
+    result = {
+        "sightings_over_time": [{"date": d, "count": daily_counts.get(d, 0)} for d in analytics.recent_days(now)],
+        "monthly_trend": [{"month": m, "count": monthly_counts.get(m, 0)} for m in analytics.recent_months(now)],
+    }
+    for name, field in [("by_train_type", "train_type"), ("by_operator", "operator"), ("by_location", "location")]:
+        result[name] = Counter(s.get(field, "Unknown") for s in sightings).most_common(10)
+    result["by_traction_type"] = Counter(
+        s.get("traction_type") for s in sightings if s.get("traction_type")
+    ).most_common(10)
+
+    hour_counts = defaultdict(int)
+    for s in sightings:
+        t = s.get("sighting_time", "")
+        if t and ":" in t:
+            try:
+                hour_counts[int(t.split(":")[0])] += 1
+            except ValueError:
+                pass
+    result["time_of_day"] = [hour_counts.get(h, 0) for h in range(24)]
+
+    dow_counts = defaultdict(int)
+    for s in sightings:
+        if s.get("sighting_date"):
+            dow_counts[datetime.strptime(s["sighting_date"], "%Y-%m-%d").weekday()] += 1
+    result["day_of_week"] = [dow_counts.get(i, 0) for i in range(7)]
+
+    unique_dates = sorted({s["sighting_date"] for s in sightings if s.get("sighting_date")})
+    longest = streak = 1
+    for prev, curr in zip(unique_dates, unique_dates[1:]):
+        gap = (datetime.strptime(curr, "%Y-%m-%d") - datetime.strptime(prev, "%Y-%m-%d")).days
+        streak = streak + 1 if gap == 1 else 1
+        longest = max(longest, streak)
+    result["streak"] = longest
+    return result
+
+
+def timed(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    now = datetime.now(timezone.utc)
+    print(f"{'sightings':>10} {'dates':>7} {'legacy ms':>10} {'rollup-loops ms':>16} {'rollup-numpy ms':>16}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        sightings = make_sightings(size, now)
+        rollup = make_rollup(sightings)
+        numpy_result = analytics.build_analytics(rollup, now)
+        loops_result = rollup_loops(rollup, now)
+        assert [d["count"] for d in numpy_result["day_of_week"]] == loops_result["day_of_week"]
+        assert numpy_result["streak"] == loops_result["streak"]
+
+        legacy_ms = timed(lambda: legacy(sightings, now), args.repeat)
+        loops_ms = timed(lambda: rollup_loops(rollup, now), args.repeat)
+        numpy_ms = timed(lambda: analytics.build_analytics(rollup, now), args.repeat)
+        print(f"{size:>10} {len(rollup['dates']):>7} {legacy_ms:>10.2f} {loops_ms:>16.2f} {numpy_ms:>16.2f}")
+
+
+if __name__ == "__main__":
+    main()
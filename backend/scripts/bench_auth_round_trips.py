@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: Mongo round trips spent on authentication per request.
+Drives authenticated routes through the ASGI app and counts the commands each
+request sends to Mongo (pymongo command monitoring), in three modes:
+
+    legacy      per-router resolution: user_sessions.find_one + users.find_one, no cache
+    dependency  auth.current_user, cold session cache ($lookup aggregation)
+    cached      auth.current_user, warm session cache
+
+Usage (from backend/):
+    MONGO_URL=mongodb://localhost:27017 python scripts/bench_auth_round_trips.py --requests 200
+
+Seeds a throwaway database (default: bench_auth_round_trips) and drops it afterwards.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx
+from fastapi import HTTPException, Request
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+import auth
+import server
+from session_cache import session_cache
+
+ROUTES = [
+    "/api/auth/me",
+    "/api/sightings?limit=20",
+    "/api/sightings/stats",
+    "/api/sightings/interactions/me",
+    "/api/social/notifications/unread-count",
+    "/api/social/following/me",
+]
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self, db_name):
+        self.db_name = db_name
+        self.count = 0
+
+    def started(self, event):
+        if event.database_name == self.db_name:
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+async def legacy_current_user(request: Request) -> dict:
+    """What each router did before: two queries per call, nothing shared."""
+    token = auth.get_session_token(request)
+    session_doc = await auth.db.user_sessions.find_one({"session_token": token}, {"_id": 0})
+    if not session_doc or auth.session_expiry(session_doc) < datetime.now(timezone.utc):
+        raise HTTPException(status_code=401, detail="Invalid session")
+    return await auth.db.users.find_one({"user_id": session_doc["user_id"]}, {"_id": 0, "password_hash": 0})
+
+
+async def seed(db):
+    now = datetime.now(timezone.utc)
+    user_id = f"user_{uuid.uuid4().hex[:12]}"
+    token = f"session_{uuid.uuid4().hex}"
+    await db.users.insert_one({
+        "user_id": user_id,
+        "email": "bench@tracklog.com",
+        "name": "Bench",
+        "password_hash": "x" * 60,
+        "picture": None,
+        "auth_provider": "email",
+        "created_at": now,
+    })
+    await db.user_sessions.insert_one({
+        "user_id": user_id,
+        "session_token": token,
+        "expires_at": now + timedelta(days=7),
+        "created_at": now,
+    })
+    return token
+
+
+async def run(http, counter, path, n_requests, warm_cache):
+    trips, latencies = [], []
+    for _ in range(n_requests):
+        if not warm_cache:
+            session_cache.clear()
+        counter.count = 0
+        t0 = time.perf_counter()
+        resp = await http.get(path)
+        latencies.append(time.perf_counter() - t0)
+        assert resp.status_code == 200, f"{path}: {resp.status_code} {resp.text[:200]}"
+        trips.append(counter.count)
+    return statistics.mean(trips), statistics.median(latencies) * 1000
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--db", default="bench_auth_round_trips")
+    args = parser.parse_args()
+
+    counter = CommandCounter(args.db)
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"), event_listeners=[counter])
+    db = client[args.db]
+    await client.drop_database(args.db)
+    try:
+        token = await seed(db)
+        server.inject_db(db)
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench.test", cookies={"session_token": token}
+        ) as http:
+            print(f"{'route':<42}{'legacy':>16}{'dependency':>16}{'cached':>16}")
+            for path in ROUTES:
+                row = []
+                for mode in ("legacy", "dependency", "cached"):
+                    if mode == "legacy":
+                        server.app.dependency_overrides[auth.current_user] = legacy_current_user
+                    else:
+                        server.app.dependency_overrides.clear()
+                    if mode == "cached":
+                        await http.get(path)
+                    trips, p50 = await run(http, counter, path, args.requests, warm_cache=mode == "cached")
+                    row.append(f"{trips:.1f} ({p50:.2f}ms)")
+                print(f"{path:<42}" + "".join(f"{cell:>16}" for cell in row))
+    finally:
+        server.app.dependency_overrides.clear()
+        await client.drop_database(args.db)
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
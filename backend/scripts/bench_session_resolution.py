@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: session resolution round trips.
+Compares the legacy two-query path (user_sessions.find_one + users.find_one)
+against the single aggregation ($lookup) path used by auth.resolve_session.
+
+Usage (from backend/):
+    MONGO_URL=mongodb://localhost:27017 python scripts/bench_session_resolution.py \
+        --sessions 2000 --requests 20000 --concurrency 64
+
+Seeds a throwaway database (default: bench_session_resolution) and drops it afterwards.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import auth
+
+
+async def two_query_path(db, session_token):
+    session_doc = await db.user_sessions.find_one({"session_token": session_token}, {"_id": 0})
+    if not session_doc:
+        return None
+    if auth.session_expiry(session_doc) < datetime.now(timezone.utc):
+        return None
+    return await db.users.find_one(
+        {"user_id": session_doc["user_id"]}, {"_id": 0, "password_hash": 0}
+    )
+
+
+async def aggregation_path(db, session_token):
+    docs = await db.user_sessions.aggregate(auth.session_lookup_pipeline(session_token)).to_list(1)
+    if not docs or auth.session_expiry(docs[0]) < datetime.now(timezone.utc):
+        return None
+    return docs[0]["user"][0] if docs[0]["user"] else None
+
+
+async def seed(db, n_sessions):
+    await db.users.create_index("user_id", unique=True)
+    await db.user_sessions.create_index("session_token", unique=True)
+    now = datetime.now(timezone.utc)
+    users, sessions, tokens = [], [], []
+    for i in range(n_sessions):
+        user_id = f"user_{uuid.uuid4().hex[:12]}"
+        token = f"session_{uuid.uuid4().hex}"
+        users.append({
+            "user_id": user_id,
+            "email": f"bench{i}@tracklog.com",
+            "name": f"Bench {i}",
+            "password_hash": "x" * 60,
+            "picture": None,
+            "auth_provider": "email",
+            "created_at": now,
+        })
+        sessions.append({
+            "user_id": user_id,
+            "session_token": token,
+            "expires_at": now + timedelta(days=7),
+            "created_at": now,
+        })
+        tokens.append(token)
+    await db.users.insert_many(users)
+    await db.user_sessions.insert_many(sessions)
+    return tokens
+
+
+async def run(db, resolver, tokens, n_requests, concurrency):
+    latencies = []
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(token):
+        async with sem:
+            t0 = time.perf_counter()
+            user = await resolver(db, token)
+            latencies.append(time.perf_counter() - t0)
+            assert user is not None
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(random.choice(tokens)) for _ in range(n_requests)))
+    elapsed = time.perf_counter() - t0
+    latencies.sort()
+    return {
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "rps": n_requests / elapsed,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--db", default="bench_session_resolution")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    db = client[args.db]
+    await client.drop_database(args.db)
+    try:
+        tokens = await seed(db, args.sessions)
+        # Warm up both paths so connection setup isn't measured
+        await run(db, two_query_path, tokens, 500, args.concurrency)
+        await run(db, aggregation_path, tokens, 500, args.concurrency)
+
+        for name, resolver in (("two find_one", two_query_path), ("$lookup", aggregation_path)):
+            r = await run(db, resolver, tokens, args.requests, args.concurrency)
+            print(f"{name:>14}: p50={r['p50_ms']:.2f}ms  p99={r['p99_ms']:.2f}ms  {r['rps']:.0f} req/s")
+    finally:
+        await client.drop_database(args.db)
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
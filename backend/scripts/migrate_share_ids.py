@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Migration: give every legacy sighting a share_id and an explicit is_public.
+get_sightings used to fill these in lazily, one update_one per document inside
+the GET; the read path no longer writes, so run this once per database.
+
+Resumable: the last processed _id is kept in the migrations collection. Each
+update only sets fields that are still missing, so re-processing a batch is
+harmless. A share_id collision (share_id_unique) is retried with a fresh id.
+
+Usage (from backend/):
+    python scripts/migrate_share_ids.py [--batch-size 500] [--dry-run] [--restart]
+"""
+import asyncio
+import logging
+import sys
+import uuid
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from migration import migrate
+
+logger = logging.getLogger("migrate_share_ids")
+
+MIGRATION = "share_ids"
+MAX_ATTEMPTS = 5
+
+LEGACY = {"$or": [{"share_id": {"$exists": False}}, {"is_public": {"$exists": False}}]}
+
+
+def new_share_id() -> str:
+    return uuid.uuid4().hex[:8]
+
+
+def backfill_updates(batch: list) -> list:
+    """(filter, fields) pairs; the filter only matches while the field is still missing."""
+    updates = []
+    for doc in batch:
+        if "share_id" not in doc:
+            updates.append(({"_id": doc["_id"], "share_id": {"$exists": False}}, {"share_id": new_share_id()}))
+        if "is_public" not in doc:
+            updates.append(({"_id": doc["_id"], "is_public": {"$exists": False}}, {"is_public": False}))
+    return updates
+
+
+async def write(db, updates: list, counts: Counter):
+    for attempt in range(MAX_ATTEMPTS):
+        ops = [UpdateOne(query, {"$set": fields}) for query, fields in updates]
+        try:
+            result = await db.sightings.bulk_write(ops, ordered=False)
+            counts["updated"] += result.modified_count
+            return
+        except BulkWriteError as e:
+            counts["updated"] += e.details.get("nModified", 0)
+            errors = e.details.get("writeErrors", [])
+            if any(error["code"] != 11000 for error in errors):
+                raise
+            # Only share_id is unique: draw new ids for the ones that collided
+            updates = [(updates[error["index"]][0], {"share_id": new_share_id()}) for error in errors]
+            counts["collisions"] += len(updates)
+    raise RuntimeError(f"share_id still colliding after {MAX_ATTEMPTS} attempts")
+
+
+async def run(db, progress, args, counts: Counter):
+    last_id = progress.state.get("last_id")
+    while True:
+        query = {**LEGACY, "_id": {"$gt": last_id}} if last_id is not None else LEGACY
+        batch = await db.sightings.find(
+            query, {"share_id": 1, "is_public": 1}
+        ).sort("_id", 1).limit(args.batch_size).to_list(args.batch_size)
+        if not batch:
+            return
+
+        counts["sightings"] += len(batch)
+        if not args.dry_run:
+            await write(db, backfill_updates(batch), counts)
+            await progress.save(last_id=batch[-1]["_id"])
+        last_id = batch[-1]["_id"]
+        logger.info(f"through {last_id} ({dict(counts)})")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    asyncio.run(migrate(MIGRATION, __doc__, run))
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Migration: give every legacy sighting the typed timestamp fields the write
+paths now store (sighted_at, hour, weekday, year_month; see
+analytics.sighted_fields), parsed from its sighting_date and sighting_time.
+
+Resumable: the last processed _id is kept in the migrations collection. Each
+update only matches while sighted_at is still missing, so a sighting edited
+(and re-derived) by the API in the meantime is left alone, and re-processing a
+batch is harmless. Unparseable dates are stored as None and not retried.
+
+Usage (from backend/):
+    python scripts/migrate_sighted_at.py [--batch-size 500] [--dry-run] [--restart]
+"""
+import asyncio
+import logging
+import sys
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pymongo import UpdateOne
+
+from analytics import sighted_fields
+from migration import migrate
+
+logger = logging.getLogger("migrate_sighted_at")
+
+MIGRATION = "sighted_at"
+
+LEGACY = {"sighted_at": {"$exists": False}}
+
+
+def backfill_updates(batch: list) -> list:
+    return [
+        UpdateOne(
+            {"_id": doc["_id"], **LEGACY},
+            {"$set": sighted_fields(doc.get("sighting_date"), doc.get("sighting_time"))},
+        )
+        for doc in batch
+    ]
+
+
+async def run(db, progress, args, counts: Counter):
+    last_id = progress.state.get("last_id")
+    while True:
+        query = {**LEGACY, "_id": {"$gt": last_id}} if last_id is not None else LEGACY
+        batch = await db.sightings.find(
+            query, {"sighting_date": 1, "sighting_time": 1}
+        ).sort("_id", 1).limit(args.batch_size).to_list(args.batch_size)
+        if not batch:
+            return
+
+        counts["sightings"] += len(batch)
+        counts["unparsed"] += sum(1 for doc in batch if sighted_fields(doc.get("sighting_date"), None)["sighted_at"] is None)
+        if not args.dry_run:
+            result = await db.sightings.bulk_write(backfill_updates(batch), ordered=False)
+            counts["updated"] += result.modified_count
+            await progress.save(last_id=batch[-1]["_id"])
+        last_id = batch[-1]["_id"]
+        logger.info(f"through {last_id} ({dict(counts)})")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    asyncio.run(migrate(MIGRATION, __doc__, run))
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Migration: flat uploads/ layout -> hash-sharded keys (ab/cd/<name>).
+Moves every stored file and rewrites the URLs that point at it, in batches:
+sightings.photos and photo_variants, users.picture, photo_blobs.url.
+
+Resumable: the current phase and last processed _id are kept in the
+migrations collection, so an interrupted run continues where it stopped. A file
+is always moved before the document referencing it is rewritten, and a missing
+source whose sharded copy exists counts as already moved, so re-processing a
+batch is harmless. A document is only rewritten while the fields it was read
+with are unchanged; one the app edited in the meantime is read again and
+rewritten from its current values. Old URLs keep resolving through the
+/api/uploads mount.
+
+Usage (from backend/):
+    python scripts/migrate_upload_layout.py [--batch-size 200] [--dry-run] [--restart]
+"""
+import asyncio
+import logging
+import sys
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pymongo import UpdateOne
+
+from storage import storage, shard_key
+from uploads import UPLOAD_URL_PREFIX, upload_key
+from migration import migrate
+
+logger = logging.getLogger("migrate_upload_layout")
+
+MIGRATION = "upload_layout"
+# Rewrites of one batch, when the app keeps editing its documents meanwhile
+MAX_ATTEMPTS = 5
+
+
+def sharded(url: str) -> Optional[str]:
+    """The sharded URL for a flat upload URL; None if there's nothing to move."""
+    key = upload_key(url)
+    if key is None or "/" in key:
+        return None
+    return UPLOAD_URL_PREFIX + shard_key(key)
+
+
+def rewrite_urls(urls: list, moves: dict) -> list:
+    rewritten = []
+    for url in urls:
+        new_url = sharded(url)
+        if new_url:
+            moves[url] = new_url
+        rewritten.append(new_url or url)
+    return rewritten
+
+
+def rewrite_sighting(doc: dict, moves: dict) -> dict:
+    fields = {}
+    if any(sharded(p) for p in doc.get("photos") or []):
+        fields["photos"] = rewrite_urls(doc["photos"], moves)
+    variants = doc.get("photo_variants") or []
+    if any(sharded(url) for v in variants for url in v.values()):
+        fields["photo_variants"] = [
+            dict(zip(v.keys(), rewrite_urls(list(v.values()), moves))) for v in variants
+        ]
+    return fields
+
+
+def rewrite_user(doc: dict, moves: dict) -> dict:
+    if sharded(doc.get("picture")):
+        return {"picture": rewrite_urls([doc["picture"]], moves)[0]}
+    return {}
+
+
+def rewrite_blob(doc: dict, moves: dict) -> dict:
+    if sharded(doc.get("url")):
+        return {"url": rewrite_urls([doc["url"]], moves)[0]}
+    return {}
+
+
+PHASES = [
+    ("sightings", {"photos": 1, "photo_variants": 1}, rewrite_sighting),
+    ("users", {"picture": 1}, rewrite_user),
+    ("photo_blobs", {"url": 1}, rewrite_blob),
+]
+
+
+async def move(url: str, new_url: str, counts: Counter):
+    key, new_key = upload_key(url), upload_key(new_url)
+    if await storage.move(key, new_key):
+        counts["moved"] += 1
+    elif await storage.exists(new_key):
+        counts["already_moved"] += 1
+    else:
+        counts["missing"] += 1
+        logger.warning(f"{key} not found in storage; rewriting its URL anyway")
+
+
+def unchanged(doc: dict, projection: dict) -> dict:
+    """Filter matching the document only while the fields read from it are unchanged."""
+    return {"_id": doc["_id"], **{field: doc.get(field) for field in projection}}
+
+
+async def rewrite_batch(db, collection: str, projection: dict, rewrite, batch: list, args, counts: Counter) -> list:
+    """Move the batch's files and rewrite its URLs; returns the _ids of documents
+    the app changed in the meantime, which were left alone."""
+    moves, ops, ids = {}, [], []
+    for doc in batch:
+        fields = rewrite(doc, moves)
+        if fields:
+            ops.append(UpdateOne(unchanged(doc, projection), {"$set": fields}))
+            ids.append(doc["_id"])
+
+    if args.dry_run:
+        counts[f"{collection}_rewritten"] += len(ops)
+        counts["files_to_move"] += len(moves)
+        return []
+
+    # Files first: a document never points at a file that isn't there yet
+    semaphore = asyncio.Semaphore(16)
+
+    async def bounded(url, new_url):
+        async with semaphore:
+            await move(url, new_url, counts)
+
+    await asyncio.gather(*(bounded(url, new_url) for url, new_url in moves.items()))
+    if not ops:
+        return []
+    result = await db[collection].bulk_write(ops, ordered=False)
+    counts[f"{collection}_rewritten"] += result.modified_count
+    if result.matched_count == len(ops):
+        return []
+    # Some were edited since the batch was read; the caller re-reads them all
+    # (already rewritten ones now need nothing)
+    return ids
+
+
+async def run_phase(db, progress, collection: str, projection: dict, rewrite, last_id, args, counts: Counter):
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        batch = await db[collection].find(query, projection).sort("_id", 1).limit(args.batch_size).to_list(args.batch_size)
+        if not batch:
+            return
+
+        docs = batch
+        for _ in range(MAX_ATTEMPTS):
+            changed = await rewrite_batch(db, collection, projection, rewrite, docs, args, counts)
+            if not changed:
+                break
+            counts[f"{collection}_reread"] += len(changed)
+            docs = await db[collection].find({"_id": {"$in": changed}}, projection).to_list(len(changed))
+        else:
+            logger.warning(f"{collection}: {len(changed)} documents kept changing; rerun with --restart to finish them")
+        await progress.save(phase=collection, last_id=batch[-1]["_id"])
+        last_id = batch[-1]["_id"]
+        logger.info(f"{collection}: through {last_id} ({dict(counts)})")
+
+
+async def run(db, progress, args, counts: Counter):
+    state = progress.state
+    names = [name for name, _, _ in PHASES]
+    start = names.index(state["phase"]) if state.get("phase") in names else 0
+    for i, (collection, projection, rewrite) in enumerate(PHASES[start:], start):
+        last_id = state.get("last_id") if i == start else None
+        await run_phase(db, progress, collection, projection, rewrite, last_id, args, counts)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    asyncio.run(migrate(MIGRATION, __doc__, run, batch_size=200,
+                        dry_run_help="report what would change, touch nothing"))
@@ -0,0 +1,83 @@
+"""
+Shared scaffolding for the resumable batch migrations in this directory:
+command-line flags, the Mongo client and the progress document each migration
+keeps in the migrations collection ({"name", "last_id", "status": "done", ...}).
+
+A migration provides `run(db, progress, args, counts)`, which resumes from
+progress.state, processes batches and calls progress.save() after each one.
+migrate() handles --restart, skips a migration already marked done and marks
+it done when run() returns.
+"""
+import argparse
+import os
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+# Progress fields cleared by --restart
+PROGRESS_FIELDS = ["status", "finished_at", "phase", "last_id"]
+
+
+class Progress:
+    def __init__(self, db, name: str, state: dict, dry_run: bool):
+        self.db = db
+        self.name = name
+        self.state = state
+        self.dry_run = dry_run
+
+    async def save(self, **fields):
+        """Record a resume point (last_id, and phase for multi-phase migrations)."""
+        if self.dry_run:
+            return
+        await self.db.migrations.update_one(
+            {"name": self.name},
+            {"$set": {**fields, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+
+    async def finish(self, counts: Counter):
+        if self.dry_run:
+            return
+        await self.db.migrations.update_one(
+            {"name": self.name},
+            {"$set": {"status": "done", "finished_at": datetime.now(timezone.utc), "counts": dict(counts)}},
+            upsert=True,
+        )
+
+
+def parse_args(doc: str, batch_size: int, dry_run_help: str) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=doc.splitlines()[1])
+    parser.add_argument("--batch-size", type=int, default=batch_size)
+    parser.add_argument("--dry-run", action="store_true", help=dry_run_help)
+    parser.add_argument("--restart", action="store_true", help="ignore saved progress and scan everything again")
+    return parser.parse_args()
+
+
+async def migrate(name: str, doc: str, run, batch_size: int = 500,
+                  dry_run_help: str = "count legacy sightings, touch nothing"):
+    args = parse_args(doc, batch_size, dry_run_help)
+
+    load_dotenv(Path(__file__).resolve().parent.parent / ".env")
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    db = client[os.environ["DB_NAME"]]
+    try:
+        state = None if args.restart else await db.migrations.find_one({"name": name})
+        if state and state.get("status") == "done":
+            print(f"{name} already completed at {state['finished_at']} (use --restart to scan again)")
+            return
+
+        if args.restart and not args.dry_run:
+            await db.migrations.update_one(
+                {"name": name}, {"$unset": {field: "" for field in PROGRESS_FIELDS}}
+            )
+
+        progress = Progress(db, name, state or {}, args.dry_run)
+        counts = Counter()
+        await run(db, progress, args, counts)
+        await progress.finish(counts)
+        print(f"{'Dry run' if args.dry_run else 'Done'}: {dict(counts)}")
+    finally:
+        client.close()
@@ -1,10 +1,11 @@
 import os
+import asyncio
 import logging
 from contextlib import asynccontextmanager
 from pathlib import Path
 
 from fastapi import FastAPI, APIRouter
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import RedirectResponse
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
@@ -14,12 +15,31 @@ from sightings import sightings_router, set_db as set_sightings_db
 from public import public_router, set_db as set_public_db
 from ai_summary import ai_router, set_db as set_ai_db
 from social import social_router, set_db as set_social_db
+from session_cache import session_cache
+from passwords import password_hasher
+import session_tokens
+from session_tokens import revocations
+import mailer
+from mailer import email_queue
+from oauth_client import oauth_client
+from indexes import apply_indexes
+import purge
+from purge import purge_queue
+import rate_limit
+from rate_limit import rate_limiter
+import uploads
+import analytics
+from platform_stats import platform_stats, set_db as set_platform_stats_db
+from analytics_cache import analytics_cache
+from uploads import UploadLimitMiddleware, photo_store
+import images
+from images import image_pipeline, variant_queue
+from storage import storage, clear_scratch, shard_key, UploadFiles
 
 # --------------------------------------------------
 # Paths & Env
 # --------------------------------------------------
 ROOT_DIR = Path(__file__).resolve().parent
-UPLOADS_DIR = ROOT_DIR / "uploads"
 
 load_dotenv(ROOT_DIR / ".env")
 
@@ -35,6 +55,21 @@ logger = logging.getLogger("server")
 # --------------------------------------------------
 # App Lifecycle (Mongo)
 # --------------------------------------------------
+def inject_db(db):
+    set_auth_db(db)
+    set_sightings_db(db)
+    set_public_db(db)
+    set_ai_db(db)
+    set_social_db(db)
+    session_tokens.set_db(db)
+    mailer.set_db(db)
+    purge.set_db(db)
+    rate_limit.set_db(db)
+    uploads.set_db(db)
+    analytics.set_db(db)
+    images.set_db(db)
+    set_platform_stats_db(db)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     mongo_url = os.getenv("MONGO_URL")
@@ -47,15 +82,40 @@ async def lifespan(app: FastAPI):
     db = client[db_name]
 
     # Inject DB into modules
-    set_auth_db(db)
-    set_sightings_db(db)
-    set_public_db(db)
-    set_ai_db(db)
-    set_social_db(db)
+    inject_db(db)
+
+    await apply_indexes(db)
+
+    if session_tokens.signed_sessions_enabled() and not session_tokens.SESSION_SECRET:
+        raise RuntimeError("SESSION_MODE=signed requires SESSION_SECRET")
+
+    # Keep honouring revocations while signed tokens are still accepted,
+    # even after switching back to opaque sessions
+    revocation_task = None
+    if session_tokens.SESSION_SECRET:
+        await revocations.refresh()
+        revocation_task = asyncio.create_task(revocations.run())
+
+    email_tasks = email_queue.start()
+    oauth_client.start()
+    purge_task = purge_queue.start()
+    variant_task = variant_queue.start()
+    platform_stats_task = platform_stats.start()
+    await asyncio.to_thread(clear_scratch)
 
     logger.info(f"✅ Connected to MongoDB: {db_name}")
     yield
 
+    for task in email_tasks:
+        task.cancel()
+    purge_task.cancel()
+    variant_task.cancel()
+    platform_stats_task.cancel()
+    if revocation_task:
+        revocation_task.cancel()
+    await oauth_client.close()
+    password_hasher.shutdown()
+    image_pipeline.shutdown()
     client.close()
     logger.info("🛑 MongoDB connection closed")
 
@@ -69,11 +129,6 @@ app = FastAPI(
 
 api_router = APIRouter(prefix="/api")
 
-# --------------------------------------------------
-# Ensure uploads dir exists
-# --------------------------------------------------
-os.makedirs(UPLOADS_DIR, exist_ok=True)
-
 # --------------------------------------------------
 # Routers
 # --------------------------------------------------
@@ -86,13 +141,27 @@ api_router.include_router(social_router)
 app.include_router(api_router)
 
 # --------------------------------------------------
-# Static uploads
+# Uploads: served from disk, or redirected to object storage
 # --------------------------------------------------
-app.mount(
-    "/api/uploads",
-    StaticFiles(directory=str(UPLOADS_DIR)),
-    name="uploads",
-)
+if storage.name == "local":
+    os.makedirs(storage.root, exist_ok=True)
+    app.mount(
+        "/api/uploads",
+        UploadFiles(directory=storage.root),
+        name="uploads",
+    )
+else:
+    @app.get("/api/uploads/{key:path}", include_in_schema=False)
+    async def uploaded_file(key: str):
+        # Flat (pre-sharding) keys: follow the file if it has been migrated
+        if "/" not in key and not await storage.exists(key):
+            key = shard_key(key)
+        return RedirectResponse(storage.url(key), status_code=307)
+
+# --------------------------------------------------
+# Upload size limit (multipart bodies)
+# --------------------------------------------------
+app.add_middleware(UploadLimitMiddleware)
 
 # --------------------------------------------------
 # CORS (IMPORTANT FOR EMERGENT)
@@ -111,3 +180,25 @@ app.add_middleware(
 @app.get("/health")
 async def health():
     return {"status": "ok"}
+
+
+# --------------------------------------------------
+# Metrics
+# --------------------------------------------------
+@app.get("/metrics")
+async def metrics():
+    return {
+        "session_cache": session_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+        "sessions": revocations.stats(),
+        "email_queue": await email_queue.stats(),
+        "oauth_upstream": oauth_client.stats(),
+        "account_purge": await purge_queue.stats(),
+        "rate_limits": rate_limiter.stats(),
+        "image_pipeline": image_pipeline.stats(),
+        "photo_variants": await variant_queue.stats(),
+        "photo_store": photo_store.stats(),
+        "storage": storage.stats(),
+        "platform_stats": platform_stats.stats(),
+        "analytics_cache": analytics_cache.stats(),
+    }
@@ -0,0 +1,102 @@
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Bounded TTL/LRU cache of resolved session token -> user document.
+#
+# The cache is per-process: invalidation only reaches the worker that handled
+# the write, so SESSION_CACHE_TTL bounds how stale another worker can be.
+
+SESSION_CACHE_MAX = int(os.environ.get("SESSION_CACHE_MAX", "10000"))
+SESSION_CACHE_TTL = float(os.environ.get("SESSION_CACHE_TTL", "60"))
+
+
+class SessionCache:
+    def __init__(self, maxsize: int = SESSION_CACHE_MAX, ttl: float = SESSION_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # token -> (deadline, user_doc)
+        self._tokens_by_user = {}      # user_id -> set(token)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, session_token: str) -> Optional[dict]:
+        entry = self._entries.get(session_token)
+        if entry is None:
+            self.misses += 1
+            return None
+        deadline, user_doc = entry
+        if deadline <= time.monotonic():
+            self._drop(session_token)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(session_token)
+        self.hits += 1
+        return dict(user_doc)
+
+    def set(self, session_token: str, user_doc: dict, expires_at: Optional[datetime] = None):
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        ttl = self.ttl
+        if expires_at is not None:
+            # Never serve a session past its own expiry
+            remaining = (expires_at - datetime.now(timezone.utc)).total_seconds()
+            ttl = min(ttl, remaining)
+            if ttl <= 0:
+                return
+        if session_token in self._entries:
+            self._drop(session_token)
+        self._entries[session_token] = (time.monotonic() + ttl, dict(user_doc))
+        self._tokens_by_user.setdefault(user_doc["user_id"], set()).add(session_token)
+        while len(self._entries) > self.maxsize:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def invalidate_token(self, session_token: str):
+        if session_token in self._entries:
+            self._drop(session_token)
+            self.invalidations += 1
+
+    def invalidate_user(self, user_id: str):
+        for token in list(self._tokens_by_user.get(user_id, ())):
+            self._drop(token)
+            self.invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._tokens_by_user.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def _drop(self, session_token: str):
+        entry = self._entries.pop(session_token, None)
+        if entry is None:
+            return
+        user_id = entry[1].get("user_id")
+        tokens = self._tokens_by_user.get(user_id)
+        if tokens is not None:
+            tokens.discard(session_token)
+            if not tokens:
+                del self._tokens_by_user[user_id]
+
+
+session_cache = SessionCache()
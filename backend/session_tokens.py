@@ -0,0 +1,127 @@
+import os
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+import jwt
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Optional stateless sessions.
+#
+# With SESSION_MODE=signed the session cookie carries an HS256-signed token
+# (user_id, expiry, jti) that get_current_user verifies in memory instead of
+# looking it up in user_sessions. Logout and password resets still take effect
+# through a small revocation list kept in Mongo (revoked_sessions) and mirrored
+# in memory, refreshed every REVOCATION_REFRESH_SECONDS.
+#
+# Opaque session_<uuid> tokens keep working in either mode, so switching modes
+# doesn't sign anybody out.
+
+SESSION_MODE = os.environ.get("SESSION_MODE", "opaque")
+SESSION_SECRET = os.environ.get("SESSION_SECRET")
+REVOCATION_REFRESH_SECONDS = float(os.environ.get("REVOCATION_REFRESH_SECONDS", "30"))
+
+ALGORITHM = "HS256"
+
+db = None
+
+def set_db(database):
+    global db
+    db = database
+
+def signed_sessions_enabled() -> bool:
+    return SESSION_MODE == "signed"
+
+def is_signed_token(token: str) -> bool:
+    return token.count(".") == 2
+
+def issue_token(user_id: str, expires_at: datetime) -> str:
+    now = datetime.now(timezone.utc)
+    claims = {
+        "sub": user_id,
+        "jti": uuid.uuid4().hex,
+        "iat": now.timestamp(),
+        "exp": int(expires_at.timestamp()),
+    }
+    return jwt.encode(claims, SESSION_SECRET, algorithm=ALGORITHM)
+
+def decode_token(token: str, verify_exp: bool = True) -> dict:
+    """Raises jwt.ExpiredSignatureError / jwt.InvalidTokenError."""
+    return jwt.decode(
+        token,
+        SESSION_SECRET,
+        algorithms=[ALGORITHM],
+        options={"require": ["sub", "jti", "iat", "exp"], "verify_exp": verify_exp},
+    )
+
+
+class RevocationList:
+    def __init__(self):
+        self._jtis = {}          # jti -> expires_at
+        self._user_cutoffs = {}  # user_id -> tokens issued before this are revoked
+        self.last_refresh: Optional[datetime] = None
+
+    def is_revoked(self, claims: dict) -> bool:
+        if claims["jti"] in self._jtis:
+            return True
+        cutoff = self._user_cutoffs.get(claims["sub"])
+        return cutoff is not None and claims["iat"] < cutoff.timestamp()
+
+    async def revoke_token(self, claims: dict):
+        expires_at = datetime.fromtimestamp(claims["exp"], tz=timezone.utc)
+        self._jtis[claims["jti"]] = expires_at
+        await db.revoked_sessions.update_one(
+            {"jti": claims["jti"]},
+            {"$set": {"jti": claims["jti"], "expires_at": expires_at}},
+            upsert=True,
+        )
+
+    async def revoke_user(self, user_id: str, expires_at: datetime):
+        """Revoke every token issued to user_id so far. expires_at should be the
+        latest expiry any such token can have."""
+        now = datetime.now(timezone.utc)
+        self._user_cutoffs[user_id] = now
+        await db.revoked_sessions.update_one(
+            {"user_id": user_id},
+            {"$set": {"user_id": user_id, "not_before": now, "expires_at": expires_at}},
+            upsert=True,
+        )
+
+    async def refresh(self):
+        now = datetime.now(timezone.utc)
+        jtis, cutoffs = {}, {}
+        async for doc in db.revoked_sessions.find({"expires_at": {"$gt": now}}, {"_id": 0}):
+            if doc.get("jti"):
+                jtis[doc["jti"]] = doc["expires_at"]
+            elif doc.get("user_id"):
+                not_before = doc["not_before"]
+                if not_before.tzinfo is None:
+                    not_before = not_before.replace(tzinfo=timezone.utc)
+                cutoffs[doc["user_id"]] = not_before
+        self._jtis, self._user_cutoffs = jtis, cutoffs
+        self.last_refresh = now
+
+    async def run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Failed to refresh session revocation list: {e}")
+            await asyncio.sleep(REVOCATION_REFRESH_SECONDS)
+
+    def stats(self) -> dict:
+        return {
+            "mode": SESSION_MODE,
+            "revoked_tokens": len(self._jtis),
+            "revoked_users": len(self._user_cutoffs),
+            "last_refresh": self.last_refresh.isoformat() if self.last_refresh else None,
+        }
+
+
+revocations = RevocationList()
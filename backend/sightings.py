@@ -1,12 +1,20 @@
-from fastapi import APIRouter, HTTPException, Request, Form, File, UploadFile
-from pydantic import BaseModel
-from typing import Optional, List
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ValidationError
+from typing import Optional, List, Tuple, Union
 from datetime import datetime, timezone
-import uuid
-import os
 import base64
+import binascii
+import uuid
 import logging
 
+from auth import current_user
+from social import create_notification
+from uploads import receive_photo_form, delete_uploads, ingest_photos, diff_photos, photo_store
+from images import variant_queue, variant_urls, variant_files
+import analytics
+from analytics_cache import analytics_cache
+
 logger = logging.getLogger(__name__)
 
 sightings_router = APIRouter(prefix="/sightings", tags=["sightings"])
@@ -17,6 +25,19 @@ def set_db(database):
     global db
     db = database
 
+def encode_cursor(sighting: dict) -> str:
+    """Opaque position after `sighting` in the newest-first list."""
+    raw = f"{sighting['created_at'].isoformat()}|{sighting['sighting_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, sighting_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), sighting_id
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 # Models
 class SightingCreate(BaseModel):
     train_number: str
@@ -31,6 +52,19 @@ class SightingCreate(BaseModel):
     photos: List[str] = []
     is_public: bool = False
 
+class SightingForm(BaseModel):
+    """Text fields of the multipart /sightings/upload form."""
+    train_number: str
+    train_type: str
+    traction_type: str
+    operator: str
+    location: str
+    sighting_date: str
+    sighting_time: str
+    route: str = ""
+    notes: str = ""
+    is_public: bool = False
+
 class SightingResponse(BaseModel):
     sighting_id: str
     user_id: str
@@ -42,12 +76,17 @@ class SightingResponse(BaseModel):
     location: str
     sighting_date: str
     sighting_time: str
+    sighted_at: Optional[datetime] = None
     notes: Optional[str] = None
     photos: List[str] = []
     is_public: bool = False
     share_id: Optional[str] = None
     created_at: datetime
 
+class SightingPage(BaseModel):
+    sightings: List[SightingResponse]
+    next_cursor: Optional[str] = None
+
 class SightingStats(BaseModel):
     total_sightings: int
     this_month: int
@@ -58,39 +97,13 @@ class SightingStats(BaseModel):
     top_operators: List[dict] = []
     top_locations: List[dict] = []
 
-async def get_current_user_id(request: Request) -> str:
-    from auth import get_current_user
-    user = await get_current_user(request)
-    return user["user_id"]
-
 @sightings_router.post("", response_model=SightingResponse)
-async def create_sighting(sighting_data: SightingCreate, request: Request):
-    try:
-        user_id = await get_current_user_id(request)
-    except Exception as e:
-        logger.error(f"Auth error in create_sighting: {e}")
-        raise
+async def create_sighting(sighting_data: SightingCreate, user: dict = Depends(current_user)):
+    user_id = user["user_id"]
     
     sighting_id = f"sighting_{uuid.uuid4().hex[:12]}"
     
-    upload_dir = "/app/backend/uploads"
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    saved_photos = []
-    for i, photo in enumerate(sighting_data.photos):
-        if photo.startswith("data:image"):
-            try:
-                header, data = photo.split(",", 1)
-                ext = "jpg" if "jpeg" in header else "png"
-                filename = f"{sighting_id}_{i}.{ext}"
-                filepath = os.path.join(upload_dir, filename)
-                with open(filepath, "wb") as f:
-                    f.write(base64.b64decode(data))
-                saved_photos.append(f"/api/uploads/{filename}")
-            except Exception as e:
-                logger.error(f"Error saving photo: {e}")
-        elif photo:
-            saved_photos.append(photo)
+    saved_photos = await ingest_photos(sighting_data.photos)
     
     sighting_doc = {
         "sighting_id": sighting_id,
@@ -103,8 +116,12 @@ async def create_sighting(sighting_data: SightingCreate, request: Request):
         "location": sighting_data.location,
         "sighting_date": sighting_data.sighting_date,
         "sighting_time": sighting_data.sighting_time,
+        **analytics.sighted_fields(sighting_data.sighting_date, sighting_data.sighting_time),
         "notes": sighting_data.notes,
         "photos": saved_photos,
+        # Rendered in the background by images.variant_queue
+        "photo_variants": [],
+        "variants_pending": bool(saved_photos),
         "is_public": sighting_data.is_public,
         "share_id": uuid.uuid4().hex[:8],
         "created_at": datetime.now(timezone.utc)
@@ -115,260 +132,111 @@ async def create_sighting(sighting_data: SightingCreate, request: Request):
     except Exception as e:
         logger.error(f"MongoDB insert error: {e}")
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    await analytics.record_created(sighting_doc)
+    if saved_photos:
+        variant_queue.wake()
     
     sighting_doc.pop("_id", None)
     return SightingResponse(**sighting_doc)
 
 @sightings_router.post("/upload", response_model=SightingResponse)
-async def create_sighting_with_files(
-    request: Request,
-    train_number: str = Form(...),
-    train_type: str = Form(...),
-    traction_type: str = Form(...),
-    operator: str = Form(...),
-    location: str = Form(...),
-    sighting_date: str = Form(...),
-    sighting_time: str = Form(...),
-    route: str = Form(""),
-    notes: str = Form(""),
-    is_public: bool = Form(False),
-    photos: List[UploadFile] = File(default=[]),
-):
-    user_id = await get_current_user_id(request)
+async def create_sighting_with_files(request: Request, user: dict = Depends(current_user)):
+    """multipart/form-data: the SightingForm fields plus any number of `photos`
+    files, streamed into storage as they arrive (uploads.receive_photo_form)."""
+    user_id = user["user_id"]
     sighting_id = f"sighting_{uuid.uuid4().hex[:12]}"
     
-    upload_dir = "/app/backend/uploads"
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    saved_photos = []
-    for i, photo in enumerate(photos):
-        if photo.filename:
-            try:
-                ext = photo.filename.rsplit(".", 1)[-1] if "." in photo.filename else "jpg"
-                filename = f"{sighting_id}_{i}.{ext}"
-                filepath = os.path.join(upload_dir, filename)
-                content = await photo.read()
-                with open(filepath, "wb") as f:
-                    f.write(content)
-                saved_photos.append(f"/api/uploads/{filename}")
-            except Exception as e:
-                logger.error(f"Error saving uploaded photo: {e}")
+    fields, saved_photos = await receive_photo_form(request)
+    try:
+        form = SightingForm(**fields)
+    except ValidationError as e:
+        await photo_store.release(saved_photos)
+        raise RequestValidationError([{**error, "loc": ("body", *error["loc"])} for error in e.errors()])
     
     sighting_doc = {
         "sighting_id": sighting_id,
         "user_id": user_id,
-        "train_number": train_number,
-        "train_type": train_type,
-        "traction_type": traction_type,
-        "operator": operator,
-        "route": route or None,
-        "location": location,
-        "sighting_date": sighting_date,
-        "sighting_time": sighting_time,
-        "notes": notes or None,
+        "train_number": form.train_number,
+        "train_type": form.train_type,
+        "traction_type": form.traction_type,
+        "operator": form.operator,
+        "route": form.route or None,
+        "location": form.location,
+        "sighting_date": form.sighting_date,
+        "sighting_time": form.sighting_time,
+        **analytics.sighted_fields(form.sighting_date, form.sighting_time),
+        "notes": form.notes or None,
         "photos": saved_photos,
-        "is_public": is_public,
+        # Rendered in the background by images.variant_queue
+        "photo_variants": [],
+        "variants_pending": bool(saved_photos),
+        "is_public": form.is_public,
         "share_id": uuid.uuid4().hex[:8],
         "created_at": datetime.now(timezone.utc)
     }
     
     await db.sightings.insert_one(sighting_doc)
+    await analytics.record_created(sighting_doc)
+    if saved_photos:
+        variant_queue.wake()
     sighting_doc.pop("_id", None)
     return SightingResponse(**sighting_doc)
 
-@sightings_router.get("", response_model=List[SightingResponse])
-async def get_sightings(request: Request, limit: int = 100, skip: int = 0):
-    user_id = await get_current_user_id(request)
-    sightings = await db.sightings.find(
-        {"user_id": user_id}, {"_id": 0}
-    ).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    results = []
-    for s in sightings:
-        if "share_id" not in s:
-            s["share_id"] = uuid.uuid4().hex[:8]
-            s["is_public"] = s.get("is_public", False)
-            await db.sightings.update_one(
-                {"sighting_id": s["sighting_id"]},
-                {"$set": {"share_id": s["share_id"], "is_public": s["is_public"]}}
-            )
-        results.append(SightingResponse(**s))
-    return results
+@sightings_router.get("", response_model=Union[List[SightingResponse], SightingPage])
+async def get_sightings(
+    user: dict = Depends(current_user), limit: int = 100, skip: int = 0, cursor: Optional[str] = None
+):
+    """Newest first. Passing `cursor` (empty for the first page) switches to
+    keyset paging: the response becomes {"sightings", "next_cursor"} and each
+    page costs the same however deep it is. Plain limit/skip still returns a list."""
+    user_id = user["user_id"]
+    query = {"user_id": user_id}
+    if cursor:
+        created_at, sighting_id = decode_cursor(cursor)
+        # The $lte bound keeps this a single index range; $or only settles ties
+        query["created_at"] = {"$lte": created_at}
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "sighting_id": {"$lt": sighting_id}},
+        ]
+    find = db.sightings.find(query, {"_id": 0}).sort([("created_at", -1), ("sighting_id", -1)])
+    if cursor is None:
+        find = find.skip(skip)
+    sightings = await find.limit(limit).to_list(limit)
+    # Legacy documents are backfilled by scripts/migrate_share_ids.py (share_id)
+    # and scripts/migrate_sighted_at.py (sighted_at and its derived fields)
+    results = [SightingResponse(**s) for s in sightings]
+    if cursor is None:
+        return results
+    next_cursor = encode_cursor(sightings[-1]) if limit and len(sightings) == limit else None
+    return SightingPage(sightings=results, next_cursor=next_cursor)
+
+def conditional(request: Request, response: Response, etag: str, payload):
+    """304 if the client already holds `etag`; otherwise the payload, tagged.
+    no-cache makes browsers revalidate each time instead of trusting their copy."""
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        analytics_cache.not_modified += 1
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return payload
 
 @sightings_router.get("/stats", response_model=SightingStats)
-async def get_sighting_stats(request: Request):
-    user_id = await get_current_user_id(request)
-    sightings = await db.sightings.find({"user_id": user_id}, {"_id": 0}).to_list(1000)
-    
-    if not sightings:
-        return SightingStats(
-            total_sightings=0, this_month=0, unique_locations=0,
-            unique_trains=0, last_sighting=None,
-            top_train_types=[], top_operators=[], top_locations=[]
-        )
-    
-    total = len(sightings)
-    now = datetime.now(timezone.utc)
-    current_month = now.strftime("%Y-%m")
-    this_month = sum(1 for s in sightings if s["sighting_date"].startswith(current_month))
-    unique_locations = len(set(s["location"] for s in sightings))
-    unique_trains = len(set(s["train_number"] for s in sightings))
-    last_sighting = max(s["created_at"] for s in sightings) if sightings else None
-    
-    train_type_counts = {}
-    operator_counts = {}
-    location_counts = {}
-    
-    for s in sightings:
-        t = s["train_type"]
-        train_type_counts[t] = train_type_counts.get(t, 0) + 1
-        o = s["operator"]
-        operator_counts[o] = operator_counts.get(o, 0) + 1
-        loc = s["location"]
-        location_counts[loc] = location_counts.get(loc, 0) + 1
-    
-    top_train_types = [{"name": k, "count": v} for k, v in sorted(train_type_counts.items(), key=lambda x: -x[1])[:5]]
-    top_operators = [{"name": k, "count": v} for k, v in sorted(operator_counts.items(), key=lambda x: -x[1])[:5]]
-    top_locations = [{"name": k, "count": v} for k, v in sorted(location_counts.items(), key=lambda x: -x[1])[:5]]
-    
-    return SightingStats(
-        total_sightings=total, this_month=this_month,
-        unique_locations=unique_locations, unique_trains=unique_trains,
-        last_sighting=last_sighting,
-        top_train_types=top_train_types, top_operators=top_operators, top_locations=top_locations
-    )
+async def get_sighting_stats(request: Request, response: Response, user: dict = Depends(current_user)):
+    etag, payload = await analytics.stats_payload(user["user_id"])
+    return conditional(request, response, etag, payload)
 
 @sightings_router.get("/analytics")
-async def get_analytics(request: Request):
-    user_id = await get_current_user_id(request)
-    sightings = await db.sightings.find({"user_id": user_id}, {"_id": 0}).to_list(5000)
-
-    # Platform-wide stats
-    all_count = await db.sightings.count_documents({})
-    all_users = await db.users.count_documents({})
-
-    if not sightings:
-        return {
-            "sightings_over_time": [],
-            "by_train_type": [],
-            "by_traction_type": [],
-            "by_operator": [],
-            "by_location": [],
-            "time_of_day": [],
-            "day_of_week": [],
-            "streak": {"current": 0, "longest": 0},
-            "monthly_trend": [],
-            "platform": {"total_sightings": all_count, "total_users": all_users},
-        }
-
-    from collections import Counter, defaultdict
-
-    # Sightings over time (last 30 days)
-    now = datetime.now(timezone.utc)
-    daily_counts = defaultdict(int)
-    for s in sightings:
-        date_str = s.get("sighting_date", "")
-        if date_str:
-            daily_counts[date_str] += 1
-
-    sightings_over_time = []
-    for i in range(29, -1, -1):
-        d = now - __import__('datetime').timedelta(days=i)
-        ds = d.strftime("%Y-%m-%d")
-        sightings_over_time.append({"date": ds, "count": daily_counts.get(ds, 0)})
-
-    # Monthly trend (last 12 months)
-    monthly_counts = defaultdict(int)
-    for s in sightings:
-        date_str = s.get("sighting_date", "")
-        if len(date_str) >= 7:
-            monthly_counts[date_str[:7]] += 1
-    monthly_trend = []
-    for i in range(11, -1, -1):
-        d = now - __import__('datetime').timedelta(days=i * 30)
-        ms = d.strftime("%Y-%m")
-        monthly_trend.append({"month": ms, "count": monthly_counts.get(ms, 0)})
-
-    # Breakdowns
-    by_train_type = [{"name": k, "count": v} for k, v in Counter(s.get("train_type", "Unknown") for s in sightings).most_common(10)]
-    by_traction_type = [{"name": k, "count": v} for k, v in Counter(s.get("traction_type", "Unknown") for s in sightings if s.get("traction_type")).most_common(10)]
-    by_operator = [{"name": k, "count": v} for k, v in Counter(s.get("operator", "Unknown") for s in sightings).most_common(10)]
-    by_location = [{"name": k, "count": v} for k, v in Counter(s.get("location", "Unknown") for s in sightings).most_common(10)]
-
-    # Time of day distribution (hourly buckets)
-    hour_counts = defaultdict(int)
-    for s in sightings:
-        t = s.get("sighting_time", "")
-        if t and ":" in t:
-            try:
-                hour = int(t.split(":")[0])
-                hour_counts[hour] += 1
-            except ValueError:
-                pass
-    time_of_day = [{"hour": h, "label": f"{h:02d}:00", "count": hour_counts.get(h, 0)} for h in range(24)]
-
-    # Day of week distribution
-    day_names = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
-    dow_counts = defaultdict(int)
-    for s in sightings:
-        date_str = s.get("sighting_date", "")
-        if date_str:
-            try:
-                d = datetime.strptime(date_str, "%Y-%m-%d")
-                dow_counts[d.weekday()] += 1
-            except ValueError:
-                pass
-    day_of_week = [{"day": day_names[i], "count": dow_counts.get(i, 0)} for i in range(7)]
-
-    # Streak calculation
-    unique_dates = sorted(set(s.get("sighting_date", "") for s in sightings if s.get("sighting_date")), reverse=True)
-    current_streak = 0
-    longest_streak = 0
-    streak = 0
-    if unique_dates:
-        today = now.strftime("%Y-%m-%d")
-        yesterday = (now - __import__('datetime').timedelta(days=1)).strftime("%Y-%m-%d")
-        # Current streak
-        if unique_dates[0] in (today, yesterday):
-            current_streak = 1
-            for i in range(1, len(unique_dates)):
-                prev = datetime.strptime(unique_dates[i - 1], "%Y-%m-%d")
-                curr = datetime.strptime(unique_dates[i], "%Y-%m-%d")
-                if (prev - curr).days == 1:
-                    current_streak += 1
-                else:
-                    break
-        # Longest streak
-        sorted_asc = sorted(unique_dates)
-        streak = 1
-        longest_streak = 1
-        for i in range(1, len(sorted_asc)):
-            prev = datetime.strptime(sorted_asc[i - 1], "%Y-%m-%d")
-            curr = datetime.strptime(sorted_asc[i], "%Y-%m-%d")
-            if (curr - prev).days == 1:
-                streak += 1
-                longest_streak = max(longest_streak, streak)
-            else:
-                streak = 1
-
-    return {
-        "sightings_over_time": sightings_over_time,
-        "monthly_trend": monthly_trend,
-        "by_train_type": by_train_type,
-        "by_traction_type": by_traction_type,
-        "by_operator": by_operator,
-        "by_location": by_location,
-        "time_of_day": time_of_day,
-        "day_of_week": day_of_week,
-        "streak": {"current": current_streak, "longest": longest_streak},
-        "platform": {"total_sightings": all_count, "total_users": all_users},
-    }
+async def get_analytics(request: Request, response: Response, user: dict = Depends(current_user)):
+    etag, payload = await analytics.analytics_payload(user["user_id"])
+    return conditional(request, response, etag, payload)
 
 
 # ── Like / Bookmark (static paths MUST come before /{sighting_id}) ──
 
 @sightings_router.get("/interactions/me")
-async def get_my_interactions(request: Request):
-    user_id = await get_current_user_id(request)
+async def get_my_interactions(user: dict = Depends(current_user)):
+    user_id = user["user_id"]
     liked = await db.likes.find({"user_id": user_id}, {"_id": 0, "sighting_id": 1}).to_list(5000)
     bookmarked = await db.bookmarks.find({"user_id": user_id}, {"_id": 0, "sighting_id": 1}).to_list(5000)
     return {
@@ -378,8 +246,8 @@ async def get_my_interactions(request: Request):
 
 
 @sightings_router.get("/bookmarks/me")
-async def get_my_bookmarks(request: Request):
-    user_id = await get_current_user_id(request)
+async def get_my_bookmarks(user: dict = Depends(current_user)):
+    user_id = user["user_id"]
     bookmarks = await db.bookmarks.find(
         {"user_id": user_id}, {"_id": 0}
     ).sort("created_at", -1).to_list(500)
@@ -411,7 +279,7 @@ async def get_my_bookmarks(request: Request):
             "sighting_date": s["sighting_date"],
             "sighting_time": s["sighting_time"],
             "notes": s.get("notes"),
-            "photos": s.get("photos", []),
+            "photos": variant_urls(s, "thumb"),
             "like_count": max(s.get("like_count", 0), 0),
             "created_at": s["created_at"].isoformat() if hasattr(s.get("created_at"), "isoformat") else str(s.get("created_at", "")),
             "owner_name": owner.get("name", "Unknown"),
@@ -423,8 +291,8 @@ async def get_my_bookmarks(request: Request):
 # ── Dynamic /{sighting_id} routes ────────────────────────────────
 
 @sightings_router.get("/{sighting_id}", response_model=SightingResponse)
-async def get_sighting(sighting_id: str, request: Request):
-    user_id = await get_current_user_id(request)
+async def get_sighting(sighting_id: str, user: dict = Depends(current_user)):
+    user_id = user["user_id"]
     sighting = await db.sightings.find_one(
         {"sighting_id": sighting_id, "user_id": user_id}, {"_id": 0}
     )
@@ -433,25 +301,21 @@ async def get_sighting(sighting_id: str, request: Request):
     return SightingResponse(**sighting)
 
 @sightings_router.delete("/{sighting_id}")
-async def delete_sighting(sighting_id: str, request: Request):
-    user_id = await get_current_user_id(request)
+async def delete_sighting(sighting_id: str, user: dict = Depends(current_user)):
+    user_id = user["user_id"]
     sighting = await db.sightings.find_one(
         {"sighting_id": sighting_id, "user_id": user_id}, {"_id": 0}
     )
     if not sighting:
         raise HTTPException(status_code=404, detail="Sighting not found")
     
-    for photo in sighting.get("photos", []):
-        if photo.startswith("/api/uploads/"):
-            filename = photo.replace("/api/uploads/", "")
-            filepath = f"/app/backend/uploads/{filename}"
-            if os.path.exists(filepath):
-                try:
-                    os.remove(filepath)
-                except:
-                    pass
+    result = await db.sightings.delete_one({"sighting_id": sighting_id, "user_id": user_id})
+    if result.deleted_count:
+        await analytics.record_deleted(sighting)
     
-    await db.sightings.delete_one({"sighting_id": sighting_id, "user_id": user_id})
+    released = await photo_store.release(sighting.get("photos", []))
+    variants = [v for v in sighting.get("photo_variants") or [] if v["original"] in released]
+    await delete_uploads(variant_files(variants))
     return {"message": "Sighting deleted successfully"}
 
 
@@ -473,8 +337,8 @@ class SightingUpdate(BaseModel):
 
 
 @sightings_router.put("/{sighting_id}")
-async def update_sighting(sighting_id: str, data: SightingUpdate, request: Request):
-    user_id = await get_current_user_id(request)
+async def update_sighting(sighting_id: str, data: SightingUpdate, user: dict = Depends(current_user)):
+    user_id = user["user_id"]
     sighting = await db.sightings.find_one(
         {"sighting_id": sighting_id, "user_id": user_id}, {"_id": 0}
     )
@@ -482,47 +346,22 @@ async def update_sighting(sighting_id: str, data: SightingUpdate, request: Reque
         raise HTTPException(status_code=404, detail="Sighting not found")
 
     update_fields = {}
-    upload_dir = "/app/backend/uploads"
-    os.makedirs(upload_dir, exist_ok=True)
 
     dumped = data.model_dump(exclude_unset=True)
 
     # Handle photos separately
     if "photos" in dumped and dumped["photos"] is not None:
         incoming = dumped.pop("photos")
-        old_photos = set(sighting.get("photos", []))
-        kept = []
-        new_saved = []
-
-        for photo in incoming:
-            if photo.startswith("data:image"):
-                # New base64 photo
-                try:
-                    header, b64data = photo.split(",", 1)
-                    ext = "jpg" if "jpeg" in header else "png"
-                    filename = f"{sighting_id}_{uuid.uuid4().hex[:6]}.{ext}"
-                    filepath = os.path.join(upload_dir, filename)
-                    with open(filepath, "wb") as f:
-                        f.write(base64.b64decode(b64data))
-                    new_saved.append(f"/api/uploads/{filename}")
-                except Exception as e:
-                    logger.error(f"Error saving new photo: {e}")
-            elif photo:
-                kept.append(photo)
-
-        # Delete removed photos from disk
-        removed = old_photos - set(kept)
-        for photo in removed:
-            if photo.startswith("/api/uploads/"):
-                filename = photo.replace("/api/uploads/", "")
-                filepath = os.path.join(upload_dir, filename)
-                if os.path.exists(filepath):
-                    try:
-                        os.remove(filepath)
-                    except Exception:
-                        pass
+        old_photos = sighting.get("photos", [])
+        kept, added, removed_photos = diff_photos(old_photos, incoming)
+        # New base64 photos are stored; other new URLs gain a reference
+        new_saved = await ingest_photos(added)
+        old_variants = sighting.get("photo_variants") or []
 
         update_fields["photos"] = kept + new_saved
+        update_fields["photo_variants"] = [v for v in old_variants if v["original"] in kept]
+        if new_saved:
+            update_fields["variants_pending"] = True
 
     for field, value in dumped.items():
         if value is not None:
@@ -531,17 +370,31 @@ async def update_sighting(sighting_id: str, data: SightingUpdate, request: Reque
     if not update_fields:
         raise HTTPException(status_code=400, detail="No fields to update")
 
+    if "sighting_date" in update_fields or "sighting_time" in update_fields:
+        update_fields.update(analytics.sighted_fields(
+            update_fields.get("sighting_date", sighting.get("sighting_date")),
+            update_fields.get("sighting_time", sighting.get("sighting_time")),
+        ))
+
     await db.sightings.update_one(
         {"sighting_id": sighting_id},
         {"$set": update_fields},
     )
+
+    if "photos" in update_fields:
+        # Release removed photos; a file is deleted once nothing references it
+        released = await photo_store.release(removed_photos)
+        await delete_uploads(variant_files([v for v in old_variants if v["original"] in released]))
+        if new_saved:
+            variant_queue.wake()
     updated = await db.sightings.find_one({"sighting_id": sighting_id}, {"_id": 0})
+    await analytics.record_updated(sighting, updated)
     return SightingResponse(**updated)
 
 
 @sightings_router.put("/{sighting_id}/visibility")
-async def toggle_sighting_visibility(sighting_id: str, data: VisibilityUpdate, request: Request):
-    user_id = await get_current_user_id(request)
+async def toggle_sighting_visibility(sighting_id: str, data: VisibilityUpdate, user: dict = Depends(current_user)):
+    user_id = user["user_id"]
     sighting = await db.sightings.find_one(
         {"sighting_id": sighting_id, "user_id": user_id}, {"_id": 0}
     )
@@ -558,9 +411,7 @@ async def toggle_sighting_visibility(sighting_id: str, data: VisibilityUpdate, r
 # ── Like / Bookmark ──────────────────────────────────────────────
 
 @sightings_router.post("/{sighting_id}/like")
-async def toggle_like(sighting_id: str, request: Request):
-    from auth import get_current_user
-    user = await get_current_user(request)
+async def toggle_like(sighting_id: str, user: dict = Depends(current_user)):
     user_id = user["user_id"]
     existing = await db.likes.find_one({"user_id": user_id, "sighting_id": sighting_id})
     if existing:
@@ -581,7 +432,6 @@ async def toggle_like(sighting_id: str, request: Request):
         # Notify sighting owner
         sighting_doc = await db.sightings.find_one({"sighting_id": sighting_id}, {"_id": 0, "user_id": 1, "train_number": 1})
         if sighting_doc:
-            from social import create_notification
             await create_notification(
                 user_id=sighting_doc["user_id"],
                 notif_type="like",
@@ -594,9 +444,7 @@ async def toggle_like(sighting_id: str, request: Request):
 
 
 @sightings_router.post("/{sighting_id}/bookmark")
-async def toggle_bookmark(sighting_id: str, request: Request):
-    from auth import get_current_user
-    user = await get_current_user(request)
+async def toggle_bookmark(sighting_id: str, user: dict = Depends(current_user)):
     user_id = user["user_id"]
     existing = await db.bookmarks.find_one({"user_id": user_id, "sighting_id": sighting_id})
     if existing:
@@ -612,7 +460,6 @@ async def toggle_bookmark(sighting_id: str, request: Request):
         # Notify sighting owner
         sighting_doc = await db.sightings.find_one({"sighting_id": sighting_id}, {"_id": 0, "user_id": 1, "train_number": 1})
         if sighting_doc:
-            from social import create_notification
             await create_notification(
                 user_id=sighting_doc["user_id"],
                 notif_type="bookmark",
@@ -1,9 +1,11 @@
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from datetime import datetime, timezone
 import uuid
 import logging
 
+from auth import current_user
+
 logger = logging.getLogger(__name__)
 
 social_router = APIRouter(prefix="/social", tags=["social"])
@@ -15,11 +17,6 @@ def set_db(database):
     db = database
 
 
-async def get_current_user(request: Request) -> dict:
-    from auth import get_current_user as auth_get_user
-    return await auth_get_user(request)
-
-
 # ── Helpers ──────────────────────────────────────────────────────
 
 async def create_notification(
@@ -50,8 +47,7 @@ async def create_notification(
 # ── Follow ───────────────────────────────────────────────────────
 
 @social_router.post("/follow/{target_user_id}")
-async def toggle_follow(target_user_id: str, request: Request):
-    user = await get_current_user(request)
+async def toggle_follow(target_user_id: str, user: dict = Depends(current_user)):
     user_id = user["user_id"]
     if user_id == target_user_id:
         raise HTTPException(status_code=400, detail="Cannot follow yourself")
@@ -83,8 +79,7 @@ async def toggle_follow(target_user_id: str, request: Request):
 
 
 @social_router.get("/following/me")
-async def get_my_following(request: Request):
-    user = await get_current_user(request)
+async def get_my_following(user: dict = Depends(current_user)):
     docs = await db.follows.find(
         {"follower_id": user["user_id"]}, {"_id": 0, "following_id": 1}
     ).to_list(5000)
@@ -136,8 +131,7 @@ async def get_follower_count(user_id: str):
 # ── Notifications ────────────────────────────────────────────────
 
 @social_router.get("/notifications")
-async def get_notifications(request: Request, limit: int = 30):
-    user = await get_current_user(request)
+async def get_notifications(user: dict = Depends(current_user), limit: int = 30):
     notifs = await db.notifications.find(
         {"user_id": user["user_id"]}, {"_id": 0}
     ).sort("created_at", -1).limit(limit).to_list(limit)
@@ -148,8 +142,7 @@ async def get_notifications(request: Request, limit: int = 30):
 
 
 @social_router.get("/notifications/unread-count")
-async def get_unread_count(request: Request):
-    user = await get_current_user(request)
+async def get_unread_count(user: dict = Depends(current_user)):
     count = await db.notifications.count_documents(
         {"user_id": user["user_id"], "read": False}
     )
@@ -157,8 +150,7 @@ async def get_unread_count(request: Request):
 
 
 @social_router.put("/notifications/read")
-async def mark_all_read(request: Request):
-    user = await get_current_user(request)
+async def mark_all_read(user: dict = Depends(current_user)):
     await db.notifications.update_many(
         {"user_id": user["user_id"], "read": False},
         {"$set": {"read": True}},
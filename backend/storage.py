@@ -0,0 +1,337 @@
+import os
+import asyncio
+import errno
+import hashlib
+import logging
+import mimetypes
+import shutil
+import tempfile
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, List
+from fastapi.staticfiles import StaticFiles
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Where uploaded photos live. Keys are paths relative to the storage root, the
+# same ones that appear after /api/uploads/ in photo URLs, so URLs don't depend
+# on the backend.
+#
+#   STORAGE_BACKEND=local  files under UPLOADS_DIR, served by the /api/uploads mount
+#   STORAGE_BACKEND=s3     objects in S3_BUCKET (AWS or any S3-compatible store such
+#                          as MinIO via S3_ENDPOINT_URL); /api/uploads redirects to them
+#
+# Uploads are always staged in a local scratch file first (they are hashed and
+# validated while streaming); put_file() then moves the finished file into place.
+# The scratch directory is never under the served root, so an upload that is
+# still streaming or failed validation can't be fetched by URL.
+#
+# Keys fan out over two levels of hex directories (shard_key) so no directory
+# grows past a few thousand entries. Files from the old flat layout are moved by
+# scripts/migrate_upload_layout.py; until then UploadFiles finds either.
+
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "local")
+UPLOADS_DIR = os.environ.get("UPLOADS_DIR", str(Path(__file__).resolve().parent / "uploads"))
+
+S3_BUCKET = os.environ.get("S3_BUCKET", "")
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL") or None
+S3_REGION = os.environ.get("S3_REGION") or None
+S3_PREFIX = os.environ.get("S3_PREFIX", "uploads/")
+# Public base URL (CDN / public bucket) to redirect to; presigned URLs otherwise
+S3_PUBLIC_URL = os.environ.get("S3_PUBLIC_URL", "").rstrip("/")
+S3_PRESIGN_SECONDS = int(os.environ.get("S3_PRESIGN_SECONDS", "3600"))
+# Files larger than one part go up as a multipart upload (S3 minimum part size is 5 MB)
+S3_PART_SIZE = max(int(os.environ.get("S3_PART_SIZE", str(8 * 1024 * 1024))), 5 * 1024 * 1024)
+
+
+def shard_key(filename: str) -> str:
+    """ab/cd/<filename>: content-addressed names (and their <sha>_<variant>
+    derivatives) shard on their own hash prefix, anything else (legacy names)
+    on the hash of the name."""
+    head = filename[:64]
+    digest = head if len(head) == 64 and all(c in "0123456789abcdef" for c in head) else (
+        hashlib.sha256(filename.encode()).hexdigest()
+    )
+    return f"{digest[:2]}/{digest[2:4]}/{filename}"
+
+
+def content_type(key: str) -> str:
+    return mimetypes.guess_type(key)[0] or "application/octet-stream"
+
+
+class LocalStorage:
+    name = "local"
+
+    def __init__(self, root: str = UPLOADS_DIR):
+        self.root = root
+        # A sibling of the root (uploads.incoming): on the same filesystem in the
+        # usual layout, so finished files are renamed, not copied, into place
+        self.scratch_dir = os.path.normpath(root) + ".incoming"
+        self.counts = Counter()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def _put(self, key: str, source: str):
+        target = self.path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.replace(source, target)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # The root is a separate mount: copy next to the target (hidden,
+            # so not served), then rename over it
+            fd, staged = tempfile.mkstemp(dir=os.path.dirname(target), prefix=".upload_")
+            os.close(fd)
+            try:
+                shutil.copyfile(source, staged)
+                os.replace(staged, target)
+            except BaseException:
+                _remove_quietly(staged)
+                raise
+            _remove_quietly(source)
+
+    async def put_file(self, key: str, source: str):
+        """Move a finished local file to `key` (the source is consumed)."""
+        await asyncio.to_thread(self._put, key, source)
+        self.counts["puts"] += 1
+
+    async def exists(self, key: str) -> bool:
+        return await asyncio.to_thread(os.path.exists, self.path(key))
+
+    def _move(self, key: str, new_key: str) -> bool:
+        os.makedirs(os.path.dirname(self.path(new_key)), exist_ok=True)
+        try:
+            os.replace(self.path(key), self.path(new_key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    async def move(self, key: str, new_key: str) -> bool:
+        """Rename an object; False if `key` doesn't exist."""
+        return await asyncio.to_thread(self._move, key, new_key)
+
+    def _delete(self, keys: List[str]) -> int:
+        deleted = 0
+        for key in keys:
+            try:
+                os.remove(self.path(key))
+                deleted += 1
+            except OSError:
+                pass
+        return deleted
+
+    async def delete(self, keys: List[str]) -> int:
+        deleted = await asyncio.to_thread(self._delete, keys)
+        self.counts["deletes"] += deleted
+        return deleted
+
+    @asynccontextmanager
+    async def local_copy(self, key: str) -> AsyncIterator[str]:
+        yield self.path(key)
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "root": self.root, **self.counts}
+
+
+class S3Storage:
+    name = "s3"
+
+    def __init__(self, bucket: str = S3_BUCKET, prefix: str = S3_PREFIX, client=None):
+        if not bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires S3_BUCKET")
+        self.bucket = bucket
+        self.prefix = prefix
+        self._client = client
+        self.scratch_dir = os.path.join(tempfile.gettempdir(), "tracklog-uploads")
+        self.counts = Counter()
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+            from botocore.config import Config
+
+            # boto3 clients are thread-safe; calls run in worker threads
+            self._client = boto3.client(
+                "s3",
+                endpoint_url=S3_ENDPOINT_URL,
+                region_name=S3_REGION,
+                config=Config(max_pool_connections=32, retries={"max_attempts": 3, "mode": "standard"}),
+            )
+        return self._client
+
+    def object_key(self, key: str) -> str:
+        return self.prefix + key
+
+    def _put(self, key: str, source: str):
+        size = os.path.getsize(source)
+        extra = {"ContentType": content_type(key)}
+        with open(source, "rb") as f:
+            if size <= S3_PART_SIZE:
+                self.client.put_object(Bucket=self.bucket, Key=self.object_key(key), Body=f, **extra)
+                return
+            upload = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.object_key(key), **extra)
+            parts = []
+            try:
+                for number in range(1, size // S3_PART_SIZE + 2):
+                    chunk = f.read(S3_PART_SIZE)
+                    if not chunk:
+                        break
+                    part = self.client.upload_part(
+                        Bucket=self.bucket, Key=self.object_key(key), UploadId=upload["UploadId"],
+                        PartNumber=number, Body=chunk,
+                    )
+                    parts.append({"PartNumber": number, "ETag": part["ETag"]})
+                self.client.complete_multipart_upload(
+                    Bucket=self.bucket, Key=self.object_key(key), UploadId=upload["UploadId"],
+                    MultipartUpload={"Parts": parts},
+                )
+                self.counts["multipart_puts"] += 1
+            except BaseException:
+                self.client.abort_multipart_upload(
+                    Bucket=self.bucket, Key=self.object_key(key), UploadId=upload["UploadId"]
+                )
+                raise
+
+    async def put_file(self, key: str, source: str):
+        """Upload a finished local file to `key` (the source is removed afterwards)."""
+        try:
+            await asyncio.to_thread(self._put, key, source)
+        finally:
+            await asyncio.to_thread(_remove_quietly, source)
+        self.counts["puts"] += 1
+
+    def _exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    async def exists(self, key: str) -> bool:
+        return await asyncio.to_thread(self._exists, key)
+
+    def _move(self, key: str, new_key: str) -> bool:
+        if not self._exists(key):
+            return False
+        self.client.copy_object(
+            Bucket=self.bucket, Key=self.object_key(new_key),
+            CopySource={"Bucket": self.bucket, "Key": self.object_key(key)},
+        )
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+        return True
+
+    async def move(self, key: str, new_key: str) -> bool:
+        """Server-side copy then delete; False if `key` doesn't exist."""
+        return await asyncio.to_thread(self._move, key, new_key)
+
+    def _delete(self, keys: List[str]) -> int:
+        deleted = 0
+        for i in range(0, len(keys), 1000):
+            result = self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": self.object_key(k)} for k in keys[i:i + 1000]], "Quiet": False},
+            )
+            deleted += len(result.get("Deleted", []))
+            for error in result.get("Errors", []):
+                logger.error(f"S3 delete failed for {error.get('Key')}: {error.get('Message')}")
+        return deleted
+
+    async def delete(self, keys: List[str]) -> int:
+        if not keys:
+            return 0
+        deleted = await asyncio.to_thread(self._delete, keys)
+        self.counts["deletes"] += deleted
+        return deleted
+
+    @asynccontextmanager
+    async def local_copy(self, key: str) -> AsyncIterator[str]:
+        os.makedirs(self.scratch_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=self.scratch_dir, suffix=os.path.splitext(key)[1])
+        os.close(fd)
+        try:
+            await asyncio.to_thread(self.client.download_file, self.bucket, self.object_key(key), path)
+            yield path
+        finally:
+            await asyncio.to_thread(_remove_quietly, path)
+
+    def url(self, key: str) -> str:
+        if S3_PUBLIC_URL:
+            return f"{S3_PUBLIC_URL}/{self.object_key(key)}"
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": self.object_key(key)}, ExpiresIn=S3_PRESIGN_SECONDS
+        )
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "bucket": self.bucket, **self.counts}
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def create_storage(backend: str = STORAGE_BACKEND):
+    if backend == "local":
+        return LocalStorage()
+    if backend == "s3":
+        return S3Storage()
+    raise RuntimeError(f"Unknown STORAGE_BACKEND {backend!r}")
+
+
+storage = create_storage()
+
+
+def scratch_dir() -> str:
+    os.makedirs(storage.scratch_dir, exist_ok=True)
+    return storage.scratch_dir
+
+
+def scratch_file(suffix: str = ".part") -> tuple:
+    """(fd, path) of a new staging file for an upload in progress."""
+    return tempfile.mkstemp(dir=scratch_dir(), prefix=".upload_", suffix=suffix)
+
+
+def clear_scratch(older_than_seconds: float = 3600) -> int:
+    """Remove staging files left behind by a crash mid-upload."""
+    removed = 0
+    cutoff = time.time() - older_than_seconds
+    if not os.path.isdir(storage.scratch_dir):
+        return 0
+    for entry in os.scandir(storage.scratch_dir):
+        if entry.stat().st_mtime >= cutoff:
+            continue
+        if entry.is_dir():
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            _remove_quietly(entry.path)
+        removed += 1
+    return removed
+
+
+class UploadFiles(StaticFiles):
+    """The /api/uploads mount for local storage. Flat (pre-sharding) paths that
+    have since been migrated are looked up at their sharded location, so old
+    URLs keep working. Hidden names (staging files, the old in-root .incoming
+    directory) are never served."""
+
+    def lookup_path(self, path: str):
+        if any(part.startswith(".") for part in Path(path).parts):
+            return "", None
+        full_path, stat_result = super().lookup_path(path)
+        if stat_result is None and "/" not in path:
+            return super().lookup_path(shard_key(path))
+        return full_path, stat_result
@@ -0,0 +1,51 @@
+"""
+The per-date loops the vectorised date analytics replaced. tests/test_analytics.py
+checks analytics.build_analytics against them and scripts/bench_analytics.py
+times them as the rollup-loops mode.
+"""
+from collections import Counter
+from datetime import datetime
+
+import analytics
+
+
+def loop_streaks(days: list, now: datetime) -> dict:
+    """The per-date streak scan analytics.streaks replaced."""
+    days = sorted(days)
+    if not days:
+        return {"current": 0, "longest": 0}
+    longest = run = 1
+    for prev, curr in zip(days, days[1:]):
+        run = run + 1 if (curr - prev).days == 1 else 1
+        longest = max(longest, run)
+    current = 0
+    if (now.date() - days[-1]).days in (0, 1):
+        current = 1
+        for prev, curr in zip(reversed(days[:-1]), reversed(days)):
+            if (curr - prev).days != 1:
+                break
+            current += 1
+    return {"current": current, "longest": longest}
+
+
+def rollup_loops(rollup: dict, now: datetime) -> dict:
+    dates = analytics.counts(rollup["dates"])
+    days = Counter()
+    for date, n in dates.items():
+        try:
+            days[datetime.strptime(date, "%Y-%m-%d").date()] += n
+        except ValueError:
+            pass
+    monthly, weekdays = Counter(), Counter()
+    for day, n in days.items():
+        monthly[day.strftime("%Y-%m")] += n
+        weekdays[day.weekday()] += n
+    return {
+        "monthly_trend": [monthly.get(m, 0) for m in analytics.recent_months(now)],
+        "day_of_week": [weekdays.get(i, 0) for i in range(7)],
+        "by_train_type": analytics.top(rollup["train_type"], 10),
+        "by_traction_type": analytics.top(rollup["traction_type"], 10),
+        "by_operator": analytics.top(rollup["operator"], 10),
+        "by_location": analytics.top(rollup["location"], 10),
+        "streak": loop_streaks(list(days), now),
+    }
@@ -0,0 +1,107 @@
+"""
+The vectorised date analytics (analytics.date_columns / month_totals /
+weekday_histogram / streaks) against the per-date loops they replaced, kept
+in tests/analytics_reference.py, on random sighting histories.
+"""
+import sys
+import random
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import analytics
+from analytics_reference import rollup_loops
+
+NOW = datetime(2026, 3, 1, 9, 30, tzinfo=timezone.utc)
+
+INVALID_DATES = ["2024-02-30", "2023-13-01", "2024-00-10", "0000-01-01", "2024-05", "2024", "yesterday",
+                 "2024-05-01T10:00", "2024/05/01", " 2024-05-01", "2024-05-01 "]
+
+
+def unpadded(day) -> str:
+    return f"{day.year}-{day.month}-{day.day}"
+
+
+def random_dates(rng: random.Random) -> dict:
+    """sighting_date -> count: consecutive runs (some through today, some in the
+    future), isolated single days, unpadded spellings of some of those days and
+    strings that aren't dates at all."""
+    dates = {}
+    for _ in range(rng.randint(0, 12)):
+        start = NOW.date() + timedelta(days=rng.randint(-800, 40))
+        for offset in range(rng.choice([1, 1, 2, 5, 30])):
+            day = start + timedelta(days=offset)
+            dates[day.isoformat()] = rng.randint(1, 4)
+            if rng.random() < 0.1:
+                dates[unpadded(day)] = rng.randint(1, 3)
+    if rng.random() < 0.5:
+        for offset in range(rng.randint(1, 6)):
+            dates[(NOW.date() - timedelta(days=offset + rng.choice([0, 1, 2]))).isoformat()] = 1
+    for value in rng.sample(INVALID_DATES, rng.randint(0, 4)):
+        dates[value] = rng.randint(1, 3)
+    return dates
+
+
+def rollup(dates: dict) -> dict:
+    return {
+        "total": sum(dates.values()),
+        "dates": {analytics.escape_key(date): n for date, n in dates.items()},
+        "hours": {},
+        **{field: {} for field in analytics.DIMENSIONS},
+    }
+
+
+def numpy_result(dates: dict) -> dict:
+    days, counts = analytics.date_columns(dates)
+    months = analytics.recent_months(NOW)
+    return {
+        "monthly_trend": analytics.month_totals(days, counts, months),
+        "day_of_week": analytics.weekday_histogram(days, counts).tolist(),
+        "streak": analytics.streaks(days, NOW),
+    }
+
+
+def loops_result(dates: dict) -> dict:
+    result = rollup_loops(rollup(dates), NOW)
+    return {key: result[key] for key in ("monthly_trend", "day_of_week", "streak")}
+
+
+class TestDateAnalytics:
+    """NumPy date analytics match the per-date loops"""
+
+    @pytest.mark.parametrize("seed", range(200))
+    def test_random_histories(self, seed):
+        dates = random_dates(random.Random(seed))
+        assert numpy_result(dates) == loops_result(dates)
+
+    def test_empty(self):
+        assert numpy_result({}) == loops_result({})
+        assert numpy_result({}) == {"monthly_trend": [0] * 12, "day_of_week": [0] * 7,
+                                    "streak": {"current": 0, "longest": 0}}
+
+    def test_only_invalid_dates(self):
+        dates = {value: 1 for value in INVALID_DATES}
+        assert numpy_result(dates) == loops_result(dates)
+        assert numpy_result(dates)["day_of_week"] == [0] * 7
+
+    def test_unpadded_and_padded_spellings_of_one_day(self):
+        dates = {"2026-02-28": 2, "2026-2-28": 3, "2026-03-01": 1}
+        assert numpy_result(dates) == loops_result(dates)
+        assert numpy_result(dates)["streak"] == {"current": 2, "longest": 2}
+
+    def test_single_days_and_future_dates(self):
+        dates = {"2026-02-20": 1, "2026-02-25": 1, "2026-03-05": 2, "2026-03-06": 1}
+        assert numpy_result(dates) == loops_result(dates)
+        assert numpy_result(dates)["streak"] == {"current": 0, "longest": 2}
+
+    def test_build_analytics(self):
+        dates = random_dates(random.Random(7))
+        built = analytics.build_analytics(rollup(dates), NOW)
+        expected = loops_result(dates)
+        assert [d["count"] for d in built["day_of_week"]] == expected["day_of_week"]
+        assert [m["count"] for m in built["monthly_trend"]] == expected["monthly_trend"]
+        assert built["streak"] == expected["streak"]
@@ -0,0 +1,299 @@
+"""
+Query-plan regression suite.
+Drives every read route through the ASGI app against a local mongod seeded with
+synthetic data, captures each Mongo read the route issues (via pymongo command
+monitoring), explains it and fails on collection scans or on plans that examine
+far more documents/keys than they return.
+
+Needs a disposable mongod (skipped when none is reachable):
+    QUERY_PLAN_MONGO_URL=mongodb://localhost:27017 pytest tests/test_query_plans.py
+QUERY_PLAN_MAX_RATIO sets the allowed examined:returned ratio (default 5).
+"""
+import os
+import sys
+import asyncio
+import random
+import uuid
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+
+import pytest
+from bson import SON
+from pymongo import monitoring
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+MONGO_URL = os.environ.get("QUERY_PLAN_MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.environ.get("QUERY_PLAN_DB", "tracklog_query_plans")
+MAX_RATIO = float(os.environ.get("QUERY_PLAN_MAX_RATIO", "5"))
+
+READ_COMMANDS = {"find", "aggregate", "count", "distinct"}
+
+# Unfiltered queries that scan by design, keyed by (route, collection). Keep this short and justified.
+ALLOWED_SCANS = {}
+
+N_USERS = 60
+SIGHTINGS_PER_USER = 30
+
+
+class CommandRecorder(monitoring.CommandListener):
+    def __init__(self):
+        self.commands = []
+
+    def started(self, event):
+        if event.command_name in READ_COMMANDS and event.database_name == DB_NAME:
+            self.commands.append(event.command)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def explainable(command) -> SON:
+    """Strip session/cluster fields pymongo adds so the command can be explained."""
+    skip = {"lsid", "txnNumber", "readConcern", "writeConcern", "$db", "$clusterTime", "$readPreference"}
+    return SON((k, v) for k, v in command.items() if k not in skip)
+
+
+def query_filter(command) -> dict:
+    if "filter" in command or "query" in command:
+        return command.get("filter") or command.get("query") or {}
+    for stage in command.get("pipeline", []):
+        if "$match" in stage:
+            return stage["$match"]
+    return {}
+
+
+def allowed_scan(label: str, collection: str, command) -> bool:
+    return (label, collection) in ALLOWED_SCANS and not query_filter(command)
+
+
+def plan_problems(explain: dict, max_ratio: float) -> list:
+    problems = []
+
+    def walk(node):
+        if isinstance(node, list):
+            for item in node:
+                walk(item)
+            return
+        if not isinstance(node, dict):
+            return
+        stage = node.get("stage")
+        if stage == "COLLSCAN":
+            problems.append("COLLSCAN")
+        if stage in ("FETCH", "IXSCAN"):
+            examined = node.get("docsExamined" if stage == "FETCH" else "keysExamined")
+            returned = node.get("nReturned")
+            if examined is not None and returned is not None and examined > max_ratio * max(returned, 1):
+                problems.append(f"{stage} examined {examined} for {returned} returned")
+        if node.get("collectionScans"):
+            problems.append(f"$lookup did {node['collectionScans']} collection scan(s)")
+        if node.get("strategy") in ("NestedLoopJoin", "HashJoin"):
+            problems.append(f"$lookup used {node['strategy']} (no usable index)")
+        for key, value in node.items():
+            if key not in ("rejectedPlans", "allPlansExecution"):
+                walk(value)
+
+    walk(explain)
+    return sorted(set(problems))
+
+
+async def seed(db):
+    from sightings import encode_cursor
+
+    now = datetime.now(timezone.utc)
+    users, sightings, notifications = [], [], []
+    for u in range(N_USERS):
+        user_id = f"user_{uuid.uuid4().hex[:12]}"
+        users.append({
+            "user_id": user_id,
+            "email": f"plan{u}@tracklog.com",
+            "name": f"Spotter {u}",
+            "password_hash": "x" * 60,
+            "picture": None,
+            "auth_provider": "email",
+            "is_profile_public": u % 2 == 0,
+            "created_at": now - timedelta(days=u),
+        })
+        for i in range(SIGHTINGS_PER_USER):
+            sightings.append({
+                "sighting_id": f"sighting_{uuid.uuid4().hex[:12]}",
+                "user_id": user_id,
+                "train_number": f"{random.randint(100, 999)}",
+                "train_type": random.choice(["Express", "Freight", "Local"]),
+                "traction_type": random.choice(["Electric", "Diesel"]),
+                "operator": random.choice(["DB", "SNCF", "NS"]),
+                "route": None,
+                "location": random.choice(["Utrecht", "Köln", "Lille"]),
+                "sighting_date": (now - timedelta(days=i)).strftime("%Y-%m-%d"),
+                "sighting_time": f"{random.randint(0, 23):02d}:15",
+                "notes": None,
+                "photos": [],
+                "is_public": i % 3 == 0,
+                "share_id": uuid.uuid4().hex[:8],
+                "like_count": 0,
+                "created_at": now - timedelta(hours=u * SIGHTINGS_PER_USER + i),
+            })
+    me = users[0]["user_id"]
+    for n in range(100):
+        notifications.append({
+            "notification_id": f"notif_{uuid.uuid4().hex[:12]}",
+            "user_id": users[n % N_USERS]["user_id"],
+            "type": "like",
+            "actor_id": users[1]["user_id"],
+            "message": "",
+            "read": n % 4 == 0,
+            "created_at": now - timedelta(minutes=n),
+        })
+    await db.users.insert_many(users)
+    await db.sightings.insert_many(sightings)
+    await db.notifications.insert_many(notifications)
+
+    others = [s for s in sightings if s["user_id"] != me]
+    await db.likes.insert_many([
+        {"user_id": me, "sighting_id": s["sighting_id"], "created_at": now} for s in others[:40]
+    ])
+    await db.bookmarks.insert_many([
+        {"user_id": me, "sighting_id": s["sighting_id"], "created_at": now} for s in others[40:80]
+    ])
+    await db.follows.insert_many([
+        {"follower_id": u["user_id"], "following_id": users[(i + 1) % N_USERS]["user_id"], "created_at": now}
+        for i, u in enumerate(users)
+    ])
+    session_token = f"session_{uuid.uuid4().hex}"
+    await db.user_sessions.insert_one({
+        "user_id": me,
+        "session_token": session_token,
+        "expires_at": now + timedelta(days=7),
+        "created_at": now,
+    })
+    mine = next(s for s in sightings if s["user_id"] == me and s["is_public"])
+    return {
+        "me": me,
+        "other": users[2]["user_id"],
+        "session_token": session_token,
+        "sighting_id": mine["sighting_id"],
+        "share_id": mine["share_id"],
+        "liked_sighting_id": others[100]["sighting_id"],
+        "cursor": encode_cursor([s for s in sightings if s["user_id"] == me][SIGHTINGS_PER_USER // 2]),
+    }
+
+
+def routes(ctx) -> list:
+    """(label, method, path) for every route whose queries must stay indexed."""
+    return [
+        ("GET /api/auth/me", "GET", "/api/auth/me"),
+        ("GET /api/sightings", "GET", "/api/sightings?limit=20&skip=0"),
+        ("GET /api/sightings?cursor", "GET", f"/api/sightings?limit=20&cursor={ctx['cursor']}"),
+        ("GET /api/sightings/stats", "GET", "/api/sightings/stats"),
+        ("GET /api/sightings/analytics", "GET", "/api/sightings/analytics"),
+        ("GET /api/sightings/interactions/me", "GET", "/api/sightings/interactions/me"),
+        ("GET /api/sightings/bookmarks/me", "GET", "/api/sightings/bookmarks/me"),
+        ("GET /api/sightings/{id}", "GET", f"/api/sightings/{ctx['sighting_id']}"),
+        ("POST /api/sightings/{id}/like", "POST", f"/api/sightings/{ctx['liked_sighting_id']}/like"),
+        ("POST /api/sightings/{id}/bookmark", "POST", f"/api/sightings/{ctx['liked_sighting_id']}/bookmark"),
+        ("GET /api/public/feed", "GET", "/api/public/feed?page=2&limit=20"),
+        ("GET /api/public/sightings/{share_id}", "GET", f"/api/public/sightings/{ctx['share_id']}"),
+        ("GET /api/public/users/{id}", "GET", f"/api/public/users/{ctx['me']}"),
+        ("GET /api/social/users/search", "GET", "/api/social/users/search?page=1&limit=20"),
+        ("GET /api/social/notifications", "GET", "/api/social/notifications"),
+        ("GET /api/social/notifications/unread-count", "GET", "/api/social/notifications/unread-count"),
+        ("GET /api/social/following/me", "GET", "/api/social/following/me"),
+        ("GET /api/social/followers/{id}", "GET", f"/api/social/followers/{ctx['other']}"),
+        ("POST /api/social/follow/{id}", "POST", f"/api/social/follow/{ctx['other']}"),
+    ]
+
+
+async def collect_plans():
+    import httpx
+    from motor.motor_asyncio import AsyncIOMotorClient
+    import server
+    from indexes import apply_indexes
+    from session_cache import session_cache
+
+    recorder = CommandRecorder()
+    client = AsyncIOMotorClient(MONGO_URL, serverSelectionTimeoutMS=2000, event_listeners=[recorder])
+    try:
+        await client.admin.command("ping")
+    except Exception as e:
+        client.close()
+        pytest.skip(f"No mongod reachable at {MONGO_URL}: {e}")
+
+    # Classic-engine explain output has per-stage FETCH/IXSCAN stats to check
+    try:
+        await client.admin.command({"setParameter": 1, "internalQueryFrameworkControl": "forceClassicEngine"})
+    except Exception:
+        pass
+
+    await client.drop_database(DB_NAME)
+    db = client[DB_NAME]
+    results = {}
+    try:
+        await apply_indexes(db)
+        ctx = await seed(db)
+        server.inject_db(db)
+        session_cache.clear()
+
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(
+            transport=transport,
+            base_url="http://plans.test",
+            cookies={"session_token": ctx["session_token"]},
+        ) as http:
+            for label, method, path in routes(ctx):
+                recorder.commands.clear()
+                resp = await http.request(method, path)
+                assert resp.status_code == 200, f"{label}: {resp.status_code} {resp.text[:200]}"
+                results[label] = []
+                for command in list(recorder.commands):
+                    collection = command[next(iter(command))]
+                    explain = await db.command(SON([
+                        ("explain", explainable(command)),
+                        ("verbosity", "executionStats"),
+                    ]))
+                    results[label].append((collection, dict(command), plan_problems(explain, MAX_RATIO)))
+    finally:
+        await client.drop_database(DB_NAME)
+        client.close()
+    return results
+
+
+@pytest.fixture(scope="module")
+def plans():
+    return asyncio.run(collect_plans())
+
+
+class TestQueryPlans:
+    """Every route's Mongo reads must be index-backed"""
+
+    def test_every_route_queries_mongo(self, plans):
+        """Guard against a route silently dropping out of the suite"""
+        silent = [label for label, queries in plans.items() if not queries]
+        assert not silent, f"Routes issued no reads: {silent}"
+
+    def test_no_collection_scans(self, plans):
+        """No COLLSCAN (or unindexed $lookup) outside the allowlist"""
+        failures = []
+        for label, queries in plans.items():
+            for collection, command, problems in queries:
+                if allowed_scan(label, collection, command):
+                    continue
+                scans = [p for p in problems if "COLLSCAN" in p or "$lookup" in p]
+                if scans:
+                    failures.append(f"{label} -> {collection}: {scans} {command}")
+        assert not failures, "Collection scans:\n" + "\n".join(failures)
+        print(f"✓ {sum(len(q) for q in plans.values())} queries across {len(plans)} routes are index-backed")
+
+    def test_examined_to_returned_ratio(self, plans):
+        """Indexes must be selective: examined <= QUERY_PLAN_MAX_RATIO x returned"""
+        failures = []
+        for label, queries in plans.items():
+            for collection, command, problems in queries:
+                if allowed_scan(label, collection, command):
+                    continue
+                ratios = [p for p in problems if "examined" in p]
+                if ratios:
+                    failures.append(f"{label} -> {collection}: {ratios} {command}")
+        assert not failures, "Unselective plans:\n" + "\n".join(failures)
@@ -0,0 +1,109 @@
+"""
+Storage backend contract: put_file / exists / local_copy / delete behave the
+same on local disk and on S3. The S3 backend runs against moto's in-process
+stand-in (skipped when moto isn't installed); to run it against MinIO instead:
+    STORAGE_TEST_S3_ENDPOINT=http://localhost:9000 AWS_ACCESS_KEY_ID=... pytest tests/test_storage.py
+"""
+import os
+import sys
+import asyncio
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import storage
+from storage import LocalStorage, S3Storage
+
+BUCKET = "tracklog-storage-test"
+S3_ENDPOINT = os.environ.get("STORAGE_TEST_S3_ENDPOINT")
+
+
+@pytest.fixture
+def local_backend(tmp_path):
+    return LocalStorage(root=str(tmp_path / "uploads"))
+
+
+@pytest.fixture
+def s3_backend(tmp_path):
+    boto3 = pytest.importorskip("boto3")
+    if S3_ENDPOINT:
+        client = boto3.client("s3", endpoint_url=S3_ENDPOINT)
+        client.create_bucket(Bucket=BUCKET)
+        backend = S3Storage(bucket=BUCKET, prefix="test/", client=client)
+        backend.scratch_dir = str(tmp_path / "scratch")
+        yield backend
+        return
+    moto = pytest.importorskip("moto")
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        backend = S3Storage(bucket=BUCKET, prefix="test/", client=client)
+        backend.scratch_dir = str(tmp_path / "scratch")
+        yield backend
+
+
+def staged(tmp_path, name: str, data: bytes) -> str:
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+async def round_trip(backend, tmp_path, data: bytes):
+    key = "ab/cd/abcdef.jpg"
+    source = staged(tmp_path, "staged.part", data)
+    await backend.put_file(key, source)
+    assert not os.path.exists(source), "put_file must consume the staged file"
+    assert await backend.exists(key)
+    async with backend.local_copy(key) as path:
+        assert Path(path).read_bytes() == data
+    assert await backend.delete([key, "missing.jpg"]) >= 1
+    assert not await backend.exists(key)
+
+
+class TestStorageBackends:
+    """Both backends honour the same contract"""
+
+    def test_local_round_trip(self, local_backend, tmp_path):
+        asyncio.run(round_trip(local_backend, tmp_path, b"\xff\xd8\xff" + os.urandom(1024)))
+
+    def test_s3_round_trip(self, s3_backend, tmp_path):
+        asyncio.run(round_trip(s3_backend, tmp_path, b"\xff\xd8\xff" + os.urandom(1024)))
+
+    def test_s3_multipart_upload(self, s3_backend, tmp_path, monkeypatch):
+        """Files larger than S3_PART_SIZE go up in parts"""
+        monkeypatch.setattr(storage, "S3_PART_SIZE", 5 * 1024 * 1024)
+        data = os.urandom(11 * 1024 * 1024)
+        asyncio.run(round_trip(s3_backend, tmp_path, data))
+        assert s3_backend.counts["multipart_puts"] == 1
+
+
+class TestLocalScratch:
+    """Uploads in progress are never reachable through /api/uploads"""
+
+    def test_scratch_outside_served_root(self, local_backend, monkeypatch):
+        monkeypatch.setattr(storage, "storage", local_backend)
+        fd, path = storage.scratch_file()
+        os.close(fd)
+        assert not Path(path).resolve().is_relative_to(Path(local_backend.root).resolve())
+
+    def test_hidden_names_not_served(self, tmp_path):
+        (tmp_path / ".incoming").mkdir()
+        (tmp_path / ".incoming" / "upload.jpg").write_bytes(b"\xff\xd8\xff")
+        (tmp_path / "photo.jpg").write_bytes(b"\xff\xd8\xff")
+        files = storage.UploadFiles(directory=str(tmp_path))
+        assert files.lookup_path(".incoming/upload.jpg")[1] is None
+        assert files.lookup_path("photo.jpg")[1] is not None
+
+    def test_put_across_filesystems(self, local_backend, tmp_path, monkeypatch):
+        replace = os.replace
+
+        def cross_device(source, target):
+            if "staged" in str(source):
+                raise OSError(storage.errno.EXDEV, "Invalid cross-device link")
+            replace(source, target)
+
+        monkeypatch.setattr(storage.os, "replace", cross_device)
+        asyncio.run(round_trip(local_backend, tmp_path, b"\xff\xd8\xff" + os.urandom(1024)))
+        assert os.listdir(Path(local_backend.path("ab/cd/abcdef.jpg")).parent) == []
@@ -0,0 +1,156 @@
+"""
+Photo reference counting: every photo slot of a sighting holds exactly one
+reference to its blob, including when the same URL fills several slots.
+Multipart photo forms: limits apply while the body streams. PhotoStore
+(against mongomock, skipped when it isn't installed) gives a reference back
+when writing the file fails.
+"""
+import os
+import sys
+import asyncio
+from collections import Counter
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import storage
+import uploads
+from uploads import UPLOAD_URL_PREFIX, PartialUpload, diff_photos, receive_photo_form
+
+A = UPLOAD_URL_PREFIX + "ab/cd/" + "a" * 64 + ".jpg"
+B = UPLOAD_URL_PREFIX + "ef/01/" + "b" * 64 + ".jpg"
+LEGACY = UPLOAD_URL_PREFIX + "sighting_0123456789ab_0.jpg"
+
+
+def refs_after_update(old, incoming):
+    """Reference counts after update_sighting, starting from one per slot of `old`."""
+    refs = Counter(old)
+    kept, added, removed = diff_photos(old, incoming)
+    refs.update(added)
+    refs.subtract(removed)
+    return kept + added, +refs
+
+
+class TestDiffPhotos:
+    """update_sighting keeps one reference per photo slot"""
+
+    def test_duplicate_added(self):
+        photos, refs = refs_after_update([A], [A, A])
+        assert photos == [A, A]
+        assert refs == Counter({A: 2})
+
+    def test_duplicate_removed(self):
+        photos, refs = refs_after_update([A, A], [A])
+        assert photos == [A]
+        assert refs == Counter({A: 1})
+
+    def test_replace_and_reorder(self):
+        kept, added, removed = diff_photos([A, B], [B, "data:image/jpeg;base64,/9j/"])
+        assert kept == [B]
+        assert added == ["data:image/jpeg;base64,/9j/"]
+        assert removed == [A]
+
+    def test_legacy_file_released_only_when_unused(self):
+        assert diff_photos([LEGACY, LEGACY], [LEGACY])[2] == []
+        assert diff_photos([LEGACY, LEGACY], [])[2] == [LEGACY, LEGACY]
+
+
+BOUNDARY = "tracklogtestboundary"
+
+
+class StreamedRequest:
+    """The parts of a Starlette Request that receive_photo_form reads; counts
+    how many body chunks were pulled."""
+
+    def __init__(self, body: bytes, chunk_size: int = 64 * 1024):
+        self.headers = {"content-type": f"multipart/form-data; boundary={BOUNDARY}"}
+        self.chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+        self.received = 0
+
+    async def stream(self):
+        for chunk in self.chunks:
+            self.received += 1
+            yield chunk
+
+
+def multipart(fields: dict, files: list) -> bytes:
+    body = b""
+    for name, value in fields.items():
+        body += f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+    for filename, data in files:
+        body += (
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="photos"; filename="{filename}"\r\n'
+            f"Content-Type: image/jpeg\r\n\r\n"
+        ).encode() + data + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+class TestPhotoForm:
+    """receive_photo_form enforces the per-file limit while streaming"""
+
+    @pytest.fixture(autouse=True)
+    def scratch(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(storage.storage, "scratch_dir", str(tmp_path / "scratch"))
+        return tmp_path / "scratch"
+
+    def test_oversized_file_rejected_mid_stream(self, scratch):
+        oversized = b"\xff\xd8\xff" + os.urandom(2 * 1024 * 1024)
+        request = StreamedRequest(multipart({"train_number": "390 001"}, [("big.jpg", oversized)]))
+        with pytest.raises(HTTPException) as rejected:
+            asyncio.run(receive_photo_form(request, max_bytes=256 * 1024))
+        assert rejected.value.status_code == 413
+        assert request.received < len(request.chunks) // 2
+        assert not os.listdir(scratch), "the staging file must be removed"
+
+    def test_text_fields_and_blank_file_input(self):
+        request = StreamedRequest(multipart({"train_number": "390 001", "is_public": "true"}, [("", b"")]))
+        fields, photos = asyncio.run(receive_photo_form(request))
+        assert fields == {"train_number": "390 001", "is_public": "true"}
+        assert photos == []
+
+
+class TestPhotoStore:
+    """A failed file write leaves photo_blobs as it was"""
+
+    @pytest.fixture
+    def blobs(self, tmp_path, monkeypatch):
+        mongomock_motor = pytest.importorskip("mongomock_motor")
+        db = mongomock_motor.AsyncMongoMockClient()["tracklog_upload_test"]
+        monkeypatch.setattr(uploads, "db", db)
+        monkeypatch.setattr(storage.storage, "scratch_dir", str(tmp_path / "scratch"))
+
+        async def failing_put(key, path):
+            raise OSError("disk full")
+
+        monkeypatch.setattr(storage.storage, "put_file", failing_put)
+        return db.photo_blobs
+
+    @staticmethod
+    def part(data: bytes) -> PartialUpload:
+        part = PartialUpload(1024 * 1024)
+        part.write(data)
+        part.finish()
+        return part
+
+    def test_new_blob_removed(self, blobs, tmp_path):
+        async def scenario():
+            with pytest.raises(OSError):
+                await uploads.photo_store.store(self.part(b"\xff\xd8\xff" + b"new"))
+            return await blobs.count_documents({})
+
+        assert asyncio.run(scenario()) == 0
+        assert not os.listdir(tmp_path / "scratch"), "the staging file must be removed"
+
+    def test_rewrite_gives_reference_back(self, blobs):
+        async def scenario():
+            part = self.part(b"\xff\xd8\xff" + b"released")
+            # The last reference is being released, so store() has to rewrite the file
+            await blobs.insert_one({"blob_id": part.sha256.hexdigest(), "refs": 0})
+            with pytest.raises(OSError):
+                await uploads.photo_store.store(part)
+            return await blobs.find_one({}, {"_id": 0, "refs": 1})
+
+        assert asyncio.run(scenario()) == {"refs": 0}
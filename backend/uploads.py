@@ -0,0 +1,536 @@
+import os
+import re
+import asyncio
+import base64
+import binascii
+import hashlib
+import logging
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+from fastapi import HTTPException, Request
+from pymongo import ReturnDocument
+from starlette.responses import JSONResponse
+from python_multipart.multipart import MultipartParser, parse_options_header
+from python_multipart.exceptions import MultipartParseError
+from dotenv import load_dotenv
+
+from storage import storage, scratch_file, shard_key
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Multipart photo uploads are parsed straight off the request stream (PhotoForm),
+# without Starlette's form parser spooling each part first. File data is
+# written from a worker thread into a staging file as it arrives, and the file
+# is handed to the storage backend (storage.py) once complete, so a
+# half-written photo is never served.
+#
+# Limits are enforced while bytes arrive: UploadLimitMiddleware caps the whole
+# multipart request body, PhotoForm caps each file and text field.
+#
+# Photos sent as data:image/...;base64 URLs (JSON endpoints) are decoded in a
+# worker thread a slice at a time straight into the same kind of temp file, so
+# the decoded bytes never exist in memory all at once. The file type comes from
+# the decoded magic bytes, not from the data-URL header.
+#
+# Stored photos are content-addressed: ab/cd/<sha256>.<ext>, hashed while streaming.
+# photo_blobs counts the references (sighting photo slots, profile pictures) to
+# each file; identical uploads are written once, and a file is only unlinked
+# when its last reference is released. The blob is marked `deleting` while its
+# file is unlinked, so an upload of the same content waits and rewrites it.
+# Files from before this scheme (<sighting_id>_<n>.<ext>) have no blob and are
+# unlinked on release as before.
+
+UPLOAD_URL_PREFIX = "/api/uploads/"
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", str(256 * 1024)))
+UPLOAD_MAX_FILE_BYTES = int(os.environ.get("UPLOAD_MAX_FILE_BYTES", str(15 * 1024 * 1024)))
+UPLOAD_MAX_REQUEST_BYTES = int(os.environ.get("UPLOAD_MAX_REQUEST_BYTES", str(60 * 1024 * 1024)))
+FORM_FIELD_MAX_BYTES = int(os.environ.get("FORM_FIELD_MAX_BYTES", str(64 * 1024)))
+# How long store() waits for a concurrent release() to finish unlinking a blob
+BLOB_UNLINK_WAIT_SECONDS = float(os.environ.get("BLOB_UNLINK_WAIT_SECONDS", "5"))
+# base64 characters decoded per slice; a multiple of 4
+BASE64_SLICE_CHARS = 4 * (UPLOAD_CHUNK_SIZE // 3)
+
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+]
+
+# <sha256>.<ext>, sharded (ab/cd/<sha256>.<ext>) or from before sharding
+BLOB_KEY = re.compile(r"^(?:[0-9a-f]{2}/[0-9a-f]{2}/)?([0-9a-f]{64})\.[a-z]+$")
+
+db = None
+
+def set_db(database):
+    global db
+    db = database
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+def _too_large(limit: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Upload exceeds the {limit // (1024 * 1024)} MB limit")
+
+
+def sniff_image(head: bytes) -> Optional[str]:
+    """File extension for a supported image format, from its leading bytes."""
+    for signature, ext in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def is_data_url(photo: str) -> bool:
+    return photo.startswith("data:image")
+
+
+def upload_key(url: str) -> Optional[str]:
+    """Storage key of an /api/uploads URL; None for external URLs."""
+    if not url or not url.startswith(UPLOAD_URL_PREFIX):
+        return None
+    return url[len(UPLOAD_URL_PREFIX):]
+
+
+def blob_id(url: str) -> Optional[str]:
+    """The sha256 of a content-addressed upload URL; None for anything else."""
+    key = upload_key(url)
+    if key is None:
+        return None
+    match = BLOB_KEY.match(key)
+    return match.group(1) if match else None
+
+
+class PartialUpload:
+    """Staging file that hashes what is written to it. The image type is
+    sniffed from the first chunk; `key` is its content-addressed storage key."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.ext = None
+        fd, self.tmp_path = scratch_file()
+        self._file = os.fdopen(fd, "wb")
+
+    @property
+    def key(self) -> str:
+        return shard_key(f"{self.sha256.hexdigest()}.{self.ext}")
+
+    def write(self, chunk: bytes):
+        if self.ext is None:
+            self.ext = sniff_image(chunk)
+            if self.ext is None:
+                raise InvalidImage("Unsupported or corrupt image data")
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise _too_large(self.max_bytes)
+        self.sha256.update(chunk)
+        self._file.write(chunk)
+
+    def finish(self):
+        if self.ext is None:
+            raise InvalidImage("Empty image")
+        self._file.close()
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+
+async def delete_uploads(urls: list) -> int:
+    keys = [key for key in map(upload_key, urls) if key]
+    return await storage.delete(keys) if keys else 0
+
+
+class PhotoStore:
+    def __init__(self):
+        self.counts = Counter()
+
+    async def store(self, part: PartialUpload) -> str:
+        """Take a reference to the blob for a finished PartialUpload, writing the
+        file only if no live blob already holds the same content. If the write
+        fails the reference is given back, so no blob points at a missing file."""
+        url = UPLOAD_URL_PREFIX + part.key
+        blob = part.sha256.hexdigest()
+        referenced = False
+        try:
+            before = await db.photo_blobs.find_one_and_update(
+                {"blob_id": blob},
+                {
+                    "$inc": {"refs": 1},
+                    "$setOnInsert": {"url": url, "size": part.size, "created_at": datetime.now(timezone.utc)},
+                },
+                upsert=True,
+                projection={"_id": 0, "refs": 1, "deleting": 1},
+                return_document=ReturnDocument.BEFORE,
+            )
+            referenced = True
+            if before is not None and before.get("deleting"):
+                # release() is unlinking the file; rewrite it once that's done
+                await self._wait_for_unlink(blob)
+            # refs <= 0: the last reference is being released right now, so (re)write it
+            if before is None or before["refs"] <= 0 or before.get("deleting"):
+                await storage.put_file(part.key, part.tmp_path)
+                self.counts["written"] += 1
+            else:
+                await asyncio.to_thread(part.abort)
+                self.counts["deduplicated"] += 1
+        except BaseException:
+            await asyncio.to_thread(part.abort)
+            if referenced:
+                await self._unreference(blob, inserted=before is None)
+            raise
+        return url
+
+    async def _unreference(self, blob: str, inserted: bool):
+        """Undo store()'s reference after a failed write."""
+        if inserted:
+            # Drop the blob this call created, unless another upload joined it meanwhile
+            result = await db.photo_blobs.delete_one({"blob_id": blob, "refs": 1})
+            if result.deleted_count:
+                return
+        await db.photo_blobs.update_one({"blob_id": blob}, {"$inc": {"refs": -1}})
+
+    async def _wait_for_unlink(self, blob: str):
+        deadline = time.monotonic() + BLOB_UNLINK_WAIT_SECONDS
+        while time.monotonic() < deadline:
+            if not await db.photo_blobs.find_one({"blob_id": blob, "deleting": True}, {"_id": 1}):
+                return
+            await asyncio.sleep(0.05)
+        # The releasing process died mid-unlink; writing the file again is safe
+        logger.warning(f"Blob {blob} still marked deleting after {BLOB_UNLINK_WAIT_SECONDS}s; rewriting")
+
+    async def retain(self, url: str):
+        """Another reference to an already-stored photo (e.g. a URL re-submitted by a client)."""
+        blob = blob_id(url)
+        if blob:
+            await db.photo_blobs.update_one({"blob_id": blob, "refs": {"$gt": 0}}, {"$inc": {"refs": 1}})
+
+    async def _unlink_blob(self, blob: str, url: str) -> bool:
+        """Unlink an unreferenced blob's file, then drop its document. The blob is
+        marked `deleting` first so a concurrent store() of the same content waits
+        and rewrites the file instead of trusting one that is about to vanish."""
+        claimed = await db.photo_blobs.find_one_and_update(
+            {"blob_id": blob, "refs": {"$lte": 0}, "deleting": {"$ne": True}},
+            {"$set": {"deleting": True}},
+            projection={"_id": 1},
+        )
+        if claimed is None:
+            return False
+        try:
+            await delete_uploads([url])
+        finally:
+            result = await db.photo_blobs.delete_one({"blob_id": blob, "refs": {"$lte": 0}})
+            if not result.deleted_count:
+                # Referenced again meanwhile; the new owner rewrites the file
+                await db.photo_blobs.update_one({"blob_id": blob}, {"$unset": {"deleting": ""}})
+        return bool(result.deleted_count)
+
+    async def release(self, urls: List[str]) -> List[str]:
+        """Drop one reference per URL; unlinks and returns the files nobody references any more."""
+        released = []
+        untracked = []
+        for url in urls:
+            if not upload_key(url):
+                continue
+            blob = blob_id(url)
+            doc = None
+            if blob:
+                doc = await db.photo_blobs.find_one_and_update(
+                    {"blob_id": blob}, {"$inc": {"refs": -1}},
+                    projection={"_id": 0, "refs": 1},
+                    return_document=ReturnDocument.AFTER,
+                )
+            if doc is None:
+                # Legacy per-sighting file, or a blob that was never tracked
+                untracked.append(url)
+            elif doc["refs"] <= 0 and await self._unlink_blob(blob, url):
+                released.append(url)
+        if untracked:
+            await delete_uploads(untracked)
+            released += untracked
+        if released:
+            self.counts["released"] += len(released)
+        return released
+
+    def stats(self) -> dict:
+        return {
+            "written": self.counts["written"],
+            "deduplicated": self.counts["deduplicated"],
+            "released": self.counts["released"],
+        }
+
+
+photo_store = PhotoStore()
+
+
+class PhotoForm:
+    """Parses a multipart/form-data body straight off request.stream(). Each file
+    part named `file_field` is written into its own PartialUpload as it arrives,
+    so a file over max_bytes is rejected (413) at the chunk that crosses the
+    limit, before the rest of it is received. Other parts are text fields."""
+
+    def __init__(self, request: Request, file_field: str, max_bytes: int):
+        self.request = request
+        self.file_field = file_field
+        self.max_bytes = max_bytes
+        self.fields = {}
+        self.photos = []
+        self._events = []
+        self._headers = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._name = None
+        self._value = b""
+        self._part = None
+        self._is_file = False
+
+    def _callback(self, event: str):
+        def on_event(data: bytes = None, start: int = 0, end: int = 0):
+            self._events.append((event, data[start:end] if data is not None else None))
+        return on_event
+
+    async def parse(self) -> "PhotoForm":
+        content_type, options = parse_options_header(self.request.headers.get("content-type", ""))
+        boundary = options.get(b"boundary")
+        if content_type != b"multipart/form-data" or not boundary:
+            raise HTTPException(status_code=400, detail="Expected a multipart/form-data body")
+        parser = MultipartParser(boundary, {
+            f"on_{event}": self._callback(event)
+            for event in ("part_begin", "part_data", "part_end", "header_field", "header_value", "header_end", "headers_finished")
+        })
+        try:
+            async for chunk in self.request.stream():
+                parser.write(chunk)
+                await self._drain()
+            parser.finalize()
+            await self._drain()
+        except MultipartParseError:
+            await self._abort()
+            raise HTTPException(status_code=400, detail="Malformed multipart body")
+        except BaseException:
+            await self._abort()
+            raise
+        return self
+
+    async def _abort(self):
+        if self._part is not None:
+            await asyncio.to_thread(self._part.abort)
+            self._part = None
+        await photo_store.release(self.photos)
+
+    async def _drain(self):
+        events, self._events = self._events, []
+        for event, data in events:
+            if event == "part_begin":
+                self._headers, self._name, self._value = {}, None, b""
+            elif event == "header_field":
+                self._header_field += data
+            elif event == "header_value":
+                self._header_value += data
+            elif event == "header_end":
+                self._headers[self._header_field.lower()] = self._header_value
+                self._header_field, self._header_value = b"", b""
+            elif event == "headers_finished":
+                await self._start_part()
+            elif event == "part_data":
+                await self._write(data)
+            elif event == "part_end":
+                await self._end_part()
+
+    async def _start_part(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._name = options.get(b"name", b"").decode()
+        self._is_file = b"filename" in options
+        # Browsers send an empty part for a file input left blank
+        if self._is_file and self._name == self.file_field and options[b"filename"]:
+            self._part = await asyncio.to_thread(PartialUpload, self.max_bytes)
+
+    async def _write(self, data: bytes):
+        if self._part is not None:
+            try:
+                await asyncio.to_thread(self._part.write, data)
+            except InvalidImage as e:
+                logger.error(f"Error saving uploaded photo: {e}")
+                await asyncio.to_thread(self._part.abort)
+                self._part = None
+        elif not self._is_file:
+            self._value += data
+            if len(self._value) > FORM_FIELD_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"Form field {self._name} is too large")
+
+    async def _end_part(self):
+        if self._part is not None:
+            part, self._part = self._part, None
+            try:
+                await asyncio.to_thread(part.finish)
+            except InvalidImage as e:
+                logger.error(f"Error saving uploaded photo: {e}")
+                await asyncio.to_thread(part.abort)
+                return
+            self.photos.append(await photo_store.store(part))
+        elif not self._is_file and self._name:
+            self.fields[self._name] = self._value.decode("utf-8", errors="replace")
+
+
+async def receive_photo_form(
+    request: Request, file_field: str = "photos", max_bytes: int = UPLOAD_MAX_FILE_BYTES
+) -> Tuple[dict, List[str]]:
+    """Stream a multipart form into photo storage: (text fields, /api/uploads URLs
+    of the stored `file_field` files). Files that aren't supported images are
+    logged and dropped; a file over max_bytes fails the request (413) and
+    releases the photos already stored."""
+    form = await PhotoForm(request, file_field, max_bytes).parse()
+    return form.fields, form.photos
+
+
+def _decode_data_url(data_url: str, max_bytes: int) -> PartialUpload:
+    """Decode a base64 data URL into a PartialUpload; runs in a worker thread."""
+    start = data_url.find(",") + 1
+    if start == 0 or ";base64" not in data_url[:start]:
+        raise InvalidImage("Not a base64 data URL")
+
+    part = PartialUpload(max_bytes)
+    pending = ""
+    try:
+        for offset in range(start, len(data_url), BASE64_SLICE_CHARS):
+            text = pending + "".join(data_url[offset:offset + BASE64_SLICE_CHARS].split())
+            usable = len(text) - len(text) % 4
+            pending = text[usable:]
+            if usable:
+                part.write(base64.b64decode(text[:usable], validate=True))
+        if pending:
+            raise InvalidImage("Truncated image data")
+        part.finish()
+    except binascii.Error as e:
+        part.abort()
+        raise InvalidImage(f"Invalid base64: {e}")
+    except BaseException:
+        part.abort()
+        raise
+    return part
+
+
+async def save_data_url(data_url: str, max_bytes: int = UPLOAD_MAX_FILE_BYTES) -> str:
+    """Store a data:image/...;base64 photo; returns its /api/uploads URL.
+    Raises InvalidImage if it doesn't decode to a supported image, 413 if too large."""
+    part = await asyncio.to_thread(_decode_data_url, data_url, max_bytes)
+    return await photo_store.store(part)
+
+
+async def _ingest(photo: str) -> str:
+    if is_data_url(photo):
+        return await save_data_url(photo)
+    await photo_store.retain(photo)
+    return photo
+
+
+async def ingest_photos(photos: List[str]) -> List[str]:
+    """Store the data-URL photos of one request in parallel, keeping their order.
+    Other entries (already-stored URLs) pass through and gain a reference; photos
+    that fail to decode are logged and dropped, while an oversized photo fails
+    the whole request (413)."""
+    photos = [photo for photo in photos if photo]
+    results = await asyncio.gather(*(_ingest(photo) for photo in photos), return_exceptions=True)
+
+    rejected = next((r for r in results if isinstance(r, HTTPException)), None)
+    if rejected is not None:
+        await photo_store.release([r for r in results if isinstance(r, str)])
+        raise rejected
+
+    saved = []
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(f"Error saving photo: {result}")
+        else:
+            saved.append(result)
+    return saved
+
+
+def diff_photos(old: List[str], incoming: List[str]) -> Tuple[List[str], List[str], List[str]]:
+    """Split a sighting's new photo list into (kept, added, removed) against its
+    current one. Each photo slot holds its own reference and a URL may fill
+    several slots, so the lists are compared as multisets: `added` gains one
+    reference per occurrence and `removed` drops one per occurrence."""
+    unclaimed = Counter(old)
+    kept, added = [], []
+    for photo in incoming:
+        if unclaimed[photo] > 0:
+            unclaimed[photo] -= 1
+            kept.append(photo)
+        else:
+            added.append(photo)
+    # Files from before content addressing have no reference count; releasing
+    # one unlinks it, so it can only go once no slot keeps it
+    removed = [photo for photo in unclaimed.elements() if blob_id(photo) or photo not in kept]
+    return kept, added, removed
+
+
+class _RequestTooLarge(Exception):
+    pass
+
+
+class UploadLimitMiddleware:
+    """Rejects multipart requests larger than max_bytes with 413: up front when
+    Content-Length says so, otherwise as soon as the streamed body passes it."""
+
+    def __init__(self, app, max_bytes: int = UPLOAD_MAX_REQUEST_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        if not headers.get(b"content-type", b"").startswith(b"multipart/form-data"):
+            return await self.app(scope, receive, send)
+
+        reject = JSONResponse(status_code=413, content={"detail": _too_large(self.max_bytes).detail})
+        content_length = headers.get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            return await reject(scope, receive, send)
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    raise _RequestTooLarge()
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            if exceeded:
+                # The body parser turns our exception into its own error response; replace it
+                if message["type"] == "http.response.start" and not response_started:
+                    response_started = True
+                    await reject(scope, receive, send)
+                return
+            response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except _RequestTooLarge:
+            if not response_started:
+                await reject(scope, receive, send)
+        if exceeded:
+            logger.warning(f"Rejected {scope['path']}: body over {self.max_bytes} bytes")
@@ -1,14 +1,35 @@
-import React from 'react';
-import { stats } from '../data/mockData';
+import React, { useState, useEffect } from 'react';
+import { stats as fallbackStats } from '../data/mockData';
+import safeFetch from '../lib/safeFetch';
+
+const API = '/api';
 
 const StatsSection = () => {
+  const [stats, setStats] = useState(fallbackStats);
+
+  // Live platform totals; the static tiles stay until (and unless) they arrive
+  useEffect(() => {
+    safeFetch(`${API}/public/stats`)
+      .then(res => (res.ok ? res.json() : null))
+      .then(data => {
+        if (data && data.total_sightings > 0) {
+          setStats([
+            { value: data.total_sightings.toLocaleString(), label: 'SIGHTINGS LOGGED' },
+            { value: data.total_users.toLocaleString(), label: 'TRAINSPOTTERS' },
+            fallbackStats[2],
+          ]);
+        }
+      })
+      .catch(() => {});
+  }, []);
+
   return (
     <section className="bg-[#0f0f10] py-12 border-t border-gray-800">
       <div className="max-w-6xl mx-auto px-6">
         <div className="grid grid-cols-1 md:grid-cols-3 gap-8 text-center">
           {stats.map((stat, index) => (
             <div key={index} className="flex flex-col items-center">
-              <span 
+              <span
                 className={`text-3xl md:text-4xl font-bold mb-2 ${
                   index === 0 ? 'text-orange-500' : 'text-white'
                 }`}